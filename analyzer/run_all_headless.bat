@@ -23,7 +23,7 @@ echo The browser will run in the background.
 echo.
 pause
 
-python win_mortal_analyzer_2captcha.py --limit 99999 --headless
+python win_mortal_analyzer_2captcha.py --queue --headless --backend sqlite
 
 echo.
 echo ============================================================
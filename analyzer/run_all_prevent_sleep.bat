@@ -31,7 +31,7 @@ echo.
 echo Starting analysis...
 echo.
 
-python win_mortal_analyzer_2captcha.py --limit 99999 --headless
+python win_mortal_analyzer_2captcha.py --queue --headless --backend sqlite
 
 echo.
 echo ============================================================
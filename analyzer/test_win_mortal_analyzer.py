@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+win_mortal_analyzer_2captcha.py 的测试（不需要浏览器）：结果日志和 CSV 快照在写入中途被杀或文件被占用时不丢失、不损坏，
+评审 JSON 下载按实际发生的次数统计重试，逐决策数据集的索引、小分片合并和缺失字段，
+工作队列的领取顺序、租约、失败退避以及与爬虫 paipu_list 的增量同步
+
+用法:
+    python -m unittest test_win_mortal_analyzer -v
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+import win_mortal_analyzer_2captcha as analyzer_module
+from win_mortal_analyzer_2captcha import MortalAnalyzer, journal_path
+
+
+class Killed(BaseException):
+    """模拟进程在某一步被杀：不是 Exception，不会被程序中的 except Exception 吞掉"""
+
+
+def make_result(i):
+    return {'uuid': f'uuid-{i}', 'start_time': f'2024-01-01 00:{i:02d}', 'score': '25000', 'rank': '2',
+            'room': 'Jade', 'rating': '90.5', 'match_rate': '75.0', 'matches': '30', 'total': '40',
+            'paipu_url': f'paipu-{i}', 'report_url': f'report-{i}'}
+
+
+class ResultJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # 相对路径（评审缓存、指标文件等）都解析到临时目录，不碰项目的 data/
+        patcher = mock.patch.object(analyzer_module, 'project_path',
+                                    lambda path: path if os.path.isabs(path) else os.path.join(self.tmp_dir, path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.output = os.path.join(self.tmp_dir, 'data', 'mortal_results_temp.csv')
+        self.journal = journal_path(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def reload(self):
+        analyzer = MortalAnalyzer()
+        analyzer.load_existing_results(self.output)
+        return analyzer
+
+    def save(self, analyzer, result):
+        """与分析时相同：结果加入内存并追加到日志"""
+        analyzer.results.append(result)
+        analyzer.existing_uuids.add(result['uuid'])
+        analyzer.append_result(result, self.output)
+
+    def read_csv_uuids(self):
+        with open(self.output, 'r', encoding='utf-8') as f:
+            return [row['uuid'] for row in csv.DictReader(f)]
+
+    def test_truncated_journal_line_is_skipped_and_not_glued(self):
+        analyzer = MortalAnalyzer()
+        self.save(analyzer, make_result(0))
+        # 写到一半被杀：最后一行没有换行符
+        line = json.dumps(make_result(1), ensure_ascii=False)
+        with open(self.journal, 'a', encoding='utf-8') as f:
+            f.write(line[:len(line) // 2])
+
+        analyzer = self.reload()
+        self.assertEqual(analyzer.existing_uuids, {'uuid-0'})
+        self.assertEqual(analyzer.journal_count, 1)
+
+        self.save(analyzer, make_result(2))
+        with open(self.journal, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])['uuid'], 'uuid-2')
+
+        analyzer = self.reload()
+        self.assertEqual(analyzer.existing_uuids, {'uuid-0', 'uuid-2'})
+        self.assertEqual(analyzer.journal_count, 2)
+
+    def test_killed_before_replace_keeps_old_csv_and_journal(self):
+        analyzer = MortalAnalyzer()
+        for i in range(3):
+            self.save(analyzer, make_result(i))
+        analyzer.save_results(self.output)
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertEqual(self.read_csv_uuids(), ['uuid-0', 'uuid-1', 'uuid-2'])
+
+        analyzer = self.reload()
+        for i in range(3, 6):
+            self.save(analyzer, make_result(i))
+        with mock.patch.object(analyzer_module.os, 'replace', side_effect=Killed):
+            with self.assertRaises(Killed):
+                analyzer.save_results(self.output)
+
+        # 旧快照完好，日志仍在，重放后得到全部结果
+        self.assertEqual(self.read_csv_uuids(), ['uuid-0', 'uuid-1', 'uuid-2'])
+        self.assertTrue(os.path.exists(self.journal))
+        analyzer = self.reload()
+        self.assertEqual(analyzer.existing_uuids, {f'uuid-{i}' for i in range(6)})
+        self.assertEqual(analyzer.journal_count, 3)
+        self.assertEqual(analyzer.results[5]['report_url'], 'report-5')
+
+        # 下一次合并覆盖掉残留的临时文件
+        analyzer.save_results(self.output)
+        self.assertEqual(self.read_csv_uuids(), [f'uuid-{i}' for i in range(6)])
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_locked_csv_does_not_rewrite_every_game(self):
+        analyzer = MortalAnalyzer()
+        replaced = []
+
+        def locked_replace(src, dst):
+            replaced.append(dst)
+            raise PermissionError(dst)
+
+        with mock.patch.object(analyzer_module.os, 'replace', side_effect=locked_replace), \
+                mock.patch('builtins.print') as printed:
+            for i in range(analyzer_module.RESULT_COMPACT_EVERY * 2 + 1):
+                analyzer.results.append(make_result(i % 60))
+                analyzer.persist_result(make_result(i % 60), self.output)
+        # 每积累 RESULT_COMPACT_EVERY 局才尝试一次，警告只打印一次
+        self.assertEqual(len(replaced), 2)
+        locked = [c for c in printed.call_args_list if '被占用' in str(c)]
+        self.assertEqual(len(locked), 1)
+        self.assertTrue(os.path.exists(self.journal))
+
+    def test_journal_count_resets_when_journal_cannot_be_removed(self):
+        analyzer = MortalAnalyzer()
+        self.save(analyzer, make_result(0))
+        with mock.patch.object(analyzer_module.os, 'remove', side_effect=PermissionError('locked')):
+            analyzer.save_results(self.output)
+        self.assertEqual(analyzer.journal_count, 0)
+        self.assertEqual(self.read_csv_uuids(), ['uuid-0'])
+        # 未删除的日志重放后不会产生重复结果
+        self.assertEqual([r['uuid'] for r in self.reload().results], ['uuid-0'])
+
+    def test_csv_edited_then_sqlite_run_keeps_edits(self):
+        # sqlite 后端分析并导出
+        analyzer = MortalAnalyzer(backend='sqlite')
+        analyzer.sync_store(self.output)
+        for i in range(3):
+            analyzer.persist_result(make_result(i), self.output)
+        analyzer.flush_results(self.output)
+        analyzer.store.close()
+
+        # csv 后端改动了 CSV（如 --reextract）并新增一局
+        analyzer = self.reload()
+        analyzer.results[1]['rating'] = '95.0'
+        self.save(analyzer, make_result(3))
+        analyzer.save_results(self.output)
+
+        # 下一次 sqlite 运行：改动和新增都进入数据库，导出时不会被旧值覆盖
+        analyzer = MortalAnalyzer(backend='sqlite')
+        with mock.patch('builtins.print') as printed:
+            analyzer.sync_store(self.output)
+        self.assertIn('导入 1 条新结果、更新 1 条已有结果', str(printed.call_args_list))
+        self.assertEqual(len(analyzer.store), 4)
+        self.assertEqual({row['uuid']: row['rating'] for row in analyzer.store.rows()},
+                         {'uuid-0': 90.5, 'uuid-1': 95.0, 'uuid-2': 90.5, 'uuid-3': 90.5})
+        analyzer.store.export_csv(self.output)
+        analyzer.store.close()
+        with open(self.output, 'r', encoding='utf-8') as f:
+            ratings = {row['uuid']: row['rating'] for row in csv.DictReader(f)}
+        self.assertEqual(ratings['uuid-1'], '95.0')
+
+
+class ReviewSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        # 每个路径依次返回的状态码，用完后返回 200
+        self.plan = {}
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                statuses = test.plan.get(self.path, [])
+                status = statuses.pop(0) if statuses else 200
+                body = b'{}'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        patcher = mock.patch.object(analyzer_module, 'FETCH_BACKOFF', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.http = analyzer_module.ReviewSession()
+        self.addCleanup(self.http.close)
+
+    def test_success_after_one_retry(self):
+        self.plan['/a'] = [503]
+        self.http.get(self.base + '/a')
+        self.assertEqual(self.http.stats['retries'], 1)
+        self.assertEqual(self.http.stats['failed'], 0)
+
+    def test_exhausted_retries_are_counted_from_history(self):
+        self.plan['/a'] = [503] * analyzer_module.FETCH_RETRIES
+        with self.assertRaises(requests.RequestException) as caught:
+            self.http.get(self.base + '/a')
+        self.assertEqual(caught.exception.attempts, analyzer_module.FETCH_RETRIES)
+        self.assertEqual(self.http.stats['retries'], analyzer_module.FETCH_RETRIES - 1)
+
+    def test_unretried_error_counts_no_retries(self):
+        # 无效的 URL 在发出请求前就失败，不经过重试
+        with self.assertRaises(requests.RequestException) as caught:
+            self.http.get('http://')
+        self.assertEqual(caught.exception.attempts, 1)
+        self.assertEqual(self.http.stats['retries'], 0)
+        self.assertEqual(self.http.stats['failed'], 1)
+
+
+def make_review(entries):
+    return {'review': {'kyokus': [{'kyoku': 0, 'honba': 0, 'entries': entries}]}}
+
+
+def make_entry(actual_index=1, is_equal=False):
+    entry = {'junme': 3, 'tiles_left': 60, 'is_equal': is_equal,
+             'actual': {'type': 'dahai', 'pai': '1m'}, 'expected': {'type': 'dahai', 'pai': '9p'},
+             'details': [{'prob': 0.75}, {'prob': 0.25}]}
+    if actual_index is not None:
+        entry['actual_index'] = actual_index
+    return entry
+
+
+@unittest.skipUnless(analyzer_module.PYARROW_AVAILABLE, '需要 pyarrow')
+class DecisionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.dir = os.path.join(self.tmp_dir, 'decisions')
+
+    def open_store(self, run_id='run'):
+        return analyzer_module.DecisionStore(run_id, self.dir)
+
+    def parts(self):
+        return sorted(name for name in os.listdir(self.dir) if name.endswith('.parquet'))
+
+    def read_uuids(self):
+        return sorted(analyzer_module.pq.read_table(self.dir).column('uuid').to_pylist())
+
+    def test_missing_actual_index_is_null_not_top_choice(self):
+        store = self.open_store()
+        store.add_game('uuid-0', make_review([make_entry(1), make_entry(None, is_equal=True)]))
+        store.flush()
+        rows = analyzer_module.pq.read_table(self.dir).to_pylist()
+        self.assertAlmostEqual(rows[0]['prob_gap'], 0.5)
+        self.assertEqual(rows[0]['is_match'], False)
+        self.assertEqual((rows[1]['actual_prob'], rows[1]['prob_gap'], rows[1]['is_match']), (None, None, None))
+        self.assertAlmostEqual(rows[1]['expected_prob'], 0.75)
+
+    def test_known_uuids_come_from_index_without_reading_parts(self):
+        store = self.open_store()
+        for i in range(3):
+            store.add_game(f'uuid-{i}', make_review([make_entry()]))
+            store.flush()
+        with mock.patch.object(analyzer_module.pq, 'read_table') as read_table:
+            store = self.open_store('run2')
+        read_table.assert_not_called()
+        self.assertEqual(store.known, {'uuid-0', 'uuid-1', 'uuid-2'})
+        self.assertEqual(store.add_game('uuid-1', make_review([make_entry()])), 0)
+
+    def test_parts_missing_from_index_are_scanned_once(self):
+        store = self.open_store()
+        store.add_game('uuid-0', make_review([make_entry()]))
+        store.flush()
+        os.remove(store.index_path)  # 旧版本写的数据集没有索引
+        self.assertEqual(self.open_store('run2').known, {'uuid-0'})
+        with mock.patch.object(analyzer_module.pq, 'read_table') as read_table:
+            self.assertEqual(self.open_store('run3').known, {'uuid-0'})
+        read_table.assert_not_called()
+
+    def test_small_parts_are_compacted(self):
+        with mock.patch.object(analyzer_module, 'DECISIONS_COMPACT_PARTS', 3):
+            for i in range(3):
+                store = self.open_store(f'run{i}')
+                store.add_game(f'uuid-{i}', make_review([make_entry(), make_entry()]))
+                store.flush()
+        self.assertEqual(len(self.parts()), 1)
+        self.assertEqual(self.read_uuids(), ['uuid-0', 'uuid-0', 'uuid-1', 'uuid-1', 'uuid-2', 'uuid-2'])
+        self.assertEqual(self.open_store('run3').known, {'uuid-0', 'uuid-1', 'uuid-2'})
+        with open(store.index_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+
+    def test_compaction_interrupted_before_removing_sources(self):
+        for i in range(3):
+            store = self.open_store(f'run{i}')
+            store.add_game(f'uuid-{i}', make_review([make_entry()]))
+            store.flush()
+        with mock.patch.object(analyzer_module, 'DECISIONS_COMPACT_PARTS', 3), \
+                mock.patch.object(analyzer_module.os, 'remove', side_effect=Killed):
+            with self.assertRaises(Killed):
+                self.open_store('run3').flush()
+        self.assertEqual(len(self.parts()), 4)  # 新分片已写出，旧分片还在
+
+        # 下次打开时删掉被替代的旧分片，数据不重复
+        store = self.open_store('run4')
+        self.assertEqual(self.parts(), ['part-run3-0000.parquet'])
+        self.assertEqual(self.read_uuids(), ['uuid-0', 'uuid-1', 'uuid-2'])
+        self.assertEqual(store.known, {'uuid-0', 'uuid-1', 'uuid-2'})
+        self.assertEqual(self.open_store('run5').part_uuids, {'part-run3-0000.parquet': ['uuid-0', 'uuid-1', 'uuid-2']})
+
+
+PAIPU_FIELDS = ['uuid', 'start_time', 'score', 'rank', 'room', 'paipu_url']
+
+
+def make_paipu(i, day=1):
+    return {'uuid': f'uuid-{i}', 'start_time': f'2024-01-{day:02d} 00:{i:02d}', 'score': '25000', 'rank': '2',
+            'room': 'Jade', 'paipu_url': f'paipu-{i}'}
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        patcher = mock.patch.object(analyzer_module, 'project_path',
+                                    lambda path: path if os.path.isabs(path) else os.path.join(self.tmp_dir, path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 队列中的时间都取自 time.time()，测试中手动推进
+        self.now = 1_700_000_000.0
+        patcher = mock.patch.object(analyzer_module.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.snapshot = os.path.join(self.tmp_dir, 'data', 'paipu_list.csv')
+        self.journal = os.path.join(self.tmp_dir, 'data', 'paipu_list.journal.jsonl')
+        os.makedirs(os.path.dirname(self.snapshot))
+        self.queue = analyzer_module.WorkQueue()
+        self.addCleanup(self.queue.close)
+
+    def write_snapshot(self, paipus):
+        """与爬虫合并日志时相同：写临时文件再替换"""
+        tmp_path = self.snapshot + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PAIPU_FIELDS)
+            writer.writeheader()
+            writer.writerows(paipus)
+        os.replace(tmp_path, self.snapshot)
+
+    def append_journal(self, paipus, tail=b''):
+        with open(self.journal, 'ab') as f:
+            for paipu in paipus:
+                f.write((json.dumps(paipu, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.write(tail)
+
+    def claim_all(self, queue=None):
+        """依次领取直到没有可领取的局，返回 uuid 列表"""
+        queue = queue or self.queue
+        claimed = []
+        while True:
+            paipu = queue.claim()
+            if paipu is None:
+                return claimed
+            claimed.append(paipu['uuid'])
+
+    def state(self, uuid):
+        return self.queue.conn.execute("SELECT state FROM queue WHERE uuid = ?", (uuid,)).fetchone()[0]
+
+    def test_claim_order_by_priority_and_not_before(self):
+        self.write_snapshot([make_paipu(0, day=1), make_paipu(1, day=3), make_paipu(2, day=2)])
+        self.queue.sync(self.snapshot)
+        paipu = self.queue.claim()
+        self.assertEqual(paipu['uuid'], 'uuid-1')  # 最新的对局先分析
+        self.assertEqual(paipu['paipu_url'], 'paipu-1')
+        # 放回后 60 秒内不能再领取，先领取其余的局
+        self.queue.release('uuid-1', 60)
+        self.assertEqual(self.claim_all(), ['uuid-2', 'uuid-0'])
+        self.now += 61
+        self.assertEqual(self.claim_all(), ['uuid-1'])
+
+    def test_expired_lease_is_reclaimed(self):
+        self.write_snapshot([make_paipu(0)])
+        self.queue.sync(self.snapshot)
+        self.assertEqual(self.claim_all(), ['uuid-0'])
+        self.now += analyzer_module.QUEUE_LEASE - 1
+        self.assertIsNone(self.queue.claim())  # 租约未过期：另一个进程还在分析
+        self.assertEqual(self.queue.counts()['in_flight'], 1)
+        self.now += 2
+        self.assertEqual(self.queue.counts()['ready'], 1)
+        self.assertEqual(self.claim_all(), ['uuid-0'])
+
+    def test_fail_backs_off_then_gives_up(self):
+        self.write_snapshot([make_paipu(0)])
+        self.queue.sync(self.snapshot)
+        for attempt in range(1, analyzer_module.QUEUE_MAX_ATTEMPTS):
+            self.assertEqual(self.claim_all(), ['uuid-0'])
+            self.queue.fail('uuid-0', 'timeout')
+            self.assertEqual(self.state('uuid-0'), 'pending')
+            delay = analyzer_module.QUEUE_RETRY_DELAY * 2 ** (attempt - 1)
+            self.now += delay - 1
+            self.assertIsNone(self.queue.claim())
+            self.now += 1
+        self.assertEqual(self.claim_all(), ['uuid-0'])
+        self.queue.fail('uuid-0', 'timeout')
+        self.assertEqual(self.state('uuid-0'), 'failed')
+        self.now += analyzer_module.QUEUE_RETRY_DELAY * 2 ** analyzer_module.QUEUE_MAX_ATTEMPTS
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.counts()['failed'], 1)
+
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual(self.claim_all(), ['uuid-0'])
+
+    def test_sync_stops_before_partial_last_line(self):
+        self.write_snapshot([make_paipu(0)])
+        line = json.dumps(make_paipu(2), ensure_ascii=False).encode('utf-8')
+        self.append_journal([make_paipu(1)], tail=line[:10])
+        self.assertEqual(sorted(self.queue.sync(self.snapshot)), ['uuid-0', 'uuid-1'])
+        # 爬虫写完这一行后再同步：从上次停下的位置读，不重复、不丢失
+        with open(self.journal, 'ab') as f:
+            f.write(line[10:] + b'\n')
+        self.assertEqual(self.queue.sync(self.snapshot), ['uuid-2'])
+        self.assertEqual(self.queue.sync(self.snapshot), [])
+        self.assertEqual(self.queue.counts()['pending'], 3)
+
+    def test_sync_after_crawler_compacts_and_removes_journal(self):
+        self.write_snapshot([make_paipu(0)])
+        self.append_journal([make_paipu(1)])
+        self.assertEqual(sorted(self.queue.sync(self.snapshot)), ['uuid-0', 'uuid-1'])
+        self.queue.mark_done(['uuid-0'])
+
+        # 合并：新快照包含日志内容，日志删除后又追加了新局
+        self.write_snapshot([make_paipu(0), make_paipu(1)])
+        os.remove(self.journal)
+        self.append_journal([make_paipu(2)])
+        self.assertEqual(self.queue.sync(self.snapshot), ['uuid-2'])
+        self.assertEqual(self.state('uuid-0'), 'done')  # 重新读取快照不改已有局的状态
+
+        # 在替换快照和删除日志之间同步，之后新日志长过了旧的偏移量
+        self.write_snapshot([make_paipu(i) for i in range(3)])
+        self.assertEqual(self.queue.sync(self.snapshot), [])
+        os.remove(self.journal)
+        self.append_journal([make_paipu(3), make_paipu(4)])
+        self.assertEqual(sorted(self.queue.sync(self.snapshot)), ['uuid-3', 'uuid-4'])
+        self.assertEqual(self.queue.counts()['pending'], 4)
+
+    def test_analyzed_uuids_are_marked_done(self):
+        self.write_snapshot([make_paipu(i) for i in range(3)])
+        for backend in ('csv', 'sqlite'):
+            with self.subTest(backend=backend):
+                output = os.path.join(self.tmp_dir, 'data', 'mortal_results_temp.csv')
+                for path in (output, os.path.join(self.tmp_dir, analyzer_module.QUEUE_DB)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                analyzer = MortalAnalyzer(backend=backend)
+                for i in range(2):
+                    analyzer.results.append(make_result(i))
+                analyzer.save_results(output)
+                if analyzer.store is not None:
+                    analyzer.store.close()
+
+                analyzer = MortalAnalyzer(backend=backend)
+                with mock.patch.object(analyzer, 'start_session', side_effect=Killed), \
+                        mock.patch('builtins.print') as printed:
+                    with self.assertRaises(Killed):
+                        analyzer.analyze_queue(self.snapshot)
+                if analyzer.store is not None:
+                    analyzer.store.close()
+                self.assertIn('已有结果标记完成: 2 条', str(printed.call_args_list))
+                queue = analyzer.queue
+                self.assertEqual(queue.counts()['done'], 2)
+                self.assertEqual(self.claim_all(queue), ['uuid-2'])
+                queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ Windows Edge 浏览器自动化 Mortal 牌谱分析器 - 2Captcha 版本
 """
 
 import csv
+import gzip
+import hashlib
 import os
 import re
 import sys
@@ -12,6 +14,11 @@ import time
 import json
 import random
 import io
+import math
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
 
@@ -20,13 +27,17 @@ if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
-# 需要安装: pip install selenium webdriver-manager 2captcha-python
+# 需要安装: pip install requests selenium webdriver-manager 2captcha-python
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
 from selenium import webdriver
 from selenium.webdriver.edge.service import Service
 from selenium.webdriver.edge.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
 
 try:
@@ -37,9 +48,729 @@ except ImportError:
     print("⚠ 2captcha-python 未安装")
     print("  安装方法: pip install 2captcha-python")
 
+# 可选：逐决策数据集（Parquet）需要 pyarrow，未安装时跳过
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# 评审 JSON 缓存目录（相对于项目根目录）：每局完整的评审结果按内容哈希压缩保存，uuid 索引指向对应文件
+REVIEW_CACHE_DIR = "data/review_cache"
+
+# 浏览器配置目录（相对于项目根目录）：静态资源缓存在 cache 子目录，多局之间保持命中；设为 None 则每次用临时配置
+BROWSER_PROFILE_DIR = "data/edge_profile"
+# 通过 CDP 拦截的请求（统计、字体、图片等与提交无关的资源）。
+# 不能拦截 challenges.cloudflare.com，否则 Turnstile 验证码无法加载
+BLOCKED_URL_PATTERNS = [
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*cloudflareinsights.com*',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*', '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.ico', '*.mp3', '*.mp4',
+]
+
+# 页面状态等待的上限（秒）：条件满足立即继续，超时才算失败
+FIELD_WAIT = 5               # 表单字段的值生效
+SCROLL_WAIT = 3              # 提交按钮滚动到视野内
+MANUAL_CAPTCHA_WAIT = 180    # 手动模式等待用户通过验证码
+SUBMIT_BUTTON_WAIT = 30      # 注入 token 后等待提交按钮启用
+REPORT_WAIT = 300            # 提交后等待跳转到 /report/
+REPORT_READY_WAIT = 15       # 结果页出现评审数据地址（?data=）或结果表格
+WAIT_POLL = 0.2              # 检查页面状态的间隔
+RETRY_DELAY = 2              # 验证码失败、点击被遮挡、超时后重试前的等待
+GAME_INTERVAL = 0            # 两局之间的额外间隔（下一局打开页面本身就会等待加载完成）
+
+# 后台下载评审 JSON：浏览器到达结果页后立即开始下一局，下载、解析和缓存在线程池中完成
+FETCH_WORKERS = 2            # 下载线程数
+FETCH_RETRIES = 3            # 每个评审 JSON 最多尝试次数（在后台重试，不阻塞浏览器）
+FETCH_TIMEOUT = 10           # 单次下载超时（秒）
+FETCH_BACKOFF = 1.0          # 重试退避系数：第 n 次重试前等待约 FETCH_BACKOFF * 2^(n-1) 秒（服务器给出 Retry-After 时以其为准）
+FETCH_RETRY_STATUS = (429, 500, 502, 503, 504)
+HTTP_POOL_SIZE = 4           # 与 mjai.ekyu.moe 保持的长连接数上限（不小于 FETCH_WORKERS）
+FETCH_MAX_PENDING = 8        # 等待下载完成的局数上限，超过时浏览器等最早的一局完成再继续
+# 浏览器已离开结果页、评审 JSON 又下载失败的局：记下评审数据地址，下次运行只重新下载，不再重新提交（相对于项目根目录）
+PENDING_FETCH_FILE = "data/review_pending.json"
+PENDING_FETCH_MAX_ATTEMPTS = 3   # 跨运行累计下载失败这么多次后放弃，重新提交分析
+
+# 每局的分阶段用时、重试次数和结果逐行追加到这里（相对于项目根目录），--metrics-summary 汇总
+METRICS_FILE = "data/analyzer_metrics.jsonl"
+# 阶段名（汇总时按此顺序输出）：打开页面、填表、验证码、等提交按钮、等跳转结果页、等结果就绪、下载评审JSON、从HTML提取
+METRIC_PHASES = ['page_load', 'fill_form', 'captcha', 'submit_button', 'report_wait', 'report_ready',
+                 'json_fetch', 'html_extract']
+
+# 逐决策数据集目录（相对于项目根目录）：每局评审 JSON 中的每个决策展开为一行，按批写成 Parquet 分片
+DECISIONS_DIR = "data/review_decisions"
+DECISIONS_FLUSH_GAMES = 200  # 缓冲这么多局后写出一个分片；批次结束时写出剩余部分
+DECISIONS_PART_BYTES = 64 * 1024 * 1024  # 小于此大小的分片算小分片，合并时每个新分片累积到此大小为止
+DECISIONS_COMPACT_PARTS = 8  # 批次结束时小分片达到这么多个就合并
+
+# 持久化工作队列（--queue，相对于项目根目录）：按 uuid 记录每局的状态，优先分析最新的对局
+QUEUE_DB = "data/analyze_queue.db"
+ROOM_PRIORITY_DAYS = {'Throne': 0, 'Jade': 0, 'Gold': 0, 'Unknown': 0}  # 房间权重：相当于对局时间提前/推后的天数
+QUEUE_MAX_ATTEMPTS = 3       # 失败这么多次后标记为 failed，不再自动重试
+QUEUE_RETRY_DELAY = 3600     # 失败后稍后重试：第 n 次失败后等待 QUEUE_RETRY_DELAY * 2^(n-1) 秒
+QUEUE_LEASE = 900            # 领取后的租约（秒）：程序崩溃时，租约过期的局自动回到待分析
+
+# 分析结果字段（CSV 列顺序）
+RESULT_FIELDS = ['uuid', 'start_time', 'score', 'rank', 'room', 'rating', 'match_rate', 'matches', 'total', 'paipu_url', 'report_url']
+# 每局结果先追加到日志（写完即 fsync），积累到这么多条再合并进 CSV 快照；批次结束时总会合并
+RESULT_COMPACT_EVERY = 50
+# --backend sqlite 使用的结果数据库（相对于项目根目录），CSV 只作为导出给可视化模块的文件
+RESULT_DB = "data/mortal_results.db"
+
+
+def project_path(path: str) -> str:
+    """相对路径按项目根目录（analyzer 的上级目录）解析"""
+    if os.path.isabs(path):
+        return path
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(os.path.dirname(script_dir), path)
+
+
+def journal_path(output_path: str) -> str:
+    """结果 CSV 对应的追加日志，如 mortal_results_temp.csv -> mortal_results_temp.journal.jsonl"""
+    return os.path.splitext(output_path)[0] + '.journal.jsonl'
+
+
+def parse_review(data: Dict) -> Dict:
+    """从评审 JSON 计算结果字段（rating、一致率等），在线提取和离线重新提取共用"""
+    review = data.get('review', {})
+    result = {'rating': None, 'match_rate': None, 'matches': None, 'total': None}
+
+    rating_raw = review.get('rating')
+    if rating_raw is not None:
+        result['rating'] = round(rating_raw * 100, 2)
+
+    result['matches'] = review.get('total_matches')
+    result['total'] = review.get('total_reviewed')
+
+    if result['matches'] and result['total']:
+        result['match_rate'] = round(result['matches'] / result['total'] * 100, 2)
+    return result
+
+
+def parse_report_html(content: str) -> Dict:
+    """从结果页 HTML 的表格中提取 rating 和一致率（评审 JSON 不可用时的备用方法）"""
+    result = {'rating': None, 'match_rate': None, 'matches': None, 'total': None}
+
+    rating_match = re.search(r'<td>Rating</td><td>([0-9.]+)</td>', content)
+    if rating_match:
+        result['rating'] = float(rating_match.group(1))
+
+    matches_match = re.search(r'<td>Matches/total</td><td>(\d+)/(\d+)\s*=\s*([0-9.]+)%</td>', content)
+    if matches_match:
+        result['matches'] = int(matches_match.group(1))
+        result['total'] = int(matches_match.group(2))
+        result['match_rate'] = float(matches_match.group(3))
+    return result
+
+
+class ReviewCache:
+    """
+    评审 JSON 的本地缓存
+
+    原始 JSON 以 gzip 压缩，按 sha256 存放在 objects/<前两位>/<哈希>.json.gz（相同内容只存一份），
+    index.jsonl 逐行追加 {uuid, sha256, url, time}，同一 uuid 以最后一行为准
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = project_path(cache_dir or REVIEW_CACHE_DIR)
+        self.index_path = os.path.join(self.cache_dir, 'index.jsonl')
+        self.index = {}
+        self.lock = threading.Lock()  # 后台下载线程会同时写入
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时写了一半的行
+                    self.index[entry['uuid']] = entry
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, uuid):
+        return uuid in self.index
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', digest[:2], f"{digest}.json.gz")
+
+    def put(self, uuid: str, body: bytes, url: str = ''):
+        """保存一局的原始评审 JSON"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.index.get(uuid, {}).get('sha256') == digest:
+                return
+            entry = {'uuid': uuid, 'sha256': digest, 'url': url, 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.index[uuid] = entry
+
+    def get(self, uuid: str) -> Optional[Dict]:
+        """读取一局的评审 JSON，不存在或损坏时返回 None"""
+        entry = self.index.get(uuid)
+        if not entry:
+            return None
+        try:
+            with gzip.open(self._object_path(entry['sha256']), 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+
+def format_action(action: Optional[Dict]) -> str:
+    """把 mjai 动作压缩成一个字符串，如 dahai 5m、pon 5m 5m0m、reach、none"""
+    if not action:
+        return ''
+    parts = [action.get('type', '')]
+    if action.get('pai'):
+        parts.append(action['pai'])
+    if action.get('consumed'):
+        parts.append(''.join(action['consumed']))
+    return ' '.join(parts)
+
+
+class DecisionStore:
+    """
+    逐决策数据集：uuid、kyoku、honba、junme、tiles_left、actual、expected、is_match、
+    actual_prob、expected_prob、prob_gap（Mortal 首选动作与实际动作的概率差）
+
+    每局展开后按列缓冲，积累 DECISIONS_FLUSH_GAMES 局写成一个 Parquet 分片（先写临时文件再替换），
+    内存占用与单局决策数和缓冲局数成正比。每个分片包含的 uuid 记在 _index.jsonl 中，启动时只读索引，
+    不在索引中的分片（旧版本写的或写索引前中断的）才读取 uuid 列并补进索引。
+    批次结束时小分片达到 DECISIONS_COMPACT_PARTS 个就合并，避免每次运行留下一堆小文件
+    """
+
+    SCHEMA = pa.schema([
+        ('uuid', pa.string()), ('kyoku', pa.int16()), ('honba', pa.int16()), ('junme', pa.int16()),
+        ('tiles_left', pa.int16()), ('actual', pa.string()), ('expected', pa.string()), ('is_match', pa.bool_()),
+        ('actual_prob', pa.float32()), ('expected_prob', pa.float32()), ('prob_gap', pa.float32()),
+    ]) if PYARROW_AVAILABLE else None
+
+    def __init__(self, run_id: str, decisions_dir: Optional[str] = None):
+        self.dir = project_path(decisions_dir or DECISIONS_DIR)
+        # 以 _ 开头的文件不会被 pandas.read_parquet / pyarrow 当作数据分片读取
+        self.index_path = os.path.join(self.dir, '_index.jsonl')
+        self.run_id = run_id
+        self.lock = threading.Lock()  # 后台下载线程会同时写入
+        self.columns = {field.name: [] for field in self.SCHEMA}
+        self.buffered_games = 0
+        self.parts = 0
+        self.part_uuids = {}  # 分片文件名 -> 其中的 uuid 列表
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_index()
+        self.known = {uuid for uuids in self.part_uuids.values() for uuid in uuids}
+
+    def _load_index(self):
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时写了一半的行
+                    index[entry['part']] = entry['uuids']
+        names = []
+        for name in sorted(os.listdir(self.dir)):
+            if name.endswith('.parquet'):
+                names.append(name)
+            elif name.startswith('_part-') and name.endswith('.tmp'):
+                os.remove(os.path.join(self.dir, name))  # 中断时写了一半的分片
+        self.part_uuids = {name: index[name] for name in names if name in index}
+        stale = len(self.part_uuids) < len(index)
+        for name in names:
+            path = os.path.join(self.dir, name)
+            if name in index or not os.path.exists(path):
+                continue
+            # 合并后的分片记录了被它替代的分片：合并在删除旧分片前中断时，在这里删掉，避免数据重复
+            metadata = pq.read_schema(path).metadata or {}
+            for replaced in json.loads(metadata.get(b'replaces', b'[]')):
+                stale = stale or replaced in self.part_uuids
+                self.part_uuids.pop(replaced, None)
+                if os.path.exists(os.path.join(self.dir, replaced)):
+                    os.remove(os.path.join(self.dir, replaced))
+            uuids = pq.read_table(path, columns=['uuid']).column('uuid').unique().to_pylist()
+            self._append_index(name, uuids)
+        if stale:
+            self._rewrite_index()  # 去掉已不存在的分片
+
+    def _append_index(self, name: str, uuids: List[str]):
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'part': name, 'uuids': uuids}, ensure_ascii=False) + '\n')
+        self.part_uuids[name] = uuids
+
+    def _rewrite_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for name, uuids in self.part_uuids.items():
+                f.write(json.dumps({'part': name, 'uuids': uuids}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.index_path)
+
+    def _next_part(self) -> str:
+        name = f"part-{self.run_id}-{self.parts:04d}.parquet"
+        self.parts += 1
+        return name
+
+    def add_game(self, uuid: str, data: Dict) -> int:
+        """展开一局的评审 JSON 并缓冲，返回决策数；已写入过的 uuid 跳过"""
+        with self.lock:
+            if uuid in self.known:
+                return 0
+            columns = self.columns
+            count = 0
+            for kyoku in data.get('review', {}).get('kyokus', []):
+                for entry in kyoku.get('entries', []):
+                    details = entry.get('details') or []
+                    # 没有 actual_index 时不知道实际动作是哪一个：概率、概率差和是否一致都留空，不当作选了首选
+                    actual_index = entry.get('actual_index')
+                    expected_prob = details[0].get('prob') if details else None
+                    actual_prob = (details[actual_index].get('prob')
+                                   if actual_index is not None and actual_index < len(details) else None)
+                    columns['uuid'].append(uuid)
+                    columns['kyoku'].append(kyoku.get('kyoku'))
+                    columns['honba'].append(kyoku.get('honba'))
+                    columns['junme'].append(entry.get('junme'))
+                    columns['tiles_left'].append(entry.get('tiles_left'))
+                    columns['actual'].append(format_action(entry.get('actual')))
+                    columns['expected'].append(format_action(entry.get('expected')))
+                    columns['is_match'].append(entry.get('is_equal') if actual_index is not None else None)
+                    columns['actual_prob'].append(actual_prob)
+                    columns['expected_prob'].append(expected_prob)
+                    columns['prob_gap'].append(expected_prob - actual_prob
+                                               if expected_prob is not None and actual_prob is not None else None)
+                    count += 1
+            self.known.add(uuid)
+            self.buffered_games += 1
+            if self.buffered_games >= DECISIONS_FLUSH_GAMES:
+                self._flush()
+            return count
+
+    def flush(self):
+        """把缓冲的决策写成一个分片（批次结束时调用），小分片多了就合并"""
+        with self.lock:
+            self._flush()
+            self._compact()
+
+    def _flush(self):
+        if not self.columns['uuid']:
+            self.buffered_games = 0
+            return
+        table = pa.table(self.columns, schema=self.SCHEMA)
+        name = self._next_part()
+        tmp_path = os.path.join(self.dir, f"_{name}.tmp")
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, os.path.join(self.dir, name))
+        self._append_index(name, list(dict.fromkeys(self.columns['uuid'])))
+        self.columns = {field.name: [] for field in self.SCHEMA}
+        self.buffered_games = 0
+
+    def _compact(self):
+        """
+        把小分片逐个读入、写进新分片，每个新分片累积到 DECISIONS_PART_BYTES 为止（内存中只有一个小分片）。
+        新分片的元数据记录被替代的分片名，先写新分片，再删旧分片，最后重写索引；中途中断时下次启动补完
+        """
+        small = [name for name in self.part_uuids
+                 if os.path.getsize(os.path.join(self.dir, name)) < DECISIONS_PART_BYTES]
+        if len(small) < DECISIONS_COMPACT_PARTS:
+            return
+        groups, size = [[]], 0
+        for name in small:
+            if size >= DECISIONS_PART_BYTES:
+                groups.append([])
+                size = 0
+            groups[-1].append(name)
+            size += os.path.getsize(os.path.join(self.dir, name))
+        for group in groups:
+            if len(group) < 2:
+                continue
+            name = self._next_part()
+            path = os.path.join(self.dir, name)
+            tmp_path = os.path.join(self.dir, f"_{name}.tmp")
+            schema = self.SCHEMA.with_metadata({'replaces': json.dumps(group)})
+            with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+                for source in group:
+                    writer.write_table(pq.read_table(os.path.join(self.dir, source)).cast(schema))
+            os.replace(tmp_path, path)
+            uuids = []
+            for source in group:
+                os.remove(os.path.join(self.dir, source))
+                uuids.extend(self.part_uuids.pop(source))
+            self.part_uuids[name] = uuids
+        self._rewrite_index()
+
+
+class HistoryRetry(Retry):
+    """重试用尽（或遇到不可重试的错误）时，把已发生的重试记录挂到抛出的异常上：urllib3 抛出异常后不再保留 Retry 对象"""
+
+    def increment(self, *args, **kwargs):
+        try:
+            return super().increment(*args, **kwargs)
+        except Exception as e:
+            e.retry_history = self.history
+            raise
+
+
+def failed_retries(error: Exception) -> int:
+    """requests 异常对应的重试次数：requests 把 urllib3 的异常包装为第一个参数"""
+    cause = error.args[0] if error.args else None
+    return len(getattr(cause, 'retry_history', getattr(error, 'retry_history', ())))
+
+
+class ReviewSession:
+    """
+    评审 JSON 下载共用的 HTTP 会话：长连接池、gzip/br 压缩、按 FETCH_RETRIES 自动重试
+
+    统计请求数、新建连接数（即 TCP/TLS 握手次数）、网络传输字节数和解压后字节数
+    """
+
+    def __init__(self):
+        self.stats = {'requests': 0, 'failed': 0, 'connections': 0, 'wire_bytes': 0, 'body_bytes': 0, 'retries': 0}
+        self.lock = threading.Lock()
+        retry = HistoryRetry(total=FETCH_RETRIES - 1, backoff_factor=FETCH_BACKOFF, status_forcelist=FETCH_RETRY_STATUS,
+                      allowed_methods=['GET'], respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(HTTP_POOL_SIZE, FETCH_WORKERS), max_retries=retry)
+        self._count_connections(adapter)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 安装了 brotli 时包含 br
+        self.session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+
+    def _count_connections(self, adapter: HTTPAdapter):
+        """替换连接池类，每新建一个连接计数一次"""
+        stats, lock = self.stats, self.lock
+        manager = adapter.poolmanager
+        counting = {}
+        for scheme, pool_class in manager.pool_classes_by_scheme.items():
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    with lock:
+                        stats['connections'] += 1
+                    return super()._new_conn()
+            counting[scheme] = CountingPool
+        manager.pool_classes_by_scheme = counting
+
+    def get(self, url: str) -> requests.Response:
+        """GET 并读完响应体；失败时抛出异常，异常的 attempts 属性为实际尝试次数"""
+        try:
+            response = self.session.get(url, timeout=FETCH_TIMEOUT)
+        except requests.RequestException as e:
+            retried = failed_retries(e)
+            e.attempts = retried + 1
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['failed'] += 1
+                self.stats['retries'] += retried
+            raise
+        body = response.content
+        retries = response.raw.retries
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['wire_bytes'] += response.raw.tell()
+            self.stats['body_bytes'] += len(body)
+            self.stats['retries'] += len(retries.history) if retries else 0
+        return response
+
+    def summary(self) -> str:
+        stats = self.stats
+        return (f"评审JSON下载: {stats['requests']} 次请求（失败 {stats['failed']}），新建连接 {stats['connections']} 次，"
+                f"传输 {stats['wire_bytes'] / 1024:.0f}KB（解压后 {stats['body_bytes'] / 1024:.0f}KB），"
+                f"重试 {stats['retries']} 次")
+
+    def close(self):
+        self.session.close()
+
+
+class SqliteResultStore:
+    """
+    分析结果的 SQLite 存储：uuid 唯一索引、start_time 索引，WAL 模式
+
+    查询未分析的 uuid 只需一次集合差查询，不必每次启动把所有结果读进内存；
+    export_csv 按原有 CSV 格式导出，可视化模块照常读取
+    """
+
+    COLUMN_TYPES = {'score': 'INTEGER', 'rank': 'INTEGER', 'rating': 'REAL', 'match_rate': 'REAL',
+                    'matches': 'INTEGER', 'total': 'INTEGER'}
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = project_path(db_path or RESULT_DB)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ', '.join(f"{name} {self.COLUMN_TYPES.get(name, 'TEXT')}" for name in RESULT_FIELDS)
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, {columns})")
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_results_uuid ON results (uuid)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_start_time ON results (start_time)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _values(result: Dict) -> List:
+        # CSV 读入的空字符串按 NULL 保存，数值列才能按类型比较和统计
+        return [None if result.get(name) in (None, '') else result.get(name) for name in RESULT_FIELDS]
+
+    def add_many(self, results: List[Dict], replace: bool = True) -> int:
+        """写入结果；replace 为 False 时跳过已有的 uuid。返回实际写入的条数（内容相同的已有结果不计）"""
+        placeholders = ', '.join('?' for _ in RESULT_FIELDS)
+        if replace:
+            names = [name for name in RESULT_FIELDS if name != 'uuid']
+            updates = ', '.join(f"{name} = excluded.{name}" for name in names)
+            changed = ' OR '.join(f"{name} IS NOT excluded.{name}" for name in names)
+            sql = (f"INSERT INTO results ({', '.join(RESULT_FIELDS)}) VALUES ({placeholders}) "
+                   f"ON CONFLICT (uuid) DO UPDATE SET {updates} WHERE {changed}")
+        else:
+            sql = f"INSERT OR IGNORE INTO results ({', '.join(RESULT_FIELDS)}) VALUES ({placeholders})"
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(sql, (self._values(result) for result in results))
+            return self.conn.total_changes - before
+
+    def add(self, result: Dict):
+        """写入一局结果（事务提交后即落盘）"""
+        self.add_many([result])
+
+    def __contains__(self, uuid: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM results WHERE uuid = ?", (uuid,)).fetchone() is not None
+
+    def pending_uuids(self, uuids: List[str]) -> set:
+        """给定的 uuid 中尚未分析的部分"""
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS input_uuids (uuid TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM input_uuids")
+            self.conn.executemany("INSERT OR IGNORE INTO input_uuids (uuid) VALUES (?)", ((u,) for u in uuids))
+        rows = self.conn.execute("SELECT uuid FROM input_uuids EXCEPT SELECT uuid FROM results")
+        return {row[0] for row in rows}
+
+    def rows(self):
+        """按写入顺序逐行读取全部结果"""
+        cursor = self.conn.execute(f"SELECT {', '.join(RESULT_FIELDS)} FROM results ORDER BY id")
+        for row in cursor:
+            yield dict(zip(RESULT_FIELDS, row))
+
+    def summary(self) -> Dict:
+        """结果条数、平均 Rating 和平均一致率"""
+        count, rating, match_rate = self.conn.execute(
+            "SELECT COUNT(*), AVG(rating), AVG(match_rate) FROM results").fetchone()
+        return {'count': count, 'rating': rating, 'match_rate': match_rate}
+
+    def export_csv(self, output_path: str):
+        """按原有 CSV 格式导出（先写临时文件再替换）"""
+        output_path = project_path(output_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows())
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.replace(tmp_path, output_path)
+        except PermissionError:
+            os.remove(tmp_path)
+            print(f"⚠ {output_path} 被占用（请关闭 Excel 等程序），结果已保存在数据库中，稍后再导出")
+            return False
+        print(f"✓ 结果已导出到: {output_path}")
+        return True
+
+
+class WorkQueue:
+    """
+    分析任务队列（SQLite）：每局一行，状态为 pending / in_flight / done / failed
+
+    - 领取时按优先级（对局时间 + 房间权重）从新到旧，跳过尚未到重试时间的局
+    - 领取后持有 QUEUE_LEASE 秒租约，崩溃后租约过期自动重新领取
+    - 失败后按指数退避稍后重试，超过 QUEUE_MAX_ATTEMPTS 次标记为 failed
+    - 与 paipu_list 增量同步：快照未变化时只读取日志新追加的部分
+    """
+
+    STATES = ('pending', 'in_flight', 'done', 'failed')
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = project_path(db_path or QUEUE_DB)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS queue (
+                uuid TEXT PRIMARY KEY, paipu_url TEXT, start_time TEXT, score TEXT, rank TEXT, room TEXT,
+                priority REAL, state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0, lease_until REAL, last_error TEXT, updated REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_state_priority ON queue (state, priority)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self.conn.close()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def priority(paipu: Dict) -> float:
+        """优先级：对局时间戳加上房间权重，越大越先分析"""
+        try:
+            timestamp = datetime.strptime(paipu['start_time'][:16], '%Y-%m-%d %H:%M').timestamp()
+        except (KeyError, TypeError, ValueError):
+            timestamp = 0
+        return timestamp + ROOM_PRIORITY_DAYS.get(paipu.get('room'), 0) * 86400
+
+    def _upsert(self, rows) -> List[str]:
+        """写入牌谱信息（已有的只更新信息，不改状态），返回新增的 uuid"""
+        new_uuids = []
+        now = time.time()
+        for row in rows:
+            row = {k: str(v) for k, v in row.items()}
+            values = (row['uuid'], row.get('paipu_url'), row.get('start_time'), row.get('score', ''),
+                      row.get('rank', ''), row.get('room'), self.priority(row), now)
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO queue (uuid, paipu_url, start_time, score, rank, room, priority, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+            if cursor.rowcount:
+                new_uuids.append(row['uuid'])
+            else:
+                self.conn.execute(
+                    "UPDATE queue SET paipu_url = ?, start_time = ?, score = ?, rank = ?, room = ?, priority = ? "
+                    "WHERE uuid = ?", values[1:7] + (values[0],))
+        return new_uuids
+
+    def sync(self, input_path: str) -> List[str]:
+        """
+        与爬虫的 paipu_list（CSV 快照 + 追加日志）同步，返回新增的 uuid
+
+        快照的修改时间和大小未变时不读取快照；日志只读取上次同步之后追加的部分
+        """
+        journal = os.path.join(os.path.dirname(input_path), 'paipu_list.journal.jsonl')
+        snapshot_stamp = (f"{os.path.getmtime(input_path)}:{os.path.getsize(input_path)}"
+                          if os.path.exists(input_path) else '-')
+        offset = int(self._meta('journal_offset') or 0)
+        journal_size = os.path.getsize(journal) if os.path.exists(journal) else 0
+        # 日志第一行：爬虫合并时先替换快照再删日志，两步之间同步过的话，新日志可能已长过旧偏移量，靠第一行发现
+        journal_head = ''
+        if journal_size:
+            with open(journal, 'rb') as f:
+                journal_head = hashlib.sha1(f.readline()).hexdigest()
+        new_uuids = []
+        with self.conn:
+            # 快照变化（爬虫合并了日志）或日志变短（已被合并删除）时重新读取快照、日志从头读
+            if snapshot_stamp != self._meta('snapshot_stamp') or journal_size < offset:
+                if os.path.exists(input_path):
+                    with open(input_path, 'r', encoding='utf-8') as f:
+                        new_uuids += self._upsert(csv.DictReader(f))
+                offset = 0
+            elif offset and journal_head != self._meta('journal_head'):
+                offset = 0  # 日志被删除后重建：新日志从头读
+            if journal_size > offset:
+                with open(journal, 'rb') as f:
+                    f.seek(offset)
+                    rows = []
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break  # 爬虫正在写的最后一行，下次再读
+                        offset += len(line)
+                        try:
+                            rows.append(json.loads(line))
+                        except ValueError:
+                            continue
+                    new_uuids += self._upsert(rows)
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                  [('snapshot_stamp', snapshot_stamp), ('journal_offset', str(offset)),
+                                   ('journal_head', journal_head)])
+        return new_uuids
+
+    def open_uuids(self) -> List[str]:
+        """尚未完成（pending / in_flight / failed）的 uuid"""
+        return [row[0] for row in self.conn.execute("SELECT uuid FROM queue WHERE state != 'done'")]
+
+    def mark_done(self, uuids):
+        """把已有结果的局标记为 done"""
+        with self.conn:
+            self.conn.executemany("UPDATE queue SET state = 'done', lease_until = NULL, updated = ? WHERE uuid = ?",
+                                  ((time.time(), uuid) for uuid in uuids))
+
+    def claim(self) -> Optional[Dict]:
+        """领取优先级最高的一局（待分析且已到重试时间，或租约已过期），没有时返回 None"""
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT uuid, paipu_url, start_time, score, rank, room FROM queue "
+                "WHERE (state = 'pending' AND not_before <= ?) OR (state = 'in_flight' AND lease_until < ?) "
+                "ORDER BY priority DESC LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE queue SET state = 'in_flight', lease_until = ?, updated = ? WHERE uuid = ?",
+                              (now + QUEUE_LEASE, now, row[0]))
+        return dict(zip(['uuid', 'paipu_url', 'start_time', 'score', 'rank', 'room'], row))
+
+    def done(self, uuid: str):
+        self.mark_done([uuid])
+
+    def fail(self, uuid: str, error: Optional[str] = None):
+        """记录一次失败：未超过次数时稍后重试，否则标记为 failed"""
+        now = time.time()
+        with self.conn:
+            attempts = self.conn.execute("SELECT attempts FROM queue WHERE uuid = ?", (uuid,)).fetchone()[0] + 1
+            if attempts >= QUEUE_MAX_ATTEMPTS:
+                self.conn.execute("UPDATE queue SET state = 'failed', attempts = ?, lease_until = NULL, "
+                                  "last_error = ?, updated = ? WHERE uuid = ?", (attempts, error, now, uuid))
+            else:
+                self.conn.execute("UPDATE queue SET state = 'pending', attempts = ?, lease_until = NULL, "
+                                  "not_before = ?, last_error = ?, updated = ? WHERE uuid = ?",
+                                  (attempts, now + QUEUE_RETRY_DELAY * 2 ** (attempts - 1), error, now, uuid))
+
+    def release(self, uuid: str, delay: float):
+        """放回待分析，delay 秒后才能再次领取（不计入失败次数）"""
+        with self.conn:
+            self.conn.execute("UPDATE queue SET state = 'pending', lease_until = NULL, not_before = ?, updated = ? "
+                              "WHERE uuid = ?", (time.time() + delay, time.time(), uuid))
+
+    def retry_failed(self) -> int:
+        """把 failed 的局重新放回待分析，返回条数"""
+        with self.conn:
+            return self.conn.execute("UPDATE queue SET state = 'pending', attempts = 0, not_before = 0 "
+                                     "WHERE state = 'failed'").rowcount
+
+    def counts(self) -> Dict:
+        """各状态的局数，以及 ready（现在就可以领取的局数）"""
+        counts = dict.fromkeys(self.STATES, 0)
+        counts.update(self.conn.execute("SELECT state, COUNT(*) FROM queue GROUP BY state").fetchall())
+        now = time.time()
+        counts['ready'] = self.conn.execute(
+            "SELECT COUNT(*) FROM queue WHERE (state = 'pending' AND not_before <= ?) "
+            "OR (state = 'in_flight' AND lease_until < ?)", (now, now)).fetchone()[0]
+        return counts
+
 
 class MortalAnalyzer:
-    def __init__(self, headless: bool = False, proxy: Optional[str] = None, captcha_api_key: Optional[str] = None):
+    def __init__(self, headless: bool = False, proxy: Optional[str] = None, captcha_api_key: Optional[str] = None,
+                 backend: str = 'csv', block_resources: bool = True):
         self.base_url = "https://mjai.ekyu.moe/zh-cn.html"
         self.results = []
         self.headless = headless
@@ -47,6 +778,21 @@ class MortalAnalyzer:
         self.driver = None
         self.captcha_api_key = captcha_api_key
         self.existing_uuids = set()  # 用于查重
+        self.block_resources = block_resources
+        self.page_load_times = []  # 每次打开提交页面到表单可用的用时（秒）
+        self.game_times = []  # 每局从打开页面到拿到结果的总用时（秒，仅成功的局）
+        self.run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.fetch_pool = None  # analyze_batch 运行期间的后台下载线程池
+        self.http = ReviewSession()  # 整个批次共用的评审 JSON 下载会话
+        self.decisions = None  # 逐决策数据集（安装了 pyarrow 时在 analyze_batch 中打开）
+        self.queue = None  # analyze_queue 运行期间的工作队列
+        self.pending_fetches = self.load_pending_fetches()  # 只需重新下载评审 JSON 的局
+        self.metrics = self.new_game_metrics()
+        self.journal_count = 0  # 尚未写进 CSV 快照的结果数（csv 后端在日志中，sqlite 后端在数据库中）
+        self.warned = set()  # 已打印过的警告（warn_once）
+        self.review_cache = ReviewCache()
+        # sqlite 后端：结果写入数据库，mortal_results_temp.csv 只是定期导出的副本
+        self.store = SqliteResultStore() if backend == 'sqlite' else None
 
         # 初始化 2Captcha solver
         if self.captcha_api_key and TWOCAPTCHA_AVAILABLE:
@@ -85,6 +831,12 @@ class MortalAnalyzer:
             options.add_argument('--disable-images')  # 不加载图片，节省资源
             options.add_argument('--blink-settings=imagesEnabled=false')
 
+        # 持久化配置和磁盘缓存：脚本、样式等静态资源在多局之间保持缓存
+        if BROWSER_PROFILE_DIR:
+            profile_dir = project_path(BROWSER_PROFILE_DIR)
+            options.add_argument(f'--user-data-dir={profile_dir}')
+            options.add_argument(f"--disk-cache-dir={os.path.join(profile_dir, 'cache')}")
+
         # 减少日志输出
         options.add_argument('--log-level=3')
         options.add_experimental_option('excludeSwitches', ['enable-logging'])
@@ -114,6 +866,15 @@ class MortalAnalyzer:
             except:
                 pass
 
+        # 通过 CDP 拦截不需要的资源
+        if self.block_resources:
+            try:
+                self.driver.execute_cdp_cmd('Network.enable', {})
+                self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+                print(f"✓ 已拦截 {len(BLOCKED_URL_PATTERNS)} 类非必要资源（统计、字体、图片等）")
+            except Exception as e:
+                print(f"⚠ 资源拦截设置失败（不影响分析）: {e}")
+
         print("✓ Edge 浏览器已启动")
 
     def close_browser(self):
@@ -146,29 +907,101 @@ class MortalAnalyzer:
             print(f"  ✗ 2Captcha 解决失败: {e}")
             return None
 
-    def submit_paipu(self, paipu_url: str, player_id: int = 0, retry_count: int = 0, captcha_retry: int = 0) -> Optional[Dict]:
-        """提交单个牌谱并获取结果"""
+    @staticmethod
+    def new_game_metrics() -> Dict:
+        """一局的指标：各阶段用时、重试次数、提取方式和最后一次错误"""
+        return {'phases': {}, 'retries': {'captcha': 0, 'click': 0, 'timeout': 0, 'fetch': 0},
+                'source': None, 'error': None, 'current': None, 'phase_start': None}
+
+    def begin_phase(self, name: Optional[str] = None):
+        """结束当前阶段（用时累加，重试时同一阶段会经历多次）并开始 name 阶段；name 为 None 时只结束"""
+        now = time.time()
+        metrics = self.metrics
+        if metrics['current']:
+            phases = metrics['phases']
+            phases[metrics['current']] = round(phases.get(metrics['current'], 0) + now - metrics['phase_start'], 3)
+        metrics['current'] = name
+        metrics['phase_start'] = now
+
+    def write_metrics(self, uuid: str, outcome: str, total_time: float, metrics: Optional[Dict] = None):
+        """把一局的指标追加到 METRICS_FILE（默认为当前局）"""
+        if metrics is None:
+            self.begin_phase(None)
+            metrics = self.metrics
+        record = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'run': self.run_id,
+            'uuid': uuid,
+            'outcome': outcome,
+            'total': round(total_time, 3),
+            'phases': metrics['phases'],
+            'retries': metrics['retries'],
+            'source': metrics['source'],
+            'error': metrics['error'],
+        }
+        path = project_path(METRICS_FILE)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"  ⚠ 写入指标失败: {e}", flush=True)
+
+    def wait_for(self, condition, timeout: float):
+        """等待页面状态满足 condition，返回 condition 的结果；超时抛出 TimeoutException"""
+        return WebDriverWait(self.driver, timeout, poll_frequency=WAIT_POLL).until(condition)
+
+    def wait_submit_enabled(self, timeout: float):
+        """等待提交按钮启用（验证码通过），返回按钮；超时返回 None"""
+        def enabled(driver):
+            try:
+                button = driver.find_element(By.CSS_SELECTOR, "button[name='submitBtn']")
+                return button if button.is_enabled() else False
+            except Exception:
+                return False
+        try:
+            return self.wait_for(enabled, timeout)
+        except TimeoutException:
+            return None
+
+    def submit_paipu(self, paipu_url: str, player_id: int = 0, retry_count: int = 0, captcha_retry: int = 0,
+                     uuid: Optional[str] = None) -> Optional[Dict]:
+        """提交单个牌谱并获取结果，uuid 用于缓存评审 JSON"""
         max_retries = 2  # 最多重试2次（点击被遮挡）
         max_captcha_retries = 2  # 验证码最多重试2次
 
         try:
             # 访问页面
+            self.begin_phase('page_load')
+            load_start = time.time()
             self.driver.get(self.base_url)
 
             # 等待页面加载
             wait = WebDriverWait(self.driver, 30)
             url_input = wait.until(EC.presence_of_element_located((By.NAME, "log-url")))
+            load_time = time.time() - load_start
+            self.page_load_times.append(load_time)
+            print(f"  页面加载: {load_time:.2f}秒")
 
-            # 填入牌谱 URL
+            # 填入牌谱 URL，等输入框的值确实生效
+            self.begin_phase('fill_form')
             url_input.clear()
-            time.sleep(0.5)
             url_input.send_keys(paipu_url)
-            time.sleep(0.5)
+            # 只作检查：页面可能会规范化输入的值，超时照常提交，由网站判断是否有效
+            try:
+                self.wait_for(lambda d: (url_input.get_attribute('value') or '').strip() == paipu_url.strip(),
+                              FIELD_WAIT)
+            except TimeoutException:
+                print(f"  ⚠ 输入框的值与牌谱链接不一致，继续提交: {url_input.get_attribute('value')}")
 
             # 选择引擎 (Mortal)
             engine_select = Select(self.driver.find_element(By.NAME, "engine"))
             engine_select.select_by_value("mortal")
-            time.sleep(0.5)
+            try:
+                self.wait_for(lambda d: engine_select.first_selected_option.get_attribute('value') == "mortal",
+                              FIELD_WAIT)
+            except TimeoutException:
+                print("  ⚠ 引擎选择未确认为 mortal，继续提交")
 
             # 勾选显示 rating
             try:
@@ -178,22 +1011,18 @@ class MortalAnalyzer:
             except:
                 pass
 
-            # 滚动到提交按钮区域，确保可见
+            # 滚动到提交按钮区域（立即滚动），等按钮确实进入视野，验证码控件也随之可见
             try:
                 submit_area = self.driver.find_element(By.CSS_SELECTOR, "button[name='submitBtn']")
-                # 滚动到元素位置
-                self.driver.execute_script("arguments[0].scrollIntoView({block: 'center', behavior: 'smooth'});", submit_area)
-                time.sleep(1)
-                # 滚动到页面顶部，避免遮挡
-                self.driver.execute_script("window.scrollTo(0, 0);")
-                time.sleep(0.5)
-                # 再次滚动到按钮，确保在视野中但不被遮挡
                 self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", submit_area)
-                time.sleep(0.5)
+                self.wait_for(lambda d: d.execute_script(
+                    "const r = arguments[0].getBoundingClientRect();"
+                    "return r.top >= 0 && r.bottom <= window.innerHeight;", submit_area), SCROLL_WAIT)
             except:
                 pass
 
             # 使用 2Captcha 解决验证码
+            self.begin_phase('captcha')
             captcha_solved = False  # 标记验证码是否成功解决
 
             if self.solver:
@@ -252,8 +1081,7 @@ class MortalAnalyzer:
                                 token_input
                             )
 
-                            # 等待验证完成
-                            time.sleep(2)
+                            # 验证完成的标志是提交按钮启用，由下面统一等待
 
                         except Exception as e:
                             print(f"  ⚠ 注入 token 失败: {e}")
@@ -261,10 +1089,12 @@ class MortalAnalyzer:
                     else:
                         # 2Captcha 解决失败（超时等）
                         print(f"  ⚠ 验证码解决失败")
+                        self.metrics['error'] = "验证码解决失败"
                         if captcha_retry < max_captcha_retries:
                             print(f"  🔄 重试验证码 ({captcha_retry + 1}/{max_captcha_retries})...")
-                            time.sleep(3)
-                            return self.submit_paipu(paipu_url, player_id, retry_count, captcha_retry + 1)
+                            self.metrics['retries']['captcha'] += 1
+                            time.sleep(RETRY_DELAY)
+                            return self.submit_paipu(paipu_url, player_id, retry_count, captcha_retry + 1, uuid)
                         else:
                             print(f"  ✗ 验证码重试次数已用尽，跳过此牌谱")
                             return None
@@ -275,53 +1105,35 @@ class MortalAnalyzer:
                 print("  >>> 请在浏览器中手动点击验证码框 <<<")
                 print("  >>> 验证码通常在提交按钮上方 <<<")
 
-                max_wait = 180
-                start_time = time.time()
+                if self.wait_submit_enabled(MANUAL_CAPTCHA_WAIT):
+                    print("  ✓ 验证码已通过！")
 
-                while time.time() - start_time < max_wait:
-                    try:
-                        submit_btn = self.driver.find_element(By.CSS_SELECTOR, "button[name='submitBtn']")
-                        if submit_btn.is_enabled():
-                            print("  ✓ 验证码已通过！")
-                            break
-                    except:
-                        pass
-                    time.sleep(1)
-
-            # 检查提交按钮是否可用，最多等待30秒
+            # 检查提交按钮是否可用，最多等待 SUBMIT_BUTTON_WAIT 秒
+            self.begin_phase('submit_button')
             submit_btn = self.driver.find_element(By.CSS_SELECTOR, "button[name='submitBtn']")
             if not submit_btn.is_enabled():
                 print("  ⚠ 提交按钮未启用，等待验证码生效...")
-                wait_start = time.time()
-                max_wait_for_btn = 30  # 最多等待30秒
-
-                while time.time() - wait_start < max_wait_for_btn:
-                    time.sleep(1)
-                    try:
-                        submit_btn = self.driver.find_element(By.CSS_SELECTOR, "button[name='submitBtn']")
-                        if submit_btn.is_enabled():
-                            print("  ✓ 提交按钮已启用")
-                            break
-                    except:
-                        pass
+                submit_btn = self.wait_submit_enabled(SUBMIT_BUTTON_WAIT)
+                if submit_btn:
+                    print("  ✓ 提交按钮已启用")
                 else:
                     # 等待超时，验证码可能失败
-                    print(f"  ✗ 提交按钮等待超时（{max_wait_for_btn}秒）")
+                    print(f"  ✗ 提交按钮等待超时（{SUBMIT_BUTTON_WAIT}秒）")
+                    self.metrics['error'] = "提交按钮等待超时"
                     if captcha_retry < max_captcha_retries:
                         print(f"  🔄 重试验证码 ({captcha_retry + 1}/{max_captcha_retries})...")
-                        time.sleep(2)
-                        return self.submit_paipu(paipu_url, player_id, retry_count, captcha_retry + 1)
+                        self.metrics['retries']['captcha'] += 1
+                        time.sleep(RETRY_DELAY)
+                        return self.submit_paipu(paipu_url, player_id, retry_count, captcha_retry + 1, uuid)
                     else:
                         print(f"  ✗ 验证码重试次数已用尽，跳过此牌谱")
                         return None
 
             # 使用 JavaScript 点击（更可靠，不受页面滚动影响）
+            self.begin_phase('report_wait')
             print("  提交中...")
             try:
-                # 滚动确保按钮在视野中
-                self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", submit_btn)
-                time.sleep(0.3)
-                # 使用 JavaScript 直接点击，避免被遮挡
+                # 使用 JavaScript 直接点击，不依赖按钮是否在视野中，也不会被遮挡
                 self.driver.execute_script("arguments[0].click();", submit_btn)
                 print("  ✓ 已提交")
             except Exception as e:
@@ -329,21 +1141,33 @@ class MortalAnalyzer:
                 # 降级到常规点击
                 submit_btn.click()
 
-            # 等待跳转到结果页面（最多等待5分钟）
+            # 等待跳转到结果页面（最多等待 REPORT_WAIT 秒）
             try:
-                WebDriverWait(self.driver, 300).until(
-                    EC.url_contains("/report/")
-                )
+                self.wait_for(EC.url_contains("/report/"), REPORT_WAIT)
             except Exception as e:
                 error_msg = str(e) if str(e).strip() else "等待结果页面超时"
                 print(f"  ✗ 页面跳转失败: {error_msg}")
                 raise Exception(error_msg)
 
-            # 等待结果加载完成
-            time.sleep(3)
+            # 等待结果可以提取：地址中出现评审数据（?data=），或页面渲染出结果表格
+            self.begin_phase('report_ready')
+            try:
+                self.wait_for(lambda d: "?data=" in d.current_url
+                              or d.find_elements(By.XPATH, "//td[text()='Rating']"), REPORT_READY_WAIT)
+            except TimeoutException:
+                print(f"  ⚠ 结果页 {REPORT_READY_WAIT} 秒内未就绪，仍尝试提取")
 
-            # 提取结果
-            result = self.extract_result()
+            # 提取结果：流水线模式下评审 JSON 交给后台线程下载，浏览器立即开始下一局。
+            # 结果表格已经渲染时先记下 HTML 中的数值，下载失败时用它代替
+            current_url = self.driver.current_url
+            if self.fetch_pool is not None and "?data=" in current_url:
+                json_url = f"https://mjai.ekyu.moe{current_url.split('?data=')[1]}"
+                html = None
+                if self.driver.find_elements(By.XPATH, "//td[text()='Rating']"):
+                    html = parse_report_html(self.driver.page_source)
+                return {'report_url': current_url, 'paipu_url': paipu_url, 'json_url': json_url, 'html': html,
+                        'future': self.fetch_pool.submit(self.fetch_review, json_url, uuid)}
+            result = self.extract_result(uuid)
             result['paipu_url'] = paipu_url
             return result
 
@@ -351,7 +1175,11 @@ class MortalAnalyzer:
             error_str = str(e).strip()
             if not error_str:
                 error_str = "未知错误（可能是网络超时或页面加载失败）"
+            # selenium 的 TimeoutException 消息里不一定含 timeout，统一加上前缀，走下面的超时重试
+            if isinstance(e, TimeoutException):
+                error_str = f"timeout: {error_str}"
             print(f"  错误: {error_str}")
+            self.metrics['error'] = error_str[:200]
 
             # 保存错误截图
             try:
@@ -364,19 +1192,21 @@ class MortalAnalyzer:
             # 如果是点击被遮挡的错误，且未达到重试次数，则重试
             if "click intercepted" in error_str and retry_count < max_retries:
                 print(f"  🔄 检测到点击被遮挡，重试 ({retry_count + 1}/{max_retries})...")
-                time.sleep(2)
-                return self.submit_paipu(paipu_url, player_id, retry_count + 1, captcha_retry)
+                self.metrics['retries']['click'] += 1
+                time.sleep(RETRY_DELAY)
+                return self.submit_paipu(paipu_url, player_id, retry_count + 1, captcha_retry, uuid)
 
             # 如果是超时相关错误，也可以重试
             if ("timeout" in error_str.lower() or "timed out" in error_str.lower()) and retry_count < max_retries:
                 print(f"  🔄 检测到超时，重试 ({retry_count + 1}/{max_retries})...")
-                time.sleep(3)
-                return self.submit_paipu(paipu_url, player_id, retry_count + 1, captcha_retry)
+                self.metrics['retries']['timeout'] += 1
+                time.sleep(RETRY_DELAY)
+                return self.submit_paipu(paipu_url, player_id, retry_count + 1, captcha_retry, uuid)
 
             return None
 
-    def extract_result(self) -> Dict:
-        """从结果页面提取 rating 和一致率"""
+    def extract_result(self, uuid: Optional[str] = None) -> Dict:
+        """从结果页面提取 rating 和一致率，给出 uuid 时把完整的评审 JSON 存入缓存"""
         result = {
             'rating': None,
             'match_rate': None,
@@ -394,43 +1224,25 @@ class MortalAnalyzer:
                 json_url = f"https://mjai.ekyu.moe{json_path}"
 
                 print(f"  正在从JSON获取数据: {json_path}")
+                self.begin_phase('json_fetch')
 
                 try:
-                    import requests
-                    response = requests.get(json_url, timeout=10)
-                    if response.status_code == 200:
-                        data = response.json()
-                        review = data.get('review', {})
-
-                        rating_raw = review.get('rating')
-                        if rating_raw is not None:
-                            result['rating'] = round(rating_raw * 100, 2)
-
-                        result['matches'] = review.get('total_matches')
-                        result['total'] = review.get('total_reviewed')
-
-                        if result['matches'] and result['total']:
-                            result['match_rate'] = round(result['matches'] / result['total'] * 100, 2)
-
-                        print(f"  ✓ Rating: {result['rating']}, 一致率: {result['match_rate']}% ({result['matches']}/{result['total']})")
-                        return result
+                    review, _, attempts = self.fetch_review(json_url, uuid)
+                    self.metrics['retries']['fetch'] += attempts - 1
+                    result.update(review)
+                    print(f"  ✓ Rating: {result['rating']}, 一致率: {result['match_rate']}% ({result['matches']}/{result['total']})")
+                    self.metrics['source'] = 'json'
+                    return result
 
                 except Exception as e:
+                    self.metrics['retries']['fetch'] += getattr(e, 'attempts', 1) - 1
                     print(f"  JSON提取失败: {e}")
                     print(f"  尝试从HTML提取...")
 
             # 方法2: 从HTML提取（备用方法）
-            content = self.driver.page_source
-
-            rating_match = re.search(r'<td>Rating</td><td>([0-9.]+)</td>', content)
-            if rating_match:
-                result['rating'] = float(rating_match.group(1))
-
-            matches_match = re.search(r'<td>Matches/total</td><td>(\d+)/(\d+)\s*=\s*([0-9.]+)%</td>', content)
-            if matches_match:
-                result['matches'] = int(matches_match.group(1))
-                result['total'] = int(matches_match.group(2))
-                result['match_rate'] = float(matches_match.group(3))
+            self.begin_phase('html_extract')
+            self.metrics['source'] = 'html'
+            result.update(parse_report_html(self.driver.page_source))
 
             print(f"  ✓ Rating: {result['rating']}, 一致率: {result['match_rate']}%")
 
@@ -439,57 +1251,242 @@ class MortalAnalyzer:
 
         return result
 
+    def backfill_decisions(self):
+        """把评审 JSON 缓存中尚未展开的局补录进逐决策数据集（不打开浏览器）"""
+        if not PYARROW_AVAILABLE:
+            print("⚠ 未安装 pyarrow，无法生成逐决策数据集（pip install pyarrow）")
+            return
+        start_time = time.time()
+        store = DecisionStore(self.run_id)
+        todo = [uuid for uuid in self.review_cache.index if uuid not in store.known]
+        print(f"评审JSON缓存 {len(self.review_cache)} 局，已展开 {len(store.known)} 局，待补录 {len(todo)} 局", flush=True)
+        decisions = 0
+        for uuid in todo:
+            data = self.review_cache.get(uuid)
+            if data is not None:
+                decisions += store.add_game(uuid, data)
+        store.flush()
+        print(f"✓ 补录 {len(todo)} 局、{decisions} 个决策到 {store.dir}，用时 {time.time() - start_time:.1f} 秒", flush=True)
+
+    def fetch_review(self, json_url: str, uuid: Optional[str] = None):
+        """
+        下载并解析评审 JSON（可在后台线程中运行，不访问浏览器），连接失败和 5xx/429 由会话自动重试
+
+        Returns:
+            (结果字段, 用时秒数, 尝试次数)；重试用尽时抛出异常
+        """
+        start = time.time()
+        response = self.http.get(json_url)
+        response.raise_for_status()
+        data = response.json()
+        review = parse_review(data)
+        retries = response.raw.retries
+        attempt = len(retries.history) + 1 if retries else 1
+
+        if uuid:
+            try:
+                self.review_cache.put(uuid, response.content, json_url)
+            except OSError as e:
+                print(f"  ⚠ 评审JSON缓存失败: {e}", flush=True)
+            if self.decisions is not None:
+                try:
+                    self.decisions.add_game(uuid, data)
+                except Exception as e:
+                    print(f"  ⚠ 逐决策数据写入失败: {e}", flush=True)
+        return review, time.time() - start, attempt
+
+    def finish_game(self, paipu: Dict, result: Optional[Dict], game_time: float, metrics: Dict):
+        """一局的结果就绪后（后台下载完成时）合并牌谱信息、保存并记录指标"""
+        uuid = paipu['uuid']
+        future = result.pop('future', None) if result else None
+        json_url = result.pop('json_url', None) if result else None
+        html = result.pop('html', None) if result else None
+        if future is not None:
+            try:
+                review, fetch_time, attempts = future.result()
+                result.update(review)
+                metrics['phases']['json_fetch'] = round(fetch_time, 3)
+                metrics['retries']['fetch'] += attempts - 1
+                metrics['source'] = 'json'
+            except Exception as e:
+                # 404、JSON 解析错误等不重试，只尝试了 1 次
+                attempts = getattr(e, 'attempts', 1)
+                metrics['retries']['fetch'] += attempts - 1
+                metrics['error'] = f"评审JSON下载失败: {e}"[:200]
+                print(f"  ✗ {uuid} 评审JSON下载失败（共尝试 {attempts} 次）: {e}", flush=True)
+                if html and html['rating'] is not None:
+                    # 浏览器离开前结果表格已渲染：与非流水线模式一样用 HTML 中的数值
+                    result.update(html)
+                    metrics['source'] = 'html'
+                elif self.defer_fetch(paipu, result['report_url'], json_url):
+                    self.write_metrics(uuid, 'failed', game_time, metrics)
+                    return
+                else:
+                    result = None
+
+        self.write_metrics(uuid, 'ok' if result else 'failed', game_time, metrics)
+        if not result:
+            if self.queue is not None:
+                self.queue.fail(uuid, metrics['error'])
+            print(f"  ✗ 分析失败，跳过（用时 {game_time:.1f}秒）", flush=True)
+            return
+
+        if self.pending_fetches.pop(uuid, None) is not None:
+            self.save_pending_fetches()
+        if game_time:  # 只重新下载评审 JSON 的局没有浏览器用时
+            self.game_times.append(game_time)
+        result.update({
+            'uuid': paipu['uuid'],
+            'start_time': paipu['start_time'],
+            'score': paipu['score'],
+            'rank': paipu['rank'],
+            'room': paipu.get('room', 'Unknown'),  # 添加房间信息
+        })
+        self.results.append(result)
+        self.existing_uuids.add(uuid)  # 添加到查重集合
+        self.persist_result(result, "data/mortal_results_temp.csv")
+        if self.queue is not None:
+            self.queue.done(uuid)
+        if future is not None:
+            print(f"  ✓ {uuid} 分析完成（浏览器用时 {game_time:.1f}秒），Rating: {result['rating']}, "
+                  f"一致率: {result['match_rate']}%", flush=True)
+        else:
+            print(f"  ✓ 分析完成（本局用时 {game_time:.1f}秒）", flush=True)
+
+    def load_pending_fetches(self) -> Dict:
+        """读取上次运行中评审 JSON 下载失败、等待重新下载的局（uuid -> 牌谱信息和评审数据地址）"""
+        path = project_path(PENDING_FETCH_FILE)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠ 读取 {path} 失败，这些局将重新分析: {e}", flush=True)
+            return {}
+
+    def save_pending_fetches(self):
+        """写回等待重新下载的局（先写临时文件再替换）"""
+        path = project_path(PENDING_FETCH_FILE)
+        if not self.pending_fetches:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.pending_fetches, f, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def defer_fetch(self, paipu: Dict, report_url: str, json_url: Optional[str]) -> bool:
+        """
+        评审 JSON 下载失败：记下评审数据地址，下次运行只重新下载
+
+        Returns:
+            已记录时返回 True；没有地址或累计失败达到 PENDING_FETCH_MAX_ATTEMPTS 次时返回 False（需要重新提交分析）
+        """
+        uuid = paipu['uuid']
+        entry = self.pending_fetches.pop(uuid, None) or {}
+        attempts = entry.get('attempts', 0) + 1
+        if json_url and attempts < PENDING_FETCH_MAX_ATTEMPTS:
+            self.pending_fetches[uuid] = {'paipu': {k: paipu.get(k) for k in ('uuid', 'paipu_url', 'start_time',
+                                                                              'score', 'rank', 'room')},
+                                          'report_url': report_url, 'json_url': json_url, 'attempts': attempts}
+        self.save_pending_fetches()
+        if uuid not in self.pending_fetches:
+            return False
+        if self.queue is not None:
+            self.queue.release(uuid, QUEUE_RETRY_DELAY)
+        print(f"  ↻ {uuid} 已记录评审数据地址，下次运行只重新下载评审JSON（第 {attempts} 次失败）", flush=True)
+        return True
+
+    def retry_pending_fetches(self, in_flight: deque):
+        """把上次下载失败的评审 JSON 重新交给后台下载，不打开浏览器、不重新提交"""
+        if self.store is not None:
+            analyzed = set(self.pending_fetches) - self.store.pending_uuids(list(self.pending_fetches))
+        else:
+            analyzed = set(self.pending_fetches) & self.existing_uuids
+        for uuid, entry in list(self.pending_fetches.items()):
+            if uuid in analyzed:
+                del self.pending_fetches[uuid]
+                continue
+            result = {'report_url': entry['report_url'], 'paipu_url': entry['paipu']['paipu_url'],
+                      'json_url': entry['json_url'],
+                      'future': self.fetch_pool.submit(self.fetch_review, entry['json_url'], uuid)}
+            in_flight.append((entry['paipu'], result, 0, self.new_game_metrics()))
+        if in_flight:
+            print(f"重新下载上次失败的评审JSON: {len(in_flight)} 局", flush=True)
+
+    def drain_games(self, in_flight: deque, wait_all: bool = False):
+        """按提交顺序处理已就绪的局；wait_all 为 True 时等待全部完成，超过 FETCH_MAX_PENDING 时等待最早的一局"""
+        while in_flight:
+            paipu, result, game_time, metrics = in_flight[0]
+            future = result.get('future') if result else None
+            if future is not None and not future.done() and not wait_all and len(in_flight) <= FETCH_MAX_PENDING:
+                break
+            in_flight.popleft()
+            self.finish_game(paipu, result, game_time, metrics)
+
     def load_existing_results(self, output_file: str = "data/mortal_results_temp.csv"):
         """加载已存在的分析结果，用于查重和恢复"""
         # 确保路径正确（相对于项目根目录的data文件夹）
-        if not os.path.isabs(output_file):
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            parent_dir = os.path.dirname(script_dir)
-            output_file = os.path.join(parent_dir, output_file)
+        output_file = project_path(output_file)
+        journal_file = journal_path(output_file)
 
-        if not os.path.exists(output_file):
+        if not os.path.exists(output_file) and not os.path.exists(journal_file):
             print(f"  未找到已有结果文件: {output_file}")
             return
 
         # 清空现有数据，避免重复累加
         self.existing_uuids.clear()
-        loaded_results = []
+        loaded_results = {}
+        self.journal_count = 0
 
         try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    uuid = row.get('uuid', '').strip()
-                    if uuid:  # 确保UUID不为空
-                        self.existing_uuids.add(uuid)
-                        loaded_results.append(row)
+            if os.path.exists(output_file):
+                with open(output_file, 'r', encoding='utf-8') as f:
+                    reader = csv.DictReader(f)
+                    for row in reader:
+                        uuid = row.get('uuid', '').strip()
+                        if uuid:  # 确保UUID不为空
+                            loaded_results[uuid] = row
+
+            # 重放上次尚未合并的日志（同一 uuid 以日志为准）
+            if os.path.exists(journal_file):
+                with open(journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                        except ValueError:
+                            continue  # 写入中途被杀留下的半行
+                        loaded_results[row['uuid']] = {k: '' if v is None else str(v) for k, v in row.items()}
+                        self.journal_count += 1
 
             # 重新设置results（避免重复累加）
-            self.results = loaded_results
+            self.results = list(loaded_results.values())
+            self.existing_uuids.update(loaded_results)
 
-            print(f"✓ 加载已有结果: {len(self.results)} 条", flush=True)
+            print(f"✓ 加载已有结果: {len(self.results)} 条（其中日志 {self.journal_count} 条）", flush=True)
             print(f"✓ 查重数据库: {len(self.existing_uuids)} 个UUID", flush=True)
         except Exception as e:
             print(f"⚠ 加载已有结果失败: {e}", flush=True)
 
     def analyze_batch(self, paipu_list: List[Dict], max_count: int = 100, start_index: int = 0):
         """批量分析牌谱"""
-        # 先加载已有结果用于查重
-        self.load_existing_results("data/mortal_results_temp.csv")
-
         # 自动处理到列表末尾
         end_index = min(start_index + max_count, len(paipu_list)) if max_count > 0 else len(paipu_list)
-
-        # 预先去重统计
         batch_to_analyze = paipu_list[start_index:end_index]
-        need_analyze = []
-        already_exist = 0
 
-        for paipu in batch_to_analyze:
-            if paipu['uuid'] in self.existing_uuids:
-                already_exist += 1
-            else:
-                need_analyze.append(paipu)
+        # 预先去重统计：sqlite 后端直接在数据库中查询未分析的 uuid，csv 后端先加载已有结果
+        if self.store is not None:
+            self.sync_store("data/mortal_results_temp.csv")
+            pending = self.store.pending_uuids([paipu['uuid'] for paipu in batch_to_analyze])
+        else:
+            self.load_existing_results("data/mortal_results_temp.csv")
+            pending = {paipu['uuid'] for paipu in batch_to_analyze} - self.existing_uuids
+        # 上次只差评审 JSON 下载的局在本次开始时重新下载，不再提交
+        pending -= self.pending_fetches.keys()
+        need_analyze = [paipu for paipu in batch_to_analyze if paipu['uuid'] in pending]
+        already_exist = len(batch_to_analyze) - len(need_analyze)
 
         total_need = len(need_analyze)
 
@@ -501,108 +1498,433 @@ class MortalAnalyzer:
         print(f"需要分析: {total_need} 条", flush=True)
         print(f"{'='*60}\n", flush=True)
 
-        if total_need == 0:
+        if total_need == 0 and not self.pending_fetches:
             print("所有牌谱已分析完成，无需重复分析", flush=True)
             return self.results
 
-        self.init_browser()
+        in_flight = self.start_session(browser=total_need > 0)
 
         try:
             completed = 0
             start_time = time.time()
 
-            for i, paipu in enumerate(batch_to_analyze):
-                actual_index = start_index + i
+            for paipu in batch_to_analyze:
                 uuid = paipu['uuid']
 
-                # 查重检查
-                if uuid in self.existing_uuids:
+                # 查重检查（同一 uuid 在列表中重复出现时只分析一次）
+                if uuid not in pending:
                     continue
+                pending.discard(uuid)
 
                 completed += 1
+                self.print_progress(completed, total_need, start_time)
+                self.analyze_one(paipu, in_flight)
 
-                # 计算进度
-                progress = (completed / total_need) * 100
-
-                # 简易进度条
-                bar_length = 30
-                filled = int(bar_length * completed / total_need)
-                bar = '█' * filled + '░' * (bar_length - filled)
-
-                print(f"\n[{completed}/{total_need}] {bar} {progress:.1f}%", flush=True)
-
-                # 计算预计时间（实时显示）
-                elapsed_time = time.time() - start_time
-                avg_time_per_item = elapsed_time / completed
-                remaining_items = total_need - completed
-                estimated_time_left = avg_time_per_item * remaining_items
-
-                # 格式化剩余时间
-                if estimated_time_left < 60:
-                    time_str = f"{int(estimated_time_left)}秒"
-                elif estimated_time_left < 3600:
-                    minutes = int(estimated_time_left / 60)
-                    seconds = int(estimated_time_left % 60)
-                    time_str = f"{minutes}分{seconds}秒"
-                else:
-                    hours = int(estimated_time_left / 3600)
-                    minutes = int((estimated_time_left % 3600) / 60)
-                    time_str = f"{hours}小时{minutes}分"
-
-                # 显示平均每个用时和预计剩余时间
-                print(f"  平均用时: {avg_time_per_item:.1f}秒/个", flush=True)
-                print(f"  预计剩余时间: {time_str}", flush=True)
-
-                print(f"  正在分析: {uuid}", flush=True)
-                print(f"  时间: {paipu['start_time']}, 名次: {paipu['rank']}, 得分: {paipu['score']}", flush=True)
-
-                result = self.submit_paipu(paipu['paipu_url'])
-
-                if result:
-                    result.update({
-                        'uuid': paipu['uuid'],
-                        'start_time': paipu['start_time'],
-                        'score': paipu['score'],
-                        'rank': paipu['rank'],
-                        'room': paipu.get('room', 'Unknown'),  # 添加房间信息
-                    })
-                    self.results.append(result)
-                    self.existing_uuids.add(uuid)  # 添加到查重集合
-                    self.save_results("data/mortal_results_temp.csv")
-                    print(f"  ✓ 分析完成", flush=True)
-                else:
-                    print(f"  ✗ 分析失败，跳过", flush=True)
+        finally:
+            self.end_session(in_flight)
+
+        return self.results
 
-                time.sleep(2)
+    def analyze_queue(self, input_path: str, max_count: int = 0, retry_failed: bool = False):
+        """
+        按工作队列分析：与 paipu_list 增量同步后，按优先级逐局领取，直到队列为空或达到 max_count（0 表示不限）
 
+        sqlite 后端启动开销只与新增和待分析的局数有关；csv 后端仍需加载已有结果以便重写 CSV
+        """
+        self.queue = WorkQueue()
+        if self.store is not None:
+            self.sync_store("data/mortal_results_temp.csv")
+        else:
+            self.load_existing_results("data/mortal_results_temp.csv")
+
+        new_uuids = self.queue.sync(input_path)
+        # 未完成的局中已有结果的直接标记为 done：首次建立队列时的全部历史，以及不经过队列分析的局
+        # （不加 --queue 运行、或换了后端）。只检查未完成的局，开销与待分析数量有关，与历史总数无关
+        open_uuids = self.queue.open_uuids()
+        if self.store is not None:
+            analyzed = set(open_uuids) - self.store.pending_uuids(open_uuids)
+        else:
+            analyzed = set(open_uuids) & self.existing_uuids
+        self.queue.mark_done(analyzed)
+        if retry_failed:
+            print(f"重新排队 {self.queue.retry_failed()} 局失败的牌谱", flush=True)
+
+        counts = self.queue.counts()
+        total_need = counts['ready'] if not max_count else min(max_count, counts['ready'])
+        print(f"\n{'='*60}", flush=True)
+        print("工作队列", flush=True)
+        print(f"{'='*60}", flush=True)
+        print(f"本次新增: {len(new_uuids)} 条，已有结果标记完成: {len(analyzed)} 条", flush=True)
+        print(f"已完成: {counts['done']} 条，待分析: {counts['pending']} 条（可立即分析 {counts['ready']} 条），"
+              f"进行中: {counts['in_flight']} 条，已放弃: {counts['failed']} 条", flush=True)
+        print(f"本次分析: {total_need} 条", flush=True)
+        print(f"{'='*60}\n", flush=True)
+
+        if total_need == 0 and not self.pending_fetches:
+            print("没有需要分析的牌谱", flush=True)
+            self.queue.close()
+            self.queue = None
+            return self.results
+
+        in_flight = self.start_session(browser=total_need > 0)
+        try:
+            completed = 0
+            start_time = time.time()
+            while completed < total_need:
+                paipu = self.queue.claim()
+                if paipu is None:
+                    break
+                if self.is_analyzed(paipu['uuid']):
+                    self.queue.done(paipu['uuid'])
+                    continue
+                if paipu['uuid'] in self.pending_fetches:
+                    # 评审 JSON 正在重新下载，不再提交；下载成功时标记为 done
+                    self.queue.release(paipu['uuid'], QUEUE_RETRY_DELAY)
+                    continue
+                completed += 1
+                self.print_progress(completed, total_need, start_time)
+                self.analyze_one(paipu, in_flight)
         finally:
-            self.close_browser()
+            self.end_session(in_flight)
+            self.queue.close()
+            self.queue = None
+
+        return self.results
+
+    def is_analyzed(self, uuid: str) -> bool:
+        """该局是否已有结果"""
+        if self.store is not None:
+            return uuid in self.store
+        return uuid in self.existing_uuids
+
+    def start_session(self, browser: bool = True) -> deque:
+        """启动浏览器（browser 为 False 时只重新下载评审 JSON）和后台下载线程池，返回按提交顺序等待保存的队列"""
+        if browser:
+            self.init_browser()
+        self.fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+        if PYARROW_AVAILABLE:
+            self.decisions = DecisionStore(self.run_id)
+        in_flight = deque()  # 已离开浏览器、按提交顺序等待保存的局
+        self.retry_pending_fetches(in_flight)
+        return in_flight
+
+    def end_session(self, in_flight: deque):
+        """关闭浏览器，等待后台下载全部完成并保存"""
+        self.close_browser()
+        self.drain_games(in_flight, wait_all=True)
+        self.fetch_pool.shutdown()
+        self.fetch_pool = None
+        if self.decisions is not None:
+            self.decisions.flush()
+        self.flush_results("data/mortal_results_temp.csv")
+        self.print_timing_summary()
+
+    @staticmethod
+    def print_progress(completed: int, total_need: int, start_time: float):
+        """打印进度条、平均用时和预计剩余时间"""
+        # 计算进度
+        progress = (completed / total_need) * 100
+
+        # 简易进度条
+        bar_length = 30
+        filled = int(bar_length * completed / total_need)
+        bar = '█' * filled + '░' * (bar_length - filled)
+
+        print(f"\n[{completed}/{total_need}] {bar} {progress:.1f}%", flush=True)
+
+        # 计算预计时间（实时显示）
+        elapsed_time = time.time() - start_time
+        avg_time_per_item = elapsed_time / completed
+        remaining_items = total_need - completed
+        estimated_time_left = avg_time_per_item * remaining_items
+
+        # 格式化剩余时间
+        if estimated_time_left < 60:
+            time_str = f"{int(estimated_time_left)}秒"
+        elif estimated_time_left < 3600:
+            minutes = int(estimated_time_left / 60)
+            seconds = int(estimated_time_left % 60)
+            time_str = f"{minutes}分{seconds}秒"
+        else:
+            hours = int(estimated_time_left / 3600)
+            minutes = int((estimated_time_left % 3600) / 60)
+            time_str = f"{hours}小时{minutes}分"
+
+        # 显示平均每个用时和预计剩余时间
+        print(f"  平均用时: {avg_time_per_item:.1f}秒/个", flush=True)
+        print(f"  预计剩余时间: {time_str}", flush=True)
+
+    def analyze_one(self, paipu: Dict, in_flight: deque):
+        """在浏览器中提交一局；评审 JSON 可能仍在后台下载，按顺序排队，已完成的立即保存"""
+        uuid = paipu['uuid']
+        print(f"  正在分析: {uuid}", flush=True)
+        print(f"  时间: {paipu['start_time']}, 名次: {paipu['rank']}, 得分: {paipu['score']}", flush=True)
+
+        game_start = time.time()
+        self.metrics = self.new_game_metrics()
+        result = self.submit_paipu(paipu['paipu_url'], uuid=uuid)
+        game_time = time.time() - game_start
+        self.begin_phase(None)
+
+        in_flight.append((paipu, result, game_time, self.metrics))
+        self.drain_games(in_flight)
+
+        if GAME_INTERVAL:
+            time.sleep(GAME_INTERVAL)
+
+    def print_timing_summary(self):
+        """打印每局总用时、提交页面加载用时（用 --no-block 运行一次即可对比拦截前后）和评审 JSON 下载统计"""
+        if self.game_times:
+            times = sorted(self.game_times)
+            print(f"\n每局总用时（成功 {len(times)} 局）: 平均 {sum(times) / len(times):.1f}秒，"
+                  f"中位数 {times[len(times) // 2]:.1f}秒，最短 {times[0]:.1f}秒，最长 {times[-1]:.1f}秒", flush=True)
+        if self.page_load_times:
+            times = sorted(self.page_load_times)
+            print(f"页面加载用时（{'拦截非必要资源' if self.block_resources else '未拦截资源'}，共 {len(times)} 次）: "
+                  f"平均 {sum(times) / len(times):.2f}秒，中位数 {times[len(times) // 2]:.2f}秒，"
+                  f"首次 {self.page_load_times[0]:.2f}秒，最长 {times[-1]:.2f}秒", flush=True)
+        if self.http.stats['requests']:
+            print(self.http.summary(), flush=True)
+
+    def persist_result(self, result: Dict, output_file: str):
+        """保存一局结果：sqlite 后端写入数据库，csv 后端追加到日志；积累 RESULT_COMPACT_EVERY 局后更新 CSV"""
+        if self.store is not None:
+            self.store.add(result)
+            self.journal_count += 1
+        else:
+            self.append_result(result, output_file)
+        if self.journal_count >= RESULT_COMPACT_EVERY:
+            self.flush_results(output_file)
+
+    def flush_results(self, output_file: str):
+        """把尚未写进 CSV 的结果合并（csv 后端）或导出（sqlite 后端）到 CSV"""
+        if not self.journal_count:
+            return
+        if self.store is not None:
+            if self.store.export_csv(output_file):
+                self.journal_count = 0
+                self.mark_synced(output_file)
+        else:
+            self.save_results(output_file)
+
+    def sync_store(self, output_file: str):
+        """
+        把 CSV 中的结果导入数据库（首次切换到 sqlite 后端，或期间用 csv 后端分析过、--reextract 改过）
+
+        只有 CSV 或日志在上次导出之后被改动过时才读取。此时 CSV 是在上次导出的基础上改动的，
+        同一 uuid 以 CSV 为准，否则下次导出会用数据库中的旧值覆盖掉 CSV 中的改动
+        """
+        output_file = project_path(output_file)
+        if self.store.get_meta('csv_stamp') == self._csv_stamp(output_file):
+            return
+        self.load_existing_results(output_file)
+        new_count = len(self.store.pending_uuids([row['uuid'] for row in self.results]))
+        changed = self.store.add_many(self.results)
+        print(f"✓ 从 CSV 导入 {new_count} 条新结果、更新 {changed - new_count} 条已有结果到数据库"
+              f"（共 {len(self.store)} 条）", flush=True)
+        self.results = []
+        self.existing_uuids.clear()
+        self.mark_synced(output_file)
+
+    def mark_synced(self, output_file: str):
+        """记录数据库与 CSV 一致时 CSV 的状态"""
+        self.store.set_meta('csv_stamp', self._csv_stamp(project_path(output_file)))
+
+    @staticmethod
+    def _csv_stamp(output_file: str) -> str:
+        stamps = []
+        for path in (output_file, journal_path(output_file)):
+            stamps.append(f"{os.path.getmtime(path)}:{os.path.getsize(path)}" if os.path.exists(path) else '-')
+        return '|'.join(stamps)
+
+    def reextract_results(self, output_file: str = "data/mortal_results_temp.csv"):
+        """不打开浏览器，用缓存的评审 JSON 重新计算已有结果的各项指标并写回"""
+        if self.store is not None:
+            self.sync_store(output_file)
+            self.results = list(self.store.rows())
+        else:
+            self.load_existing_results(output_file)
+        if not self.results:
+            return self.results
 
+        start_time = time.time()
+        updated = 0
+        missing = 0
+        for row in self.results:
+            data = self.review_cache.get(row['uuid'])
+            if data is None:
+                missing += 1
+                continue
+            row.update(parse_review(data))
+            updated += 1
+
+        print(f"✓ 重新提取 {updated} 条（缓存中共 {len(self.review_cache)} 局），"
+              f"{missing} 条没有缓存保持不变，用时 {time.time() - start_time:.1f} 秒", flush=True)
+        if updated and self.store is not None:
+            self.store.add_many(self.results)
+            if self.store.export_csv(output_file):
+                self.mark_synced(output_file)
+        elif updated:
+            self.save_results(output_file)
         return self.results
 
+    def append_result(self, result: Dict, output_path: str):
+        """把一局结果追加到日志并 fsync，开销与已有结果数量无关"""
+        output_path = project_path(output_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        line = json.dumps({k: result.get(k) for k in RESULT_FIELDS}, ensure_ascii=False) + '\n'
+        with open(journal_path(output_path), 'ab+') as f:
+            # 文件末尾不是换行，说明上一局的结果只写了一部分就被杀：另起一行，那半行在加载时会被忽略
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_count += 1
+
     def save_results(self, output_path: str):
-        """保存结果到 CSV"""
+        """保存结果到 CSV：先写临时文件再替换，写入中途被杀不会损坏已有文件；成功后删除已合并的日志"""
         if not self.results:
             return
 
         # 确保路径正确（相对于项目根目录）
-        if not os.path.isabs(output_path):
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            parent_dir = os.path.dirname(script_dir)
-            output_path = os.path.join(parent_dir, output_path)
+        output_path = project_path(output_path)
 
         # 确保data目录存在
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-        fieldnames = ['uuid', 'start_time', 'score', 'rank', 'room', 'rating', 'match_rate', 'matches', 'total', 'paipu_url', 'report_url']
-
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
             writer.writeheader()
             writer.writerows(self.results)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 无论成功与否，再积累 RESULT_COMPACT_EVERY 局才重写 CSV，文件被占用时不会每局都重写一遍
+        self.journal_count = 0
+        try:
+            os.replace(tmp_path, output_path)
+        except PermissionError:
+            os.remove(tmp_path)
+            self.warn_once('csv_locked', f"⚠ {output_path} 被占用（请关闭 Excel 等程序），结果仍保存在日志中，稍后再合并")
+            return
+
+        # self.results 是加载时的 CSV 加上日志重放和本次新增的全部结果，已经完整写进 CSV，日志可以删除。
+        # 删除失败也无妨：下次加载时重放日志，同一 uuid 得到的是同一行
+        journal_file = journal_path(output_path)
+        try:
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+        except OSError as e:
+            self.warn_once('journal_locked', f"⚠ 无法删除已合并的日志 {journal_file}: {e}")
 
         print(f"✓ 结果已保存到: {output_path}")
 
+    def warn_once(self, key: str, message: str):
+        """同一类警告每次运行只打印一次"""
+        if key not in self.warned:
+            self.warned.add(key)
+            print(message, flush=True)
+
+
+def load_paipu_list(input_path: str) -> List[Dict]:
+    """读取牌谱列表：CSV 快照 + 爬虫尚未合并进快照的追加日志（同一 uuid 以日志为准），按时间倒序"""
+    paipu_dict = {}
+    with open(input_path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            paipu_dict[row['uuid']] = row
+
+    journal_file = os.path.join(os.path.dirname(input_path), 'paipu_list.journal.jsonl')
+    if os.path.exists(journal_file):
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                paipu_dict[row['uuid']] = {k: str(v) for k, v in row.items()}
+
+    paipu_list = list(paipu_dict.values())
+    paipu_list.sort(key=lambda x: x['start_time'], reverse=True)
+    return paipu_list
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """已排序数据的 q 分位数（最近秩法）"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_metrics(run: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    """
+    汇总 METRICS_FILE：每个阶段的 p50/p95/最大用时、结果和重试次数
+
+    Args:
+        run: 只统计某次运行（运行编号如 20250101-120000）
+        since/until: 只统计该日期范围（YYYY-MM-DD，含两端）；都不给时统计最近一次运行
+    """
+    path = project_path(METRICS_FILE)
+    if not os.path.exists(path):
+        print(f"未找到指标文件: {path}")
+        return
+
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    if not records:
+        print("指标文件为空")
+        return
+
+    if not (run or since or until):
+        run = records[-1]['run']
+    if run:
+        records = [r for r in records if r['run'] == run]
+    if since:
+        records = [r for r in records if r['time'][:10] >= since]
+    if until:
+        records = [r for r in records if r['time'][:10] <= until]
+    if not records:
+        print("没有符合条件的记录")
+        return
+
+    scope = f"运行 {run}" if run else f"{since or '最早'} ~ {until or '最新'}"
+    outcomes = {}
+    sources = {}
+    retries = {}
+    for record in records:
+        outcomes[record['outcome']] = outcomes.get(record['outcome'], 0) + 1
+        if record.get('source'):
+            sources[record['source']] = sources.get(record['source'], 0) + 1
+        for key, value in record.get('retries', {}).items():
+            retries[key] = retries.get(key, 0) + value
+
+    print(f"{'='*60}")
+    print(f"分析器指标汇总（{scope}）")
+    print(f"{'='*60}")
+    print(f"时间范围: {records[0]['time']} ~ {records[-1]['time']}")
+    print(f"局数: {len(records)}（" + "，".join(f"{k} {v}" for k, v in sorted(outcomes.items())) + "）")
+    if sources:
+        print("结果来源: " + "，".join(f"{k} {v}" for k, v in sorted(sources.items())))
+    print("重试次数: " + "，".join(f"{k} {v}" for k, v in sorted(retries.items())))
+    print()
+    print(f"{'阶段':<16}{'次数':>6}{'p50(秒)':>10}{'p95(秒)':>10}{'最大(秒)':>10}")
+
+    phases = [phase for phase in METRIC_PHASES if any(phase in r['phases'] for r in records)]
+    phases += sorted({phase for r in records for phase in r['phases']} - set(phases))
+    for phase in phases + ['total']:
+        values = sorted(r['total'] if phase == 'total' else r['phases'][phase]
+                        for r in records if phase == 'total' or phase in r['phases'])
+        print(f"{phase:<16}{len(values):>6}{percentile(values, 0.5):>10.2f}"
+              f"{percentile(values, 0.95):>10.2f}{values[-1]:>10.2f}")
+
 
 def main():
     import argparse
@@ -610,14 +1932,52 @@ def main():
     parser = argparse.ArgumentParser(description='Windows Edge Mortal AI 牌谱分析器 - 2Captcha版')
     parser.add_argument('--input', '-i', default='data/paipu_list.csv', help='输入牌谱列表 CSV')
     parser.add_argument('--output', '-o', default='data/mortal_results.csv', help='输出结果 CSV')
-    parser.add_argument('--limit', '-l', type=int, default=100, help='分析数量限制')
-    parser.add_argument('--start', '-s', type=int, default=0, help='起始索引')
+    parser.add_argument('--limit', '-l', type=int, help='分析数量限制（默认 100；--queue 模式默认不限）')
+    parser.add_argument('--start', '-s', type=int, default=0, help='起始索引（--queue 模式下忽略）')
+    parser.add_argument('--queue', action='store_true',
+                        help='按持久化工作队列 data/analyze_queue.db 分析：最新的对局优先，失败的稍后重试，中断后从队列继续')
+    parser.add_argument('--retry-failed', action='store_true', help='配合 --queue：把已放弃（failed）的局重新排队')
+    parser.add_argument('--queue-status', action='store_true', help='同步并打印工作队列各状态的局数后退出')
     parser.add_argument('--headless', action='store_true', help='无头模式')
     parser.add_argument('--proxy', '-p', help='代理服务器')
     parser.add_argument('--api-key', '-k', help='2Captcha API Key')
+    parser.add_argument('--reextract', action='store_true',
+                        help='不打开浏览器，用缓存的评审JSON重新计算 mortal_results_temp.csv 中的指标')
+    parser.add_argument('--no-block', action='store_true', help='不拦截统计、字体、图片等资源（用于对比页面加载用时）')
+    parser.add_argument('--backfill-decisions', action='store_true',
+                        help='不打开浏览器，把评审JSON缓存展开到逐决策数据集 data/review_decisions/（需要 pyarrow）')
+    parser.add_argument('--metrics-summary', action='store_true',
+                        help='汇总 data/analyzer_metrics.jsonl 中的分阶段用时（默认最近一次运行）')
+    parser.add_argument('--run', help='配合 --metrics-summary：只统计某次运行（如 20250101-120000）')
+    parser.add_argument('--since', help='配合 --metrics-summary：起始日期 YYYY-MM-DD')
+    parser.add_argument('--until', help='配合 --metrics-summary：结束日期 YYYY-MM-DD（含）')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv',
+                        help='结果存储：csv（默认）或 sqlite（data/mortal_results.db，CSV 作为导出文件）')
 
     args = parser.parse_args()
 
+    if args.metrics_summary:
+        summarize_metrics(args.run, args.since, args.until)
+        return
+
+    if args.backfill_decisions:
+        MortalAnalyzer().backfill_decisions()
+        return
+
+    if args.reextract:
+        MortalAnalyzer(backend=args.backend).reextract_results()
+        return
+
+    if args.queue_status:
+        queue = WorkQueue()
+        new_uuids = queue.sync(project_path(args.input))
+        counts = queue.counts()
+        queue.close()
+        print(f"本次新增: {len(new_uuids)} 条（新增的局在下次 --queue 运行时与已有结果核对）")
+        for state in WorkQueue.STATES + ('ready',):
+            print(f"  {state:<10}{counts[state]:>8}")
+        return
+
     # 如果没有提供API key，从环境变量或配置文件读取
     api_key = args.api_key or os.getenv('TWOCAPTCHA_API_KEY')
 
@@ -639,27 +1999,39 @@ def main():
     print("Windows Edge Mortal AI 牌谱分析器 - 2Captcha版")
     print("="*60)
 
-    # 读取牌谱列表
-    input_path = args.input
-    if not os.path.isabs(input_path):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        parent_dir = os.path.dirname(script_dir)
-        input_path = os.path.join(parent_dir, input_path)
-
-    paipu_list = []
-    with open(input_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            paipu_list.append(row)
+    input_path = project_path(args.input)
+    analyzer = MortalAnalyzer(headless=args.headless, proxy=args.proxy, captcha_api_key=api_key,
+                              backend=args.backend, block_resources=not args.no_block)
+
+    if args.queue:
+        # 工作队列：与牌谱列表增量同步，按优先级领取
+        results = analyzer.analyze_queue(input_path, args.limit or 0, args.retry_failed)
+    else:
+        # 读取牌谱列表
+        paipu_list = load_paipu_list(input_path)
+        limit = 100 if args.limit is None else args.limit
+
+        actual_count = min(limit, len(paipu_list) - args.start)
+        print(f"读取到 {len(paipu_list)} 条牌谱")
+        print(f"将从第 {args.start} 条开始，最多分析 {limit} 条 (实际处理 {actual_count} 条)")
+        print()
 
-    actual_count = min(args.limit, len(paipu_list) - args.start)
-    print(f"读取到 {len(paipu_list)} 条牌谱")
-    print(f"将从第 {args.start} 条开始，最多分析 {args.limit} 条 (实际处理 {actual_count} 条)")
-    print()
+        # 分析
+        results = analyzer.analyze_batch(paipu_list, limit, args.start)
 
-    # 分析
-    analyzer = MortalAnalyzer(headless=args.headless, proxy=args.proxy, captcha_api_key=api_key)
-    results = analyzer.analyze_batch(paipu_list, args.limit, args.start)
+    if analyzer.store is not None:
+        # 数据库后端：导出全部结果，统计直接在数据库中计算
+        analyzer.store.export_csv(args.output)
+        summary = analyzer.store.summary()
+        if summary['rating'] is not None:
+            print(f"\n{'='*60}")
+            print("统计结果")
+            print(f"{'='*60}")
+            print(f"成功分析: {summary['count']} 场")
+            print(f"平均 Rating: {summary['rating']:.2f}")
+            print(f"平均一致率: {summary['match_rate'] or 0:.2f}%")
+        analyzer.store.close()
+        return
 
     # 保存最终结果（save_results会自动处理路径）
     analyzer.save_results(args.output)
@@ -86,8 +86,9 @@ def run_analyzer():
         # Build command arguments
         cmd_args = [
             'python', analyzer_script,
-            '--limit', '99999',
-            '--headless'
+            '--queue',
+            '--headless',
+            '--backend', 'sqlite'
         ]
 
         # Add API key if available
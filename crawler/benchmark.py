@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+爬虫性能基准：在本地模拟服务器（mock_server.py）上运行 crawl_all.py 的各个阶段，
+输出请求数/秒、用时、峰值内存和完整度，用于衡量性能改动前后的差异
+
+每个 (项目, 规模) 在独立子进程中运行，峰值内存互不影响；模拟服务器运行在主进程中，
+其测试数据不计入爬虫的内存。
+
+用法:
+    python benchmark.py                                  # 全部项目，默认规模
+    python benchmark.py --suite api --sizes 100,100000   # 指定项目和规模
+    python benchmark.py --latency 50 --error-rate 0.05   # 模拟网络延迟和限流
+    python benchmark.py --output bench.jsonl             # 结果追加到文件，便于前后对比
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import mock_server
+
+BENCH_PLAYER_ID = 11111
+DEFAULT_SIZES = '100,1000,10000'
+DEFAULT_RATE = 200.0   # 基准默认放宽限速，否则耗时主要由 RATE_LIMIT 决定
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存（MB），无法获取时返回 None"""
+    # Linux 的 ru_maxrss 会从父进程继承（fork 后 exec 也不重置），优先用 /proc 中本进程的 VmHWM
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    except Exception:
+        return None
+
+
+def configure(crawl_all, base_url, data_dir, rate):
+    """把爬虫指向模拟服务器和临时数据目录"""
+    crawl_all.API_BASE = base_url
+    crawl_all.DATA_DIR = data_dir
+    crawl_all.STATE_FILE = os.path.join(data_dir, 'crawl_state.json')
+    crawl_all.PLAYER_ID = BENCH_PLAYER_ID
+    crawl_all.PLAYER_NAME = mock_server.player_name(BENCH_PLAYER_ID)
+    crawl_all.REAL_MAJSOUL_ID = mock_server.real_majsoul_id(BENCH_PLAYER_ID)
+    crawl_all.MODE = 16.12
+    crawl_all.WEB_URL = f"{base_url}/player/{BENCH_PLAYER_ID}/16.12"
+    crawl_all.RATE_LIMIT = rate
+    crawl_all.RATE_BURST = max(crawl_all.RATE_BURST, int(rate))
+
+
+def bench_api(crawl_all, size, args):
+    """全量抓取历史数据（不使用缓存）"""
+    rows = crawl_all.crawl_api_data(full=True, state={}, use_cache=False)
+    return {'rows': len(rows)}
+
+
+def bench_stream(crawl_all, size, args):
+    """流水线：全量抓取边转换边写入空数据目录，最后合并成快照（衡量内存是否随历史规模增长）"""
+    state = {}
+    stats = {}
+    rows = crawl_all.iter_api_rows(full=True, state=state, use_cache=False, stats=stats)
+    _, total = crawl_all.merge_and_save(rows, [], compact=True)
+    return {'rows': total}
+
+
+def bench_web(crawl_all, size, args):
+    """获取最新数据（默认无浏览器接口，--selenium 时用浏览器打开仿网页）"""
+    rows = crawl_all.crawl_web_data(use_browser=args.selenium)
+    return {'rows': len(rows), 'recent_days': None if args.selenium else crawl_all.RECENT_DAYS}
+
+
+def bench_merge(crawl_all, size, args):
+    """合并 size 条牌谱到空数据目录，再增量合并 50 条新牌谱 + 50 条重复牌谱"""
+    player = crawl_all.default_player()
+    records = mock_server.make_records(BENCH_PLAYER_ID, size + 50)
+    rows = [crawl_all.record_to_row(r, player) for r in records]
+    rows = [row for row in rows if row]
+    initial, incremental = rows[:-50], rows[-100:]
+
+    start = time.time()
+    crawl_all.merge_and_save(initial, [], compact=True)
+    bulk = time.time() - start
+
+    start = time.time()
+    _, total = crawl_all.merge_and_save(incremental, [])
+    return {'rows': total, 'expected': size + 50, 'bulk_s': round(bulk, 3), 'incremental_s': round(time.time() - start, 3)}
+
+
+def bench_convert(crawl_all, size, args):
+    """记录转换微基准：逐条 record_to_row 与批量 records_to_rows 各运行3次取最快，并校验结果一致"""
+    player = crawl_all.default_player()
+    records = mock_server.make_records(BENCH_PLAYER_ID, size)
+
+    def best_of(func, repeat=3):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    expected, loop = best_of(lambda: [crawl_all.record_to_row(r, player) for r in records])
+    rows, batch = best_of(lambda: crawl_all.records_to_rows(records, player))
+    if rows != expected:
+        raise AssertionError('批量转换结果与逐条转换不一致')
+    return {'rows': len(rows), 'expected': size, 'loop_s': round(loop, 4), 'batch_s': round(batch, 4),
+            'vectorized': crawl_all.np is not None and size >= crawl_all.VECTORIZE_MIN_ROWS}
+
+
+# 名称 -> (函数, 是否需要模拟服务器)
+SUITES = {
+    'api': (bench_api, True),
+    'stream': (bench_stream, True),
+    'web': (bench_web, True),
+    'merge': (bench_merge, False),
+    'convert': (bench_convert, False),
+}
+
+
+def run_child(args):
+    """子进程：运行单个项目，最后一行输出结果 JSON"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    real_stdout = sys.stdout
+    import crawl_all
+
+    func, _ = SUITES[args.child]
+    with tempfile.TemporaryDirectory() as data_dir:
+        configure(crawl_all, args.base_url, data_dir, args.rate)
+        log = sys.stderr if args.verbose else open(os.devnull, 'w', encoding='utf-8')
+        baseline = peak_rss_mb()
+        start = time.time()
+        with contextlib.redirect_stdout(log):
+            result = func(crawl_all, args.size, args)
+        result['wall_s'] = round(time.time() - start, 3)
+    result['peak_rss_mb'] = peak_rss_mb()
+    if baseline is not None:
+        result['rss_growth_mb'] = round(result['peak_rss_mb'] - baseline, 1)
+    real_stdout.write(RESULT_PREFIX + json.dumps(result) + '\n')
+    real_stdout.flush()
+
+
+def expected_rows(server, result):
+    """该项目理论上应得到的牌谱数（无浏览器的 web 项目只取最近 recent_days 天）"""
+    since = time.time() - result['recent_days'] * 86400 if result.get('recent_days') else None
+    return len(server.expected_records(BENCH_PLAYER_ID, {16, 12}, since))
+
+
+def run_one(suite, size, args):
+    """在子进程中运行一个 (项目, 规模)，返回结果 dict"""
+    _, needs_server = SUITES[suite]
+    server = None
+    if needs_server:
+        server = mock_server.MockServer({BENCH_PLAYER_ID: size}, latency=args.latency / 1000,
+                                        page_limit=args.page_limit, error_rate=args.error_rate,
+                                        combined_modes=not args.no_combined_mode).start()
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', suite, '--size', str(size),
+               '--rate', str(args.rate), '--base-url', server.url if server else '']
+        if args.selenium:
+            cmd.append('--selenium')
+        if args.verbose:
+            cmd.append('--verbose')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, encoding='utf-8')
+        lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if proc.returncode != 0 or not lines:
+            return {'suite': suite, 'size': size, 'error': f"子进程退出码 {proc.returncode}"}
+        result = json.loads(lines[-1][len(RESULT_PREFIX):])
+
+        if server:
+            result['requests'] = server.stats['requests']
+            result['injected_errors'] = server.stats['errors']
+            result['req_per_s'] = round(result['requests'] / result['wall_s'], 1) if result['wall_s'] else None
+            expected = expected_rows(server, result)
+        else:
+            expected = result.get('expected', size)
+        result['expected'] = expected
+        result['completeness'] = round(result['rows'] / expected, 4) if expected else 1.0
+    finally:
+        if server:
+            server.stop()
+    return {'suite': suite, 'size': size, **result}
+
+
+def format_row(result):
+    if 'error' in result:
+        return f"{result['suite']:<6} {result['size']:>7}  [失败] {result['error']}"
+    rss = result.get('peak_rss_mb')
+    growth = result.get('rss_growth_mb')
+    extra = ''
+    if 'bulk_s' in result:
+        extra = f"全量 {result['bulk_s']}s / 增量 {result['incremental_s']}s"
+    elif 'batch_s' in result:
+        speedup = result['loop_s'] / result['batch_s'] if result['batch_s'] else float('inf')
+        extra = (f"逐条 {result['loop_s']}s / 批量 {result['batch_s']}s，加速 {speedup:.1f} 倍"
+                 + ("" if result['vectorized'] else "（未向量化）"))
+    elif result.get('injected_errors'):
+        extra = f"注入错误 {result['injected_errors']}"
+    return (f"{result['suite']:<6} {result['size']:>7} {result['wall_s']:>9.2f} "
+            f"{result.get('requests', '-'):>7} {result.get('req_per_s') or '-':>8} "
+            f"{f'{rss:.0f}' if rss else '-':>8} {growth if growth is not None else '-':>8} "
+            f"{result['completeness']:>8.2%}  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='爬虫性能基准（使用本地模拟服务器）')
+    parser.add_argument('--suite', default=','.join(SUITES), help='运行的项目，逗号分隔（默认: %(default)s）')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='玩家对局数，逗号分隔（默认: %(default)s，最大可到 100000）')
+    parser.add_argument('--latency', type=float, default=0, help='模拟服务器每个请求的基础延迟（毫秒）')
+    parser.add_argument('--page-limit', type=int, default=100, help='接口每次最多返回的记录数')
+    parser.add_argument('--error-rate', type=float, default=0, help='模拟服务器随机返回 429/5xx 的概率')
+    parser.add_argument('--no-combined-mode', action='store_true',
+                        help='模拟服务器不接受合并模式参数，爬虫回退到按模式分别抓取')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='爬虫限速 RATE_LIMIT（默认: %(default)s）')
+    parser.add_argument('--selenium', action='store_true', help='web 项目使用浏览器模式（需要 Edge）')
+    parser.add_argument('--output', help='结果追加写入的 JSONL 文件')
+    parser.add_argument('--verbose', action='store_true', help='显示爬虫输出（写到 stderr）')
+    # 子进程内部参数
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    suites = [s.strip() for s in args.suite.split(',') if s.strip()]
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        parser.error(f"未知项目: {', '.join(unknown)}（可选: {', '.join(SUITES)}）")
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    print(f"{'项目':<5} {'规模':>6} {'用时(秒)':>7} {'请求数':>5} {'请求/秒':>6} {'峰值MB':>6} {'增长MB':>6} {'完整度':>5}", flush=True)
+    results = []
+    for suite in suites:
+        for size in sizes:
+            result = run_one(suite, size, args)
+            results.append(result)
+            print(format_row(result), flush=True)
+
+    if args.output:
+        run_info = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'latency_ms': args.latency,
+                    'error_rate': args.error_rate, 'rate': args.rate,
+                    'combined_mode': not args.no_combined_mode}
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps({**run_info, **result}, ensure_ascii=False) + '\n')
+        print(f"结果已追加到: {args.output}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
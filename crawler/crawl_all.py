@@ -7,12 +7,31 @@ import requests
 import time
 import re
 import csv
+import gzip
+import hashlib
+import heapq
+import json
+import operator
 import os
+import random
 import sys
 import io
-from datetime import datetime
+import threading
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.edge.options import Options as EdgeOptions
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时逐条转换记录
+    np = None
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
@@ -26,378 +45,1274 @@ REAL_MAJSOUL_ID = "87654321"   # 改为你的雀魂友人ID
 # - 单王座：16 (Throne)
 # - 单玉：12 (Jade)
 # - 单金：9 (Gold)
-# - 混合（如王座+玉）：16.12
+# - 混合（如王座+玉）：16.12，也可以写成列表 [16, 12]
 MODE = 16.12  
-WEB_URL = f"https://amae-koromo.sapk.ch/player/{PLAYER_ID}/{MODE}"
+WEB_URL = f"https://amae-koromo.sapk.ch/player/{PLAYER_ID}/{'.'.join(map(str, MODE)) if isinstance(MODE, list) else MODE}"
 PAIPU_PREFIX = "https://game.maj-soul.com/1/?paipu="
 
+# API 并发抓取配置
+MAX_WORKERS = 4      # 同时进行中的请求数上限
+RATE_LIMIT = 3.0     # 令牌桶速率：每秒最多发出的请求数
+RATE_BURST = 3       # 令牌桶容量：允许的瞬时突发请求数
+PLAYER_WORKERS = 3   # 多玩家模式下同时抓取的玩家数（共用上面的全局限速）
+
+# 增量抓取：每个 (PLAYER_ID, mode) 记录已入库的最新 startTime（水位线）
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+STATE_FILE = os.path.join(DATA_DIR, 'crawl_state.json')
+WATERMARK_OVERLAP_DAYS = 7   # 从水位线往前回溯的天数，用于补上API延迟回填的对局
+
+# 自适应时间段：API每次最多返回100条，满载的时间段会被二分后重新请求
+API_PAGE_LIMIT = 100
+HISTORY_START = datetime(2019, 1, 1)          # 早于牌谱屋收录的最早对局
+MIN_WINDOW_MS = 60 * 1000                     # 时间段最短1分钟，不再继续二分
+FIRST_GAME_PRECISION_MS = 7 * 86400 * 1000    # 二分查找第一局的精度
+
+# API 响应磁盘缓存（data/http_cache）
+CACHE_OPEN_TTL = 10 * 60                # 未结束时间段的缓存有效期（秒）
+API_LAG_DAYS = 35                       # 牌谱屋 API 回填对局的最长延迟（通常约1个月）：结束超过这么多天的时间段才永久缓存
+CACHE_MAX_BYTES = 200 * 1024 * 1024     # 缓存总大小上限，超出后淘汰最久未使用的条目
+
+# 失败重试与熔断
+MAX_RETRIES = 4              # 单个请求失败后最多重试几次
+BACKOFF_BASE = 1.0           # 指数退避基数（秒）：第 n 次重试等待 BACKOFF_BASE * 2**n 的 50%~100%
+BACKOFF_MAX = 60             # 单次退避或 Retry-After 等待的上限（秒）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = 5        # 同一主机连续失败多少次后熔断
+BREAKER_COOLDOWN = 60        # 熔断多少秒后放行一个试探请求
+
+# 最新数据：默认直接请求数据接口，Selenium 只作为回退
+RECENT_DAYS = 7      # 获取最近几天的牌谱
+
+# 浏览器模式的等待上限（秒）：条件满足就立即继续，不再固定 sleep
+WEB_LOAD_TIMEOUT = 30    # 等待牌谱表格出现
+WEB_SCROLL_SETTLE = 3    # 每次滚动后等待新行出现，超时即认为已全部加载
+WEB_DEADLINE = 90        # 整个浏览器模式的截止时间
+
+# 混合模式：先探测 API 是否接受合并的模式参数，支持时所有模式一次扫描完成（结果记录在 crawl_state.json）
+COMBINED_MODE_SEPARATORS = (',', '.')   # 依次尝试的参数写法，如 "16,12"、"16.12"
+COMBINED_PROBE_DAYS = (30, 180, 730)    # 探测用的时间段长度（天），从短到长直到能做出判断
+COMBINED_PROBE_RETRY_DAYS = 7           # 无法判断时，隔多少天后再探测
+
+# 记录转换：条数达到该值且安装了 numpy 时按列批量转换
+VECTORIZE_MIN_ROWS = 500
+API_ROOM_MAP = {16: "Throne", 12: "Jade", 9: "Gold"}
+
+# 流水线缓冲：API 记录攒够这么多条就转换并写入存储；日志合并时也按这个大小分块排序
+STREAM_BUFFER = 2000
+
+# paipu_list 存储：新数据先追加到日志，积累到一定条数后再合并进 CSV 快照
+JOURNAL_NAME = 'paipu_list.journal.jsonl'
+COMPACT_THRESHOLD = 500
+
 # 房间类型映射
 def get_room_type(mode):
-    """根据MODE获取房间类型"""
-    if isinstance(mode, (int, float)):
-        mode_str = str(mode)
-        if '.' in mode_str:
-            # 混合模式，如16.12
-            parts = mode_str.split('.')
-            rooms = []
-            mode_map = {16: "Throne", 12: "Jade", 9: "Gold"}
-            for part in parts:
-                try:
-                    room = mode_map.get(int(part))
-                    if room:
-                        rooms.append(room)
-                except:
-                    pass
-            return "+".join(rooms) if rooms else "Unknown"
-        else:
-            # 单一模式
-            mode_map = {16: "Throne", 12: "Jade", 9: "Gold"}
-            return mode_map.get(int(mode), "Unknown")
-    return "Unknown"
-
-def crawl_api_data(limit=None):
-    """从API获取历史牌谱"""
-    print("\n" + "="*60, flush=True)
-    print("步骤 1/2: 从 API 获取所有数据", flush=True)
-    print("="*60, flush=True)
+    """根据MODE获取房间类型，如 16.12 -> Throne+Jade"""
+    rooms = [API_ROOM_MAP[m] for m in parse_modes(mode) if m in API_ROOM_MAP]
+    return "+".join(rooms) if rooms else "Unknown"
 
-    print(f"玩家: {PLAYER_NAME} (ID: {PLAYER_ID})", flush=True)
-    print(f"模式: {MODE}", flush=True)
-    print(f"网页查看: https://amae-koromo.sapk.ch/player/{PLAYER_ID}/{MODE}", flush=True)
-    if limit:
-        print(f"数量限制: {limit}\n", flush=True)
+def parse_modes(mode=None):
+    """
+    把 MODE 配置解析成模式列表：16 -> [16]；16.12、"16.12"、[16, 12] -> [16, 12]
+    """
+    mode = MODE if mode is None else mode
+    if isinstance(mode, (list, tuple)):
+        parts = mode
+    elif isinstance(mode, float) and mode.is_integer():
+        parts = [int(mode)]
     else:
-        print(f"数量限制: 无限制（获取所有）\n", flush=True)
-
-    # 处理混合模式：分别获取每个模式的数据
-    modes_to_fetch = []
-    if isinstance(MODE, float) and '.' in str(MODE):
-        # 混合模式，如16.12
-        parts = str(MODE).split('.')
-        for part in parts:
+        parts = re.split(r'[.,]', str(mode))
+    modes = []
+    for part in parts:
+        try:
+            value = int(part)
+        except (TypeError, ValueError):
+            continue
+        if value not in modes:
+            modes.append(value)
+    return modes
+
+def mode_path(mode):
+    """模式在牌谱屋网页 URL 中的写法，如 [16, 12] -> 16.12"""
+    return '.'.join(str(m) for m in parse_modes(mode))
+
+def watermark_key(player_id, mode):
+    """水位线在状态文件中的键"""
+    return f"{player_id}:{mode}"
+
+def load_crawl_state(state_file=None):
+    """读取爬取状态文件，不存在或损坏时返回空状态"""
+    state_file = state_file or STATE_FILE
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取爬取状态失败，将全量抓取: {e}", flush=True)
+        return {}
+
+def save_crawl_state(state, state_file=None):
+    """原子写入爬取状态文件（先写临时文件再替换）"""
+    state_file = state_file or STATE_FILE
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, state_file)
+
+def default_player():
+    """由顶部的单玩家配置生成玩家档案"""
+    return {
+        'player_id': PLAYER_ID,
+        'player_name': PLAYER_NAME,
+        'real_majsoul_id': REAL_MAJSOUL_ID,
+        'mode': MODE,
+    }
+
+def load_players(path):
+    """
+    读取多玩家配置（JSON 列表），每项包含 player_id、player_name、real_majsoul_id、mode，
+    缺少 mode 时使用顶部的 MODE
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        players = json.load(f)
+    for player in players:
+        player['player_id'] = int(player['player_id'])
+        player['real_majsoul_id'] = str(player['real_majsoul_id'])
+        player.setdefault('player_name', str(player['player_id']))
+        player.setdefault('mode', MODE)
+    return players
+
+def player_data_dir(player):
+    """多玩家模式下每个玩家的数据分区：data/players/<player_id>/"""
+    return os.path.join(DATA_DIR, 'players', str(player['player_id']))
+
+class TokenBucket:
+    """线程安全的令牌桶限速器：任意时长 T 内最多放行 capacity + rate*T 个请求"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(max(1, capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.acquired = 0  # 已放行的请求数
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.acquired += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def create_session(pool_size=MAX_WORKERS):
+    """创建带连接池的 keep-alive 会话，所有请求共用"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class ResponseCache:
+    """
+    API 响应磁盘缓存，按 URL + 参数的哈希寻址
+
+    结束超过 API_LAG_DAYS 天的时间段数据不会再变，永久缓存；仍可能变化的时间段短期过期，
+    过期后若服务器提供了 ETag/Last-Modified 则用条件请求重新验证。
+    refresh 为 True 时（--full 重建）所有条目都视为过期，只用于条件请求
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=CACHE_MAX_BYTES, refresh=False):
+        self.cache_dir = cache_dir or os.path.join(DATA_DIR, 'http_cache')
+        self.max_bytes = max_bytes
+        self.refresh_all = refresh
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'revalidated': 0, 'stored': 0, 'evicted': 0}
+
+    def _path(self, url, params):
+        key = json.dumps([url, sorted((params or {}).items())], ensure_ascii=False)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.json')
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, url, params):
+        """返回 (新鲜的缓存内容或None, 缓存条目或None)，过期条目可用于条件请求"""
+        path = self._path(url, params)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count('miss')
+            return None, None
+
+        expires_at = entry.get('expires_at')
+        if expires_at is None:
+            # 按旧规则（结束 WATERMARK_OVERLAP_DAYS 天即永久）写入的条目可能缺少延迟回填的对局，重新验证一次
+            fresh = entry.get('lag_days', WATERMARK_OVERLAP_DAYS) >= API_LAG_DAYS
+        else:
+            fresh = expires_at > time.time()
+        if fresh and not self.refresh_all:
+            self._count('hit')
             try:
-                modes_to_fetch.append(int(part))
-            except:
+                os.utime(path)  # 更新修改时间，淘汰时按最近使用排序
+            except OSError:
                 pass
-    else:
-        # 单一模式
-        modes_to_fetch = [int(MODE)]
-
-    all_records = []
-
-    for mode in modes_to_fetch:
-        mode_name_map = {16: "王座之间", 12: "玉之间", 9: "金之间"}
-        mode_name = mode_name_map.get(mode, f"mode={mode}")
-        print(f"\n正在获取{mode_name}数据...", flush=True)
-        mode_records = []
-
-        # 动态生成时间段：从2020年到当前时间，按季度分段（API每次最多返回100条）
-        import time as time_module
-        from datetime import datetime as dt
-
-        time_ranges = []
-        start_year = 2020
-        current_time = int(time_module.time() * 1000)  # 当前时间（毫秒）
-
-        # 生成从2020年到当前的所有季度
-        for year in range(start_year, dt.now().year + 2):  # +2确保覆盖未来
-            for quarter in range(1, 5):  # Q1-Q4
-                # 计算季度起止时间
-                if quarter == 1:
-                    q_start = dt(year, 1, 1)
-                    q_end = dt(year, 4, 1)
-                elif quarter == 2:
-                    q_start = dt(year, 4, 1)
-                    q_end = dt(year, 7, 1)
-                elif quarter == 3:
-                    q_start = dt(year, 7, 1)
-                    q_end = dt(year, 10, 1)
-                else:  # Q4
-                    q_start = dt(year, 10, 1)
-                    q_end = dt(year + 1, 1, 1)
-
-                start_ms = int(q_start.timestamp() * 1000)
-                end_ms = int(q_end.timestamp() * 1000)
-
-                # 如果起始时间已经超过当前时间，停止生成
-                if start_ms > current_time:
-                    break
-
-                time_ranges.append((start_ms, end_ms))
-
-            # 如果已经超过当前年份，停止
-            if year > dt.now().year:
+            return entry['body'], entry
+        self._count('miss')
+        return None, entry
+
+    def put(self, url, params, body, closed, etag=None, last_modified=None):
+        """写入缓存；closed 为 True 表示该时间段已结束，永久有效"""
+        path = self._path(url, params)
+        entry = {
+            'url': url,
+            'params': params,
+            'stored_at': time.time(),
+            'expires_at': None if closed else time.time() + CACHE_OPEN_TTL,
+            'lag_days': API_LAG_DAYS,
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': body,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._count('stored')
+
+    def refresh(self, url, params, entry, closed):
+        """304 Not Modified：沿用缓存内容，更新过期时间"""
+        self._count('revalidated')
+        self.put(url, params, entry['body'], closed, entry.get('etag'), entry.get('last_modified'))
+
+    def prune(self):
+        """缓存总大小超过上限时，按最近使用时间从旧到新删除"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
                 break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats['evicted'] += 1
+            except OSError:
+                pass
 
-        for start_time, end_time in time_ranges:
-            url = f"{API_BASE}/api/v2/pl4/player_records/{PLAYER_ID}/{start_time}/{end_time}"
-            params = {"mode": mode}
+    def summary(self):
+        s = self.stats
+        return (f"缓存命中 {s['hit']}，未命中 {s['miss']}，条件请求验证 {s['revalidated']}，"
+                f"新写入 {s['stored']}，淘汰 {s['evicted']}")
 
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数，无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器：连续失败 threshold 次后熔断，cooldown 秒内直接拒绝请求，
+    之后只放行一个试探请求，成功则恢复，失败则继续熔断。
+    服务器要求的 Retry-After 也记录在这里，该主机的所有请求都会等到期后再发出
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0         # 连续失败次数
+        self.opened_at = None     # 熔断开始时间，None 表示未熔断
+        self.probing = False      # 是否已放行试探请求
+        self.hold_until = 0.0     # Retry-After 到期时间（monotonic）
+        self.trips = 0            # 熔断次数
+
+    def allow(self):
+        """是否允许发出请求"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        """记录一次失败，返回 True 表示本次失败导致熔断"""
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                tripped = not self.probing
+                self.opened_at = time.monotonic()
+                self.probing = False
+                self.trips += tripped
+                return tripped
+            return False
+
+    def hold(self, seconds):
+        """服务器要求等待 seconds 秒（Retry-After）"""
+        with self.lock:
+            self.hold_until = max(self.hold_until, time.monotonic() + seconds)
+
+    def remaining_hold(self):
+        with self.lock:
+            return max(0.0, self.hold_until - time.monotonic())
+
+class ApiClient:
+    """牌谱屋 API 客户端：共享会话 + 令牌桶限速 + 失败重试/按主机熔断 + 可选磁盘缓存"""
+
+    def __init__(self, session=None, limiter=None, cache=None):
+        self.session = session or create_session()
+        self.limiter = limiter or TokenBucket(RATE_LIMIT, RATE_BURST)
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.request_counts = defaultdict(int)  # player_id -> 实际发出的请求数（含重试）
+        self.breakers = {}                      # 主机 -> CircuitBreaker
+        self.timing = defaultdict(float)        # 各线程累计秒数：throttle 限速等待、backoff 退避等待、transfer 传输
+        self.retry_stats = defaultdict(int)     # retries 重试、gave_up 重试耗尽、rejected 熔断拒绝
+
+    def close(self):
+        self.session.close()
+
+    def _breaker(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker()
+            return self.breakers[host]
+
+    def _add(self, counter, name, value=1):
+        with self.lock:
+            counter[name] += value
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+        self._add(self.timing, 'backoff', seconds)
+
+    def request(self, url, params=None, headers=None, player_id=None):
+        """
+        限速后发出 GET 请求；连接错误和 RETRY_STATUS 状态码按指数退避（带随机抖动）重试，
+        429/503 优先遵循 Retry-After；主机熔断期间直接放弃
+
+        Returns:
+            最终的响应（不在 RETRY_STATUS 中的状态码原样返回）；重试耗尽或被熔断时返回 None
+        """
+        breaker = self._breaker(url)
+        reason = None
+        for attempt in range(MAX_RETRIES + 1):
+            if not breaker.allow():
+                self._add(self.retry_stats, 'rejected')
+                print(f"  [跳过] {urlparse(url).netloc} 已熔断" + (f"（{reason}）" if reason else ""), flush=True)
+                return None
+            hold = breaker.remaining_hold()
+            if hold:
+                self._sleep(hold)
+
+            started = time.monotonic()
+            self.limiter.acquire()
+            self._add(self.timing, 'throttle', time.monotonic() - started)
+            with self.lock:
+                self.request_counts[player_id] += 1
+
+            started = time.monotonic()
             try:
-                resp = requests.get(url, params=params, timeout=30)
-                if resp.status_code == 200:
-                    records = resp.json()
-                    if records:
-                        mode_records.extend(records)
-                        start_date = datetime.fromtimestamp(start_time/1000).strftime('%Y-%m')
-                        print(f"  {start_date}: {len(records)} 条", flush=True)
-                    time.sleep(0.3)  # 避免请求过快
+                resp = self.session.get(url, params=params, headers=headers, timeout=30)
+                resp.content  # 读完响应体，传输时间包含下载
+            except requests.RequestException as e:
+                resp, reason = None, f"{type(e).__name__}: {e}"
+            self._add(self.timing, 'transfer', time.monotonic() - started)
+
+            if resp is not None and resp.status_code not in RETRY_STATUS:
+                breaker.record_success()
+                return resp
+            if resp is not None:
+                reason = f"状态码 {resp.status_code}"
+            if breaker.record_failure():
+                print(f"  [警告] {urlparse(url).netloc} 连续失败 {breaker.failures} 次，"
+                      f"熔断 {breaker.cooldown} 秒", flush=True)
+            if attempt == MAX_RETRIES:
+                break
+
+            retry_after = None
+            if resp is not None and resp.status_code in (429, 503):
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            if retry_after is not None:
+                delay = min(BACKOFF_MAX, retry_after)
+                breaker.hold(delay)
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+            self._add(self.retry_stats, 'retries')
+            print(f"  请求失败（{reason}），{delay:.1f} 秒后第 {attempt + 1} 次重试", flush=True)
+            self._sleep(delay)
+
+        self._add(self.retry_stats, 'gave_up')
+        print(f"  获取失败（{reason}），已重试 {MAX_RETRIES} 次", flush=True)
+        return None
+
+    def summary(self):
+        """等待与传输耗时、重试统计（多线程时为各线程累计）"""
+        t, r = self.timing, self.retry_stats
+        return (f"累计等待 {t['throttle'] + t['backoff']:.1f} 秒（限速 {t['throttle']:.1f}，"
+                f"退避/Retry-After {t['backoff']:.1f}），传输 {t['transfer']:.1f} 秒；"
+                f"重试 {r['retries']} 次，放弃 {r['gave_up']} 次，熔断拒绝 {r['rejected']} 次")
+
+    @staticmethod
+    def records_url(player_id, start_time, end_time):
+        return f"{API_BASE}/api/v2/pl4/player_records/{player_id}/{start_time}/{end_time}"
+
+    def get_records(self, player_id, mode, start_time, end_time):
+        """获取单个时间段的牌谱记录，mode 可以是单个模式或合并的模式参数（如 "16,12"），失败返回 None"""
+        url = self.records_url(player_id, start_time, end_time)
+        params = {"mode": mode}
+        # 结束时间早于 API 最长回填延迟的时间段不会再有新数据
+        closed = end_time < (time.time() - API_LAG_DAYS * 86400) * 1000
+
+        entry = None
+        headers = {}
+        if self.cache:
+            body, entry = self.cache.get(url, params)
+            if body is not None:
+                return body
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = self.request(url, params, headers, player_id)
+        if resp is None:
+            return None
+        try:
+            if resp.status_code == 304 and entry:
+                self.cache.refresh(url, params, entry, closed)
+                return entry['body']
+            if resp.status_code == 200:
+                records = resp.json() or []
+                if self.cache:
+                    self.cache.put(url, params, records, closed,
+                                   resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+                return records
+            print(f"  获取失败，状态码: {resp.status_code}", flush=True)
+        except Exception as e:
+            print(f"  获取失败: {e}", flush=True)
+        return None
+
+def split_point(start_ms, end_ms):
+    """
+    在 (start_ms, end_ms) 内选一个拆分点
+
+    优先选对齐程度最高的时间点（以 HISTORY_START 为原点、MIN_WINDOW_MS 为单位的
+    2 的幂次网格），这样各次运行拆出的已结束时间段完全相同，可以命中缓存
+    """
+    base = int(HISTORY_START.timestamp() * 1000)
+    lo = (start_ms - base) // MIN_WINDOW_MS + 1
+    hi = (end_ms - base - 1) // MIN_WINDOW_MS
+    if lo < 1 or lo > hi:
+        return (start_ms + end_ms) // 2
+    if lo == hi:
+        return base + lo * MIN_WINDOW_MS
+    k = (lo ^ hi).bit_length() - 1
+    return base + ((hi >> k) << k) * MIN_WINDOW_MS
+
+def find_first_game(client, player_id, mode, lo_ms, hi_ms):
+    """
+    在 [lo_ms, hi_ms) 内二分查找玩家该模式第一局的时间（毫秒）
+
+    Returns:
+        (第一局时间, 是否查找完成)：时间不晚于第一局；没有任何对局时为 (None, True)；
+        请求失败时保守地返回 (lo_ms, False)，本次从 lo_ms 开始抓取，但结果不应记入状态文件
+    """
+    records = client.get_records(player_id, mode, lo_ms, hi_ms)
+    if records is None:
+        return lo_ms, False
+    if not records:
+        return None, True
+
+    # 始终保持 [lo_ms, hi_ms) 内有对局
+    while len(records) >= API_PAGE_LIMIT and hi_ms - lo_ms > FIRST_GAME_PRECISION_MS:
+        mid = split_point(lo_ms, hi_ms)
+        head = client.get_records(player_id, mode, lo_ms, mid)
+        if head is None:
+            return lo_ms, False
+        if head:
+            hi_ms, records = mid, head
+        else:
+            lo_ms = mid
+
+    # 未满载的窗口包含了区间内全部对局，可直接得到精确的第一局时间
+    if len(records) < API_PAGE_LIMIT:
+        return (min(r.get('startTime', 0) for r in records) - 1) * 1000, True
+    return lo_ms, True
+
+def probe_combined_mode(client, player_id, modes):
+    """
+    探测 API 是否接受合并的模式参数：同一时间段先按单个模式分别请求，再用合并参数请求，
+    合并结果恰好等于各模式结果之和时认为支持。需要至少两个模式有对局，对局太少时换更长的时间段；
+    各模式合计达到 API_PAGE_LIMIT 条（合并结果会被截断）时把时间段减半，只保留最近的一半
+
+    Returns:
+        支持时返回可用的参数（如 "16,12"）；确定不支持时返回 False；无法判断（请求失败、对局太少或太多）时返回 None
+    """
+    end_ms = int(time.time() * 1000) + 86400 * 1000
+    for days in COMBINED_PROBE_DAYS:
+        span_ms = days * 86400 * 1000
+        while True:
+            start_ms = end_ms - span_ms
+            per_mode = [client.get_records(player_id, mode, start_ms, end_ms) for mode in modes]
+            if any(records is None for records in per_mode):
+                return None
+            if sum(len(records) for records in per_mode) < API_PAGE_LIMIT:
+                break
+            if span_ms <= MIN_WINDOW_MS:
+                return None
+            span_ms //= 2
+        if sum(1 for records in per_mode if records) < 2:
+            if span_ms < days * 86400 * 1000:
+                return None  # 减半后只剩一个模式有对局，更长的时间段同样会被截断
+            continue
+        expected = {r.get('uuid') for records in per_mode for r in records}
+
+        errored = False
+        for sep in COMBINED_MODE_SEPARATORS:
+            param = sep.join(str(mode) for mode in modes)
+            resp = client.request(client.records_url(player_id, start_ms, end_ms), {"mode": param},
+                                  player_id=player_id)
+            if resp is None:
+                errored = True
+            elif resp.status_code == 200:
+                try:
+                    if {r.get('uuid') for r in resp.json() or []} == expected:
+                        return param
+                except ValueError:
+                    errored = True
+        return None if errored else False
+    return None
+
+def plan_sweeps(client, player_id, modes, state, probe=True):
+    """
+    决定每次扫描使用的模式参数
+
+    API 支持合并的模式参数时，所有模式一次扫描；否则每个模式分别扫描。
+    探测结果按 (玩家, 模式组合) 记录在 state['combined_mode'] 中，之后不再探测；无法判断时在
+    state['combined_mode_retry'] 中记录下次探测的时间，在此之前按模式分别抓取。probe 为 False 时只读取已有结果
+
+    Returns:
+        [(请求用的模式参数, 包含的模式列表), ...]
+    """
+    per_mode = [(mode, [mode]) for mode in modes]
+    if len(modes) < 2:
+        return per_mode
+
+    decisions = state.setdefault('combined_mode', {})
+    key = watermark_key(player_id, mode_path(modes))
+    retry_at = state.setdefault('combined_mode_retry', {})
+    if key not in decisions and probe and retry_at.get(key, 0) <= time.time():
+        decision = probe_combined_mode(client, player_id, modes)
+        if decision is None:
+            retry_at[key] = int(time.time()) + COMBINED_PROBE_RETRY_DAYS * 86400
+            retry_str = datetime.fromtimestamp(retry_at[key]).strftime('%Y-%m-%d')
+            print(f"无法判断 API 是否支持合并模式查询，按模式分别抓取，{retry_str} 之后再探测", flush=True)
+            return per_mode
+        decisions[key] = decision
+        retry_at.pop(key, None)
+        if decision:
+            print(f"API 支持合并模式查询（mode={decision}），所有模式一次扫描完成", flush=True)
+        else:
+            print("API 不支持合并模式查询，按模式分别抓取", flush=True)
+    if decisions.get(key):
+        return [(decisions[key], modes)]
+    return per_mode
+
+def iter_adaptive(tasks, client, player_id, failed, max_workers=None):
+    """
+    自适应并发抓取：返回条数达到 API_PAGE_LIMIT 的时间段可能被截断，二分后重新请求，
+    直到每个时间段都不满载；空时间段不再细分。每个时间段完成后立即产出，不在内存中累积
+
+    同时提交的请求不超过并发数的两倍，调用方处理慢时不会有大量已完成的响应堆积在内存中；
+    拆分出的子时间段优先处理（深度优先），产出的时间段大致按时间顺序
+
+    Args:
+        tasks: 初始时间段 [(mode, start_ms, end_ms), ...]
+        failed: 列表，请求失败的时间段追加到其中
+
+    Yields:
+        ((mode, start_ms, end_ms), 记录列表)，只包含未满载的时间段
+    """
+    max_workers = max_workers or MAX_WORKERS
+    queue = deque(tasks)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def fill():
+            while queue and len(pending) < max_workers * 2:
+                task = queue.popleft()
+                pending[executor.submit(client.get_records, player_id, *task)] = task
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                mode, start_ms, end_ms = task = pending.pop(future)
+                records = future.result()
+                if records is None:
+                    failed.append(task)
+                elif len(records) >= API_PAGE_LIMIT and end_ms - start_ms > MIN_WINDOW_MS:
+                    mid = split_point(start_ms, end_ms)
+                    queue.appendleft((mode, mid, end_ms))
+                    queue.appendleft((mode, start_ms, mid))
                 else:
-                    print(f"  获取失败，状态码: {resp.status_code}")
-            except Exception as e:
-                print(f"  获取失败: {e}")
-                import traceback
-                traceback.print_exc()
+                    if len(records) >= API_PAGE_LIMIT:
+                        print(f"  [警告] 时间段已无法再拆分，可能缺少对局: {task}", flush=True)
+                    yield task, records
+            fill()
 
-        print(f"  {mode_name}总计: {len(mode_records)} 条", flush=True)
+class RawArchive:
+    """
+    API 原始记录归档：按对局月份分区的 gzip 压缩 JSONL（raw/YYYY-MM.jsonl.gz），按 uuid 去重、只追加
 
-        if len(mode_records) == 0:
-            print(f"  [提示] API未返回{mode_name}数据，可能原因:", flush=True)
-            print(f"        1. 该模式没有对局记录", flush=True)
-            print(f"        2. API数据更新延迟（通常延迟1个月）", flush=True)
-            print(f"        3. PLAYER_ID配置错误", flush=True)
-            print(f"        4. 网页端可查看最新数据: https://amae-koromo.sapk.ch/player/{PLAYER_ID}/{mode}", flush=True)
+    保留四家的 accountId、分数、昵称、段位、结束时间等全部字段，之后的新分析可以直接读本地数据。
+    每次追加写入一个新的 gzip 成员，写入中断只会损坏最后一个成员：读取时跳过，
+    下次写入该分区时用有效记录重写整个分区
+    """
 
-        all_records.extend(mode_records)
+    def __init__(self, data_dir=None):
+        self.archive_dir = os.path.join(data_dir or DATA_DIR, 'raw')
 
-    # 去重并排序
-    unique_records = {}
-    for record in all_records:
-        uuid = record.get('uuid')
-        if uuid and uuid not in unique_records:
-            unique_records[uuid] = record
+    def _path(self, month):
+        return os.path.join(self.archive_dir, f"{month}.jsonl.gz")
 
-    records = list(unique_records.values())
-    records.sort(key=lambda x: x.get('startTime', 0), reverse=True)
+    @staticmethod
+    def _read_partition(path, damaged=None):
+        """逐条读取分区；damaged 为列表时，文件末尾损坏会向其中追加 True"""
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (EOFError, OSError):
+            # 最后一个 gzip 成员不完整（写入时被中断），之前的记录仍然有效
+            if damaged is not None:
+                damaged.append(True)
+
+    @staticmethod
+    def _write_member(f, records):
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for record in records:
+                gz.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def add(self, records):
+        """追加尚未归档的记录，只读取涉及到的月份分区，返回新增条数"""
+        by_month = defaultdict(dict)
+        for record in records:
+            uuid = record.get('uuid')
+            if uuid:
+                month = datetime.fromtimestamp(record.get('startTime', 0)).strftime('%Y-%m')
+                by_month[month].setdefault(uuid, record)
+
+        added = 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, month_records in by_month.items():
+            path = self._path(month)
+            damaged = []
+            existing = {}
+            if os.path.exists(path):
+                for record in self._read_partition(path, damaged):
+                    month_records.pop(record.get('uuid'), None)
+                    existing.setdefault(record.get('uuid'), record)
+            if damaged:
+                # 末尾损坏的分区后面再追加的数据读不到，用有效记录 + 新记录重写
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    self._write_member(f, list(existing.values()) + list(month_records.values()))
+                os.replace(tmp_path, path)
+            elif month_records:
+                with open(path, 'ab') as f:
+                    self._write_member(f, month_records.values())
+            added += len(month_records)
+        return added
+
+    def iter_records(self, months=None):
+        """按月份顺序读取归档记录；months 为 ['2024-01', ...] 时只读这些分区"""
+        if not os.path.isdir(self.archive_dir):
+            return
+        for name in sorted(os.listdir(self.archive_dir)):
+            if not name.endswith('.jsonl.gz'):
+                continue
+            if months and name[:-len('.jsonl.gz')] not in months:
+                continue
+            yield from self._read_partition(os.path.join(self.archive_dir, name))
+
+def record_to_row(record, player=None):
+    """把一条 API 记录转换为 paipu_list 的一行，缺少 uuid 时返回 None"""
+    uuid = record.get('uuid')
+    if not uuid:
+        return None
+
+    player = player or default_player()
+    player_id = player['player_id']
+
+    player_info = None
+    for p in record.get('players', []):
+        if p.get('accountId') == player_id:
+            player_info = p
+            break
 
-    if limit and limit > 0:
-        records = records[:limit]
+    players = record.get('players', [])
+    players_sorted = sorted(players, key=lambda x: x.get('score', 0), reverse=True)
+    rank = 1
+    for i, p in enumerate(players_sorted):
+        if p.get('accountId') == player_id:
+            rank = i + 1
+            break
 
-    print(f"\n合并去重后共 {len(records)} 条记录\n", flush=True)
+    # 根据每条记录的modeId确定房间类型
+    room = API_ROOM_MAP.get(record.get('modeId', 0), "Unknown")
 
-    paipu_list = []
-    for record in records:
-        uuid = record.get('uuid')
-        if not uuid:
-            continue
+    return {
+        'uuid': uuid,
+        'paipu_url': f"{PAIPU_PREFIX}{uuid}_a{player['real_majsoul_id']}",
+        'start_time': datetime.fromtimestamp(record.get('startTime', 0)).strftime('%Y-%m-%d %H:%M:%S'),
+        'score': player_info.get('score', 0) if player_info else 0,
+        'rank': rank,
+        'room': room,
+    }
 
-        player_info = None
-        for player in record.get('players', []):
-            if player.get('accountId') == PLAYER_ID:
-                player_info = player
-                break
+_EPOCH = datetime(1970, 1, 1)
 
-        players = record.get('players', [])
-        players_sorted = sorted(players, key=lambda x: x.get('score', 0), reverse=True)
-        rank = 1
-        for i, p in enumerate(players_sorted):
-            if p.get('accountId') == PLAYER_ID:
-                rank = i + 1
-                break
+def _utc_offset(timestamp):
+    """本地时区在该时刻相对 UTC 的偏移（秒）"""
+    return int((datetime.fromtimestamp(timestamp) - _EPOCH).total_seconds()) - timestamp
 
-        # 根据每条记录的modeId确定房间类型
-        mode_id = record.get('modeId', 0)
-        mode_map = {16: "Throne", 12: "Jade", 9: "Gold"}
-        room = mode_map.get(mode_id, "Unknown")
+def _format_local_times(timestamps):
+    """
+    把 Unix 时间戳数组格式化为本地时间字符串，与 datetime.fromtimestamp(t).strftime 一致
 
-        paipu_list.append({
-            'uuid': uuid,
-            'paipu_url': f"{PAIPU_PREFIX}{uuid}_a{REAL_MAJSOUL_ID}",
-            'start_time': datetime.fromtimestamp(record.get('startTime', 0)).strftime('%Y-%m-%d %H:%M:%S'),
-            'score': player_info.get('score', 0) if player_info else 0,
-            'rank': rank,
-            'room': room,
-        })
+    时区偏移按 UTC 日计算，一天内偏移不变时整天共用；夏令时切换当天逐条计算
+    """
+    days, inverse = np.unique(timestamps // 86400, return_inverse=True)
+    offsets = np.empty(len(days), dtype=np.int64)
+    constant = np.empty(len(days), dtype=bool)
+    for i, day in enumerate(days.tolist()):
+        offsets[i] = _utc_offset(day * 86400)
+        constant[i] = offsets[i] == _utc_offset(day * 86400 + 86399)
+
+    local = (timestamps + offsets[inverse]).astype('datetime64[s]')
+    strings = np.char.replace(np.datetime_as_string(local, unit='s'), 'T', ' ').tolist()
+    for i in np.flatnonzero(~constant[inverse]).tolist():
+        strings[i] = datetime.fromtimestamp(int(timestamps[i])).strftime('%Y-%m-%d %H:%M:%S')
+    return strings
+
+def _pluck(items, key, default=None):
+    """取出每个 dict 中 key 的值；全部都有该键时走 itemgetter 快速路径"""
+    try:
+        return list(map(operator.itemgetter(key), items))
+    except KeyError:
+        return [item.get(key, default) for item in items]
 
-    print(f"\n[成功] 获取到 {len(paipu_list)} 条历史数据", flush=True)
-    return paipu_list
+def records_to_rows(records, player=None):
+    """
+    批量转换 API 记录，结果与逐条调用 record_to_row（跳过返回 None 的记录）完全相同
 
+    安装了 numpy 且条数较多时按列计算名次、分数、房间和时间，否则逐条转换
+    """
+    player = player or default_player()
+    records = [r for r in records if r.get('uuid')]
+    if np is None or len(records) < VECTORIZE_MIN_ROWS:
+        return [record_to_row(r, player) for r in records]
+
+    player_id = player['player_id']
+    seats = [r.get('players', []) for r in records]
+    counts = np.array([len(s) for s in seats], dtype=np.int64)
+    width = max(1, int(counts.max()))
+
+    # 所有座位展开成一维后按 (记录, 座位) 放入矩阵；空位的分数为 -inf，不影响名次
+    rows = np.repeat(np.arange(len(records)), counts)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    flat = [p for s in seats for p in s]
+    flat_scores = _pluck(flat, 'score', 0)
+    scores = np.full((len(records), width), -np.inf)
+    scores[rows, cols] = flat_scores
+    is_me = np.zeros((len(records), width), dtype=bool)
+    is_me[rows, cols] = np.array(_pluck(flat, 'accountId')) == player_id
+
+    # 与 record_to_row 相同：按分数稳定降序排序（同分保持座位顺序），本玩家第一次出现的位置 + 1
+    order = np.argsort(-scores, axis=1, kind='stable')
+    found = is_me.any(axis=1)
+    ranks = np.where(found, np.take_along_axis(is_me, order, axis=1).argmax(axis=1) + 1, 1).tolist()
+    # 分数直接从原始记录取，保持原来的类型；找不到本玩家时为 0
+    my_index = np.where(found, np.cumsum(counts) - counts + is_me.argmax(axis=1), -1).tolist()
+    my_scores = [flat_scores[i] if i >= 0 else 0 for i in my_index]
+
+    mode_ids = np.array(_pluck(records, 'modeId', 0))
+    rooms = np.full(len(records), "Unknown", dtype=object)
+    for mode_id, room in API_ROOM_MAP.items():
+        rooms[mode_ids == mode_id] = room
+
+    timestamps = np.array(_pluck(records, 'startTime', 0), dtype=np.int64)
+    start_times = _format_local_times(timestamps)
+
+    url_suffix = f"_a{player['real_majsoul_id']}"
+    return [{
+        'uuid': r['uuid'],
+        'paipu_url': f"{PAIPU_PREFIX}{r['uuid']}{url_suffix}",
+        'start_time': start_time,
+        'score': score,
+        'rank': rank,
+        'room': room,
+    } for r, start_time, score, rank, room in zip(records, start_times, my_scores, ranks, rooms.tolist())]
+
+def iter_api_rows(full=False, state=None, use_cache=True, player=None, client=None, data_dir=None,
+                  stats=None):
+    """
+    从API获取历史牌谱的流水线：每个时间段的记录完成后按 uuid 去重，攒够 STREAM_BUFFER 条就归档、
+    批量转换并逐行产出，内存中只保留 uuid 集合和一个缓冲区。产出顺序不保证按时间排序
 
-def crawl_web_data():
-    """从网页爬取最新牌谱"""
+    Args:
+        full: 为True时忽略水位线，全量重建
+        use_cache: 是否使用 API 响应磁盘缓存（传入 client 时以 client 为准）
+        player: 玩家档案，默认使用顶部的单玩家配置
+        client: 共享的 ApiClient（多玩家模式），默认新建并在结束时关闭
+        data_dir: 数据目录，原始记录归档写入其中的 raw/
+        state: 爬取状态（load_crawl_state），全部产出后才更新其中的水位线和失败时间段，由调用方在保存数据后持久化
+        stats: 可选 dict，结束时写入 fetched（产出条数）
+    """
     print("\n" + "="*60, flush=True)
-    print("步骤 2/3: 从网页获取最新数据", flush=True)
+    print("从 API 获取所有数据", flush=True)
     print("="*60, flush=True)
 
-    driver = None
+    player = player or default_player()
+    player_id = player['player_id']
+    print(f"玩家: {player['player_name']} (ID: {player_id})", flush=True)
+    modes_to_fetch = parse_modes(player['mode'])
+    print(f"模式: {mode_path(modes_to_fetch)}", flush=True)
+    print(f"网页查看: https://amae-koromo.sapk.ch/player/{player_id}/{mode_path(modes_to_fetch)}\n", flush=True)
+
+    # 读取各模式的水位线（已入库的最新 startTime）
+    if state is None:
+        state = load_crawl_state()
+    watermarks = state.setdefault('watermarks', {})
+    failed_state = state.setdefault('failed_windows', {})  # 上次重试后仍失败的时间段
+
+    own_client = client is None
+    if own_client:
+        client = ApiClient(cache=ResponseCache(refresh=full) if use_cache else None)
+    first_games = state.setdefault('first_game', {})
+    history_start_ms = int(HISTORY_START.timestamp() * 1000)
+    now_ms = int(time.time() * 1000) + 86400 * 1000  # 多留一天，避免时钟误差漏掉最新对局
+    fetch_start = time.time()
+
+    # 混合模式在 API 支持时合并为一次扫描；水位线等状态仍按单个模式记录，切换扫描方式后可以沿用
+    sweeps = plan_sweeps(client, player_id, modes_to_fetch, state)
+    sweep_members = dict(sweeps)
+
+    # 每次扫描只生成一个初始时间段，满载的时间段在抓取时再二分
+    tasks = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        searches = {}
+        for query_mode, members in sweeps:
+            keys = [watermark_key(player_id, mode) for mode in members]
+            marks = [watermarks.get(key) for key in keys]
+            if not full and all(marks):
+                # 增量模式：只查询水位线（减去回溯重叠）之后的时间段
+                since_ms = (min(marks) - WATERMARK_OVERLAP_DAYS * 86400) * 1000
+                since_str = datetime.fromtimestamp(since_ms / 1000).strftime('%Y-%m-%d %H:%M')
+                print(f"增量模式 mode={query_mode}: 从 {since_str} 开始（使用 --full 可全量重建）", flush=True)
+                tasks.append((query_mode, since_ms, now_ms))
+                retry_windows = sorted({tuple(w) for key in keys for w in failed_state.get(key, [])
+                                        if w[0] < since_ms})
+                if retry_windows:
+                    print(f"mode={query_mode}: 重试上次失败的 {len(retry_windows)} 个时间段", flush=True)
+                    tasks.extend((query_mode, start_ms, end_ms) for start_ms, end_ms in retry_windows)
+            elif not full and all(key in first_games for key in keys):
+                tasks.append((query_mode, min(first_games[key] for key in keys), now_ms))
+            else:
+                # 二分查找第一局，跳过注册前的年份
+                searches[query_mode] = executor.submit(find_first_game, client, player_id,
+                                                       query_mode, history_start_ms, now_ms)
+
+        for query_mode, future in searches.items():
+            first_ms, complete = future.result()
+            if first_ms is None:
+                print(f"mode={query_mode}: 没有找到任何对局", flush=True)
+                continue
+            if complete:
+                for mode in sweep_members[query_mode]:
+                    first_games[watermark_key(player_id, mode)] = first_ms
+                first_str = datetime.fromtimestamp(first_ms / 1000).strftime('%Y-%m-%d')
+                print(f"mode={query_mode}: 第一局约在 {first_str}", flush=True)
+            else:
+                # 查找中途请求失败：本次从区间起点全量抓取，不记录第一局时间，下次运行重新查找
+                print(f"mode={query_mode}: 查找第一局时请求失败，本次从头抓取", flush=True)
+            tasks.append((query_mode, first_ms, now_ms))
+
+    seen = set()                       # 已产出的 uuid
+    mode_counts = defaultdict(int)     # 按记录的 modeId 统计
+    newest = defaultdict(int)          # 各次扫描最新的 startTime
+    failed_windows = []
+    buffer = []
+    archive = RawArchive(data_dir)
+    archived = 0
     try:
-        print("正在启动浏览器...", flush=True)
-        options = EdgeOptions()
-        options.add_argument('--disable-gpu')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_experimental_option('excludeSwitches', ['enable-automation'])
+        for (query_mode, _, _), records in iter_adaptive(tasks, client, player_id, failed_windows):
+            for record in records:
+                uuid = record.get('uuid')
+                if not uuid or uuid in seen:
+                    continue
+                seen.add(uuid)
+                mode_counts[record.get('modeId')] += 1
+                newest[query_mode] = max(newest[query_mode], record.get('startTime', 0))
+                buffer.append(record)
+            if len(buffer) >= STREAM_BUFFER:
+                archived += archive.add(buffer)
+                yield from records_to_rows(buffer, player)
+                buffer.clear()
+        if buffer:
+            archived += archive.add(buffer)
+            yield from records_to_rows(buffer, player)
+            buffer.clear()
+    finally:
+        if own_client:
+            client.close()
+    print(f"请求完成，共 {client.request_counts[player_id]} 个请求（并发 {MAX_WORKERS}，限速 {RATE_LIMIT}/秒），"
+          f"用时 {time.time() - fetch_start:.1f} 秒", flush=True)
+    if own_client:
+        print(client.summary(), flush=True)
+    if own_client and client.cache:
+        client.cache.prune()
+        print(client.cache.summary(), flush=True)
+
+    mode_name_map = {16: "王座之间", 12: "玉之间", 9: "金之间"}
+    for query_mode, members in sweeps:
+        failed = [[start_ms, end_ms] for window_mode, start_ms, end_ms in failed_windows
+                  if window_mode == query_mode]
+        for mode in members:
+            print(f"\n{mode_name_map.get(mode, f'mode={mode}')}总计: {mode_counts[mode]} 条", flush=True)
+
+            # 失败的时间段记入状态文件，下次运行只重试这些时间段，水位线照常推进
+            key = watermark_key(player_id, mode)
+            if failed:
+                failed_state[key] = failed
+            else:
+                failed_state.pop(key, None)
+            # 扫描完成后，水位线之前该扫描包含的所有模式都已入库
+            if newest[query_mode]:
+                watermarks[key] = max(newest[query_mode], 0 if full else watermarks.get(key, 0))
+        if failed:
+            print(f"  [警告] {len(failed)} 个时间段重试后仍失败，已记录，下次运行将重试", flush=True)
+
+        if not newest[query_mode]:
+            print(f"  [提示] API未返回 mode={query_mode} 的数据，可能原因:", flush=True)
+            print(f"        1. 该模式没有对局记录", flush=True)
+            print(f"        2. API数据更新延迟（通常延迟1个月）", flush=True)
+            print(f"        3. PLAYER_ID配置错误", flush=True)
+            print(f"        4. 网页端可查看最新数据: https://amae-koromo.sapk.ch/player/{player_id}/{mode_path(members)}", flush=True)
 
-        driver = webdriver.Edge(options=options)
+    print(f"\n去重后共 {len(seen)} 条记录，原始记录归档新增 {archived} 条", flush=True)
+    if stats is not None:
+        stats['fetched'] = len(seen)
 
-        print(f"访问页面: {WEB_URL}", flush=True)
-        driver.get(WEB_URL)
+def crawl_api_data(limit=None, full=False, state=None, use_cache=True, player=None, client=None,
+                   data_dir=None):
+    """
+    从API获取历史牌谱，返回按时间倒序的完整列表（整个历史都在内存中；
+    主流程用 iter_api_rows 边抓取边写入存储）
 
-        print("等待页面加载...", flush=True)
-        time.sleep(10)
+    Args:
+        limit: 数量限制（取最新的 limit 条）
+        其余参数同 iter_api_rows
+    """
+    paipu_list = list(iter_api_rows(full=full, state=state, use_cache=use_cache, player=player,
+                                    client=client, data_dir=data_dir))
+    paipu_list.sort(key=lambda x: x['start_time'], reverse=True)
+    if limit and limit > 0:
+        paipu_list = paipu_list[:limit]
+    print(f"\n[成功] 获取到 {len(paipu_list)} 条历史数据", flush=True)
+    return paipu_list
 
-        # 多次滚动确保加载所有数据（上下都滚动）
-        print("滚动页面加载所有数据...", flush=True)
+def crawl_recent_data(days=RECENT_DAYS, player=None, client=None, data_dir=None):
+    """
+    不启动浏览器，直接请求网页本身调用的数据接口获取最近的牌谱
 
-        # 先滚动到最顶部
-        driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(3)
+    Args:
+        player: 玩家档案，默认使用顶部的单玩家配置
+        client: 共享的 ApiClient（多玩家模式），默认新建并在结束时关闭
 
-        # 向下滚动几次加载更多
-        for i in range(5):
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
+    Returns:
+        与 crawl_web_data_selenium 相同结构的列表；接口请求失败时返回 None
+    """
+    start = time.time()
+    end_ms = int(time.time() * 1000) + 86400 * 1000
+    start_ms = end_ms - (days + 1) * 86400 * 1000
+    print(f"请求最近 {days} 天的数据（无浏览器）...", flush=True)
+
+    player = player or default_player()
+    own_client = client is None
+    if own_client:
+        client = ApiClient()
+    try:
+        # 沿用全量抓取时记录的合并模式探测结果，这里不额外探测
+        state = load_crawl_state(os.path.join(data_dir, 'crawl_state.json') if data_dir else None)
+        sweeps = plan_sweeps(client, player['player_id'], parse_modes(player['mode']), state, probe=False)
+        # 最近几天的对局也可能超过 API_PAGE_LIMIT 条：满载的时间段二分后重新请求
+        failed = []
+        records = []
+        for _, window_records in iter_adaptive([(query_mode, start_ms, end_ms) for query_mode, _ in sweeps],
+                                               client, player['player_id'], failed):
+            records.extend(window_records)
+        if failed:
+            print(f"  [警告] {len(failed)} 个时间段请求失败", flush=True)
+            return None
+    finally:
+        if own_client:
+            print(client.summary(), flush=True)
+            client.close()
 
-        # 最后滚回顶部，确保顶部最新数据也被加载
-        driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(3)
+    RawArchive(data_dir).add(records)
 
-        print("正在提取牌谱数据...", flush=True)
-        page_source = driver.page_source
-
-        # 提取时间信息
-        time_pattern = r'(\d{4}/\d{2}/\d{2}\s+\d{2}:\d{2})'
-        time_matches = re.findall(time_pattern, page_source)
-
-        # 提取rank（汉字或全角数字）
-        # 查找 <div class="MuiBox-root css-9p3m8i">１</div> 或 <div class="MuiBox-root css-18ov3r4">４</div>
-        rank_pattern = r'<div class="MuiBox-root css-[^"]+">([一二三四１２３４])</div>'
-        rank_matches = re.findall(rank_pattern, page_source)
-
-        # 转换rank
-        rank_map = {
-            '一': 1, '１': 1,
-            '二': 2, '２': 2,
-            '三': 3, '３': 3,
-            '四': 4, '４': 4,
-        }
-        ranks = [rank_map.get(r, 0) for r in rank_matches]
-
-        # 提取玩家分数
-        # 格式: [Cl1] Traaaaa [49100] 或 [St1] メガウソッキー [22700]
-        # 使用配置中的PLAYER_NAME，并转义特殊字符
-        player_pattern = rf'{re.escape(PLAYER_NAME)} \[([+-]?\d+)\]'
-        player_scores = re.findall(player_pattern, page_source)
-
-        # 提取房间类型 - 根据MODE动态构建匹配模式
-        # 网页HTML结构：<div aria-colindex="1" ... title="Thr">
-        # 房间类型在表格第一列的 title 属性中
-
-        # 根据MODE确定需要匹配的房间
-        mode_to_room_abbr = {16: 'Thr', 12: 'Jad', 9: 'Gld'}
-        allowed_rooms = []
-
-        if isinstance(MODE, float) and '.' in str(MODE):
-            # 混合模式：提取所有模式对应的房间缩写
-            parts = str(MODE).split('.')
-            for part in parts:
-                try:
-                    mode_id = int(part)
-                    if mode_id in mode_to_room_abbr:
-                        allowed_rooms.append(mode_to_room_abbr[mode_id])
-                except:
-                    pass
-        else:
-            # 单一模式
-            mode_id = int(MODE)
-            if mode_id in mode_to_room_abbr:
-                allowed_rooms.append(mode_to_room_abbr[mode_id])
-
-        # 构建动态正则（只匹配允许的房间）
-        if allowed_rooms:
-            room_list = '|'.join(allowed_rooms)
-        else:
-            room_list = 'Thr|Jad|Gld'  # 默认匹配所有
+    paipu_dict = {}
+    for row in records_to_rows(records, player):
+        if row['uuid'] not in paipu_dict:
+            paipu_dict[row['uuid']] = row
 
-        # 匹配表格第一列的房间类型：aria-colindex="1".*?title="(Thr|Jad|Gld)"
-        room_pattern = rf'aria-colindex="1"[^>]*?title="({room_list})"'
-        room_matches = re.findall(room_pattern, page_source)
+    paipu_list = list(paipu_dict.values())
+    paipu_list.sort(key=lambda x: x['start_time'], reverse=True)
 
-        # 转换房间类型
-        room_map = {
-            'Thr': 'Throne',
-            'Jad': 'Jade',
-            'Gld': 'Gold',
-        }
-        rooms = [room_map.get(r, 'Unknown') for r in room_matches]
-
-        print(f"找到 {len(time_matches)} 个时间, {len(ranks)} 个rank, {len(player_scores)} 个score, {len(rooms)} 个room", flush=True)
+    print(f"[成功] 提取到 {len(paipu_list)} 条牌谱，用时 {time.time() - start:.1f} 秒", flush=True)
+    if len(paipu_list) > 0:
+        print("前5条:")
+        for i, p in enumerate(paipu_list[:5], 1):
+            print(f"  {i}. [{p['start_time']}] {p['uuid']}")
+    return paipu_list
 
-        # 匹配牌谱链接（包含所有玩家的）
-        pattern = r'mahjongsoul\.game\.yo-star\.com/\?paipu=([^"\'<>\s&]+)'
-        all_matches = re.findall(pattern, page_source)
+def crawl_web_data(use_browser=False):
+    """
+    获取最新牌谱
 
-        print(f"找到 {len(all_matches)} 个牌谱链接", flush=True)
+    Args:
+        use_browser: 为True时直接用浏览器爬取网页；否则先走无浏览器接口，失败时才回退到浏览器
+    """
+    print("\n" + "="*60, flush=True)
+    print("从网页获取最新数据", flush=True)
+    print("="*60, flush=True)
 
-        # 只保留我们玩家的牌谱链接
-        our_matches = []
-        for match in all_matches:
-            if f'_a{REAL_MAJSOUL_ID}' in match:
-                our_matches.append(match)
+    if not use_browser:
+        try:
+            paipu_list = crawl_recent_data()
+            if paipu_list is not None:
+                return paipu_list
+        except Exception as e:
+            print(f"[警告] 接口获取失败: {e}", flush=True)
+        print("[提示] 回退到浏览器模式", flush=True)
+
+    return crawl_web_data_selenium()
+
+# 当前渲染的牌谱链接数和页面高度，用于判断滚动后是否加载了新数据
+COUNT_ROWS_JS = "return [document.querySelectorAll('a[href*=\"paipu=\"]').length, document.body.scrollHeight];"
+
+# 在浏览器中逐行读取牌谱表格，每行返回一个对象（表头等没有牌谱链接的行也会返回，由 Python 跳过）
+EXTRACT_ROWS_JS = r"""
+const RANK_GLYPHS = /^[一二三四１２３４]$/;
+const TIME_RE = /(\d{4}\/\d{2}\/\d{2}\s+\d{2}:\d{2})/;
+return Array.from(document.querySelectorAll('[role="row"]')).map((row, index) => {
+    const roomCell = row.querySelector('[aria-colindex="1"]');
+    const rankCell = Array.from(row.querySelectorAll('div'))
+        .find(div => div.children.length === 0 && RANK_GLYPHS.test(div.textContent.trim()));
+    const text = row.innerText || '';
+    const timeMatch = text.match(TIME_RE);
+    return {
+        index: index,
+        room: roomCell ? roomCell.getAttribute('title') : null,
+        rank: rankCell ? rankCell.textContent.trim() : null,
+        time: timeMatch ? timeMatch[1] : null,
+        text: text,
+        links: Array.from(row.querySelectorAll('a[href*="paipu="]')).map(a => a.href),
+    };
+});
+"""
 
-        print(f"找到 {len(our_matches)} 个属于我们玩家的牌谱链接", flush=True)
+WEB_RANK_MAP = {
+    '一': 1, '１': 1,
+    '二': 2, '２': 2,
+    '三': 3, '３': 3,
+    '四': 4, '４': 4,
+}
+WEB_ROOM_MAP = {'Thr': 'Throne', 'Jad': 'Jade', 'Gld': 'Gold'}
 
-        # 检查数据一致性
-        expected_count = len(our_matches)
+def parse_web_row(row):
+    """
+    解析 EXTRACT_ROWS_JS 返回的一行
 
-        print(f"数据一致性检查:", flush=True)
-        print(f"  牌谱链接: {len(our_matches)}", flush=True)
-        print(f"  时间: {len(time_matches)}", flush=True)
-        print(f"  Rank: {len(ranks)}", flush=True)
-        print(f"  Score: {len(player_scores)}", flush=True)
-        print(f"  Room: {len(rooms)}", flush=True)
+    Returns:
+        (牌谱dict, None)：解析成功
+        (None, None)：不是我们玩家的牌谱行（表头、其他玩家）
+        (None, 错误说明)：是我们的牌谱，但缺少字段
+    """
+    paipu_id = None
+    for link in row.get('links') or []:
+        match = re.search(r'paipu=([^"\'<>\s&]+)', link)
+        if match and f'_a{REAL_MAJSOUL_ID}' in match.group(1):
+            paipu_id = match.group(1)
+            break
+    if not paipu_id:
+        return None, None
 
-        if len(player_scores) != expected_count:
-            print(f"[警告] player_scores数量({len(player_scores)})与牌谱链接数量({expected_count})不一致！", flush=True)
-            print(f"[警告] 请检查PLAYER_NAME配置是否正确: {PLAYER_NAME}", flush=True)
+    uuid = paipu_id.split('_')[0]
+    missing = []
 
-        # 以our_matches为基准（牌谱链接数量最准确）
-        # 注意：不包括time_matches，因为时间可以从UUID提取
-        actual_count = min(len(our_matches), len(ranks), len(player_scores), len(rooms))
+    # 时间：优先用表格中的精确时间，否则从UUID提取日期
+    if row.get('time'):
+        start_time = row['time'].replace('/', '-') + ":00"
+    else:
+        date_match = re.match(r'(\d{2})(\d{2})(\d{2})-', uuid)
+        if not date_match:
+            missing.append('时间')
+            start_time = None
+        else:
+            start_time = f"20{date_match.group(1)}-{date_match.group(2)}-{date_match.group(3)} 00:00:00"
+
+    # 格式: [Cl1] Traaaaa [49100] 或 [St1] メガウソッキー [22700]
+    score_match = re.search(rf'{re.escape(PLAYER_NAME)} \[([+-]?\d+)\]', row.get('text') or '')
+    if not score_match:
+        missing.append('分数')
+
+    rank = WEB_RANK_MAP.get(row.get('rank'))
+    if not rank:
+        missing.append('名次')
+
+    room = WEB_ROOM_MAP.get(row.get('room'))
+    if not room:
+        missing.append('房间')
+
+    if missing:
+        return None, f"{uuid} 缺少{'、'.join(missing)}"
+
+    return {
+        'uuid': uuid,
+        'paipu_url': f"{PAIPU_PREFIX}{uuid}_a{REAL_MAJSOUL_ID}",
+        'start_time': start_time,
+        'score': int(score_match.group(1)),
+        'rank': rank,
+        'room': room,
+    }, None
+
+def crawl_web_data_selenium():
+    """从网页爬取最新牌谱（浏览器模式）"""
+    driver = None
+    deadline = time.time() + WEB_DEADLINE
+    phase_times = []  # [(阶段, 秒)]
+    try:
+        print("正在启动浏览器...", flush=True)
+        phase_start = time.time()
+        options = EdgeOptions()
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-blink-features=AutomationControlled')
+        options.add_experimental_option('excludeSwitches', ['enable-automation'])
 
-        if actual_count < expected_count:
-            print(f"[警告] 数据不完整！预期{expected_count}条，实际只能处理{actual_count}条", flush=True)
+        driver = webdriver.Edge(options=options)
+        phase_times.append(('启动浏览器', time.time() - phase_start))
 
-        # 解析数据
-        paipu_dict = {}
+        print(f"访问页面: {WEB_URL}", flush=True)
+        phase_start = time.time()
+        driver.get(WEB_URL)
+        phase_times.append(('打开页面', time.time() - phase_start))
 
-        for i in range(actual_count):
-            match = our_matches[i]
-            parts = match.split('_')
-            if len(parts) >= 1:
-                uuid = parts[0]
-                if uuid in paipu_dict:
-                    continue
+        print("等待表格渲染...", flush=True)
+        phase_start = time.time()
+        try:
+            WebDriverWait(driver, WEB_LOAD_TIMEOUT, poll_frequency=0.2).until(
+                lambda d: d.execute_script(COUNT_ROWS_JS)[0] > 0
+            )
+        except TimeoutException:
+            print(f"[错误] {WEB_LOAD_TIMEOUT} 秒内未出现牌谱表格", flush=True)
+            return []
+        phase_times.append(('等待表格', time.time() - phase_start))
+
+        # 逐次滚动到底部，直到牌谱链接数和页面高度都不再增长；每次都提取当前渲染的行，
+        # 这样即使表格是虚拟滚动（只渲染可见行）也不会漏掉
+        print("滚动加载，直到行数不再增长...", flush=True)
+        phase_start = time.time()
+        rows = list(driver.execute_script(EXTRACT_ROWS_JS))
+        last_state = driver.execute_script(COUNT_ROWS_JS)
+        scrolls = 0
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"[警告] 已达到截止时间（{WEB_DEADLINE}秒），停止滚动", flush=True)
+                break
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            scrolls += 1
+            try:
+                WebDriverWait(driver, min(WEB_SCROLL_SETTLE, remaining), poll_frequency=0.2).until(
+                    lambda d: d.execute_script(COUNT_ROWS_JS) != last_state
+                )
+            except TimeoutException:
+                break
+            last_state = driver.execute_script(COUNT_ROWS_JS)
+            rows.extend(driver.execute_script(EXTRACT_ROWS_JS))
+        phase_times.append(('滚动加载', time.time() - phase_start))
+        print(f"滚动 {scrolls} 次，共读取 {len(rows)} 行", flush=True)
 
-                # 从UUID提取日期
-                date_match = re.match(r'(\d{6})-', uuid)
-                if date_match:
-                    date_str = date_match.group(1)
-                    year = "20" + date_str[:2]
-                    month = date_str[2:4]
-                    day = date_str[4:6]
-                    start_time = f"{year}-{month}-{day} 00:00:00"
-
-                    # 使用精确时间
-                    if i < len(time_matches):
-                        precise_time = time_matches[i].replace('/', '-')
-                        start_time = precise_time + ":00"
-                else:
-                    start_time = "未知"
-
-                # 获取rank、score和room（索引i对应player_scores的索引）
-                rank = ranks[i] if i < len(ranks) else 0
-                score = int(player_scores[i]) if i < len(player_scores) else 0
-                room = rooms[i] if i < len(rooms) else 'Unknown'
-
-                paipu_dict[uuid] = {
-                    'uuid': uuid,
-                    'paipu_url': f"{PAIPU_PREFIX}{uuid}_a{REAL_MAJSOUL_ID}",
-                    'start_time': start_time,
-                    'score': score,
-                    'rank': rank,
-                    'room': room,
-                }
+        print("正在提取牌谱数据...", flush=True)
+        phase_start = time.time()
+        paipu_dict = {}
+        failures = {}  # 同一行可能在多次滚动中被重复读取，按错误说明去重
+        for row in rows:
+            item, error = parse_web_row(row)
+            if error:
+                failures.setdefault(error, row.get('index'))
+            elif item and item['uuid'] not in paipu_dict:
+                paipu_dict[item['uuid']] = item
+
+        if failures:
+            print(f"[警告] {len(failures)} 行解析失败:", flush=True)
+            for error, index in failures.items():
+                print(f"  第 {index} 行: {error}", flush=True)
+            if any('分数' in error for error in failures):
+                print(f"[警告] 请检查PLAYER_NAME配置是否正确: {PLAYER_NAME}", flush=True)
+        phase_times.append(('解析', time.time() - phase_start))
+        print("阶段用时: " + ", ".join(f"{name} {seconds:.1f}秒" for name, seconds in phase_times), flush=True)
 
         # 按时间排序
         paipu_list = list(paipu_dict.values())
@@ -426,104 +1341,319 @@ def crawl_web_data():
             except Exception as e:
                 print(f"关闭浏览器时出错（可忽略）: {e}")
 
-def merge_and_save(api_data, web_data):
-    """合并去重并保存（追加模式，不删除已有数据）"""
-    print("\n" + "="*60, flush=True)
-    print("步骤 3/3: 合并数据并去重", flush=True)
-    print("="*60, flush=True)
+class PaipuStore:
+    """
+    paipu_list 存储：按时间倒序排好的 CSV 快照 + 只追加的 JSONL 日志
 
-    all_data = {}
+    新增/更新只追加到日志（写完即 fsync），日志积累到 COMPACT_THRESHOLD 条后才合并进快照；
+    快照先写临时文件再替换，读取方永远不会看到写了一半的文件。
+    同一 uuid 在日志中出现多次时以最后一条为准
+    """
+
+    FIELDNAMES = ['uuid', 'paipu_url', 'start_time', 'score', 'rank', 'room']
+
+    def __init__(self, data_dir=None):
+        data_dir = data_dir or DATA_DIR
+        self.snapshot_file = os.path.join(data_dir, 'paipu_list.csv')
+        self.journal_file = os.path.join(data_dir, JOURNAL_NAME)
+        self.index = {}  # uuid -> (start_time, room)
+        self.journal_count = 0
+        self._spilled = []  # 合并时分块排序的临时文件
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            return
+        with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 程序中途被杀时最后一行可能不完整，跳过
+                    continue
 
-    # 先读取已有的CSV文件（如果存在）
-    data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    output_file = os.path.join(data_dir, 'paipu_list.csv')
+    def load(self):
+        """建立 uuid 索引（只读取 uuid、时间和房间，不排序、不重写）"""
+        self.index.clear()
+        for row in self._read_snapshot():
+            self.index[row['uuid']] = (row['start_time'], row.get('room'))
+        self.journal_count = 0
+        for row in self._read_journal():
+            self.index[row['uuid']] = (row['start_time'], row.get('room'))
+            self.journal_count += 1
+        return self
+
+    def upsert(self, items, upgrade_unknown=False):
+        """
+        不存在则插入；upgrade_unknown 为 True 时，还会覆盖已有的 room=Unknown 记录
+
+        items 可以是生成器：每攒够 STREAM_BUFFER 条就追加到日志，不会把全部数据留在内存中
+
+        Returns:
+            (新增条数, 更新条数)
+        """
+        new_count = 0
+        update_count = 0
+        pending = []
+        for item in items:
+            existing = self.index.get(item['uuid'])
+            if existing is None:
+                new_count += 1
+            elif upgrade_unknown and existing[1] == 'Unknown':
+                update_count += 1
+            else:
+                continue
+            self.index[item['uuid']] = (item['start_time'], item.get('room'))
+            pending.append({k: item.get(k) for k in self.FIELDNAMES})
+            if len(pending) >= STREAM_BUFFER:
+                self._append(pending)
+                pending = []
+
+        if pending:
+            self._append(pending)
+        return new_count, update_count
+
+    def _append(self, rows):
+        with open(self.journal_file, 'ab+') as f:
+            # 上次写入中断留下的半行没有换行符，先补上，避免与新记录粘在一起
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            for row in rows:
+                f.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_count += len(rows)
+
+    def _spill(self, rows):
+        """把一块日志按时间倒序写入临时文件，返回文件路径"""
+        path = f"{self.journal_file}.{len(self._spilled)}.sort.tmp"
+        rows.sort(key=lambda x: x['start_time'], reverse=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._spilled.append(path)
+        return path
+
+    @staticmethod
+    def _read_spill(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def compact(self, force=False):
+        """
+        把日志合并进快照；快照被其他程序（如Excel）占用时保留日志，下次再合并
+
+        日志按 STREAM_BUFFER 条分块排序后与快照（已按时间倒序）归并写出，内存中不需要同时放下全部数据。
+        同一 uuid 只保留与索引一致（即最后写入）的那一条，需先 load()
+        """
+        if not force and self.journal_count < COMPACT_THRESHOLD and os.path.exists(self.snapshot_file):
+            return False
+        if self.journal_count == 0 and os.path.exists(self.snapshot_file):
+            return False
+
+        self._spilled = []
+        tmp_file = self.snapshot_file + '.tmp'
+        try:
+            chunk = []
+            for row in self._read_journal():
+                chunk.append(row)
+                if len(chunk) >= STREAM_BUFFER:
+                    self._spill(chunk)
+                    chunk = []
+            chunk.sort(key=lambda x: x['start_time'], reverse=True)
+            sources = [self._read_snapshot(), chunk] + [self._read_spill(path) for path in self._spilled]
+
+            # 归并后同一时间的行相邻，只需记住当前时间已写出的 uuid
+            written, written_time = set(), None
+            with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDNAMES, extrasaction='ignore')
+                writer.writeheader()
+                for row in heapq.merge(*sources, key=lambda x: x['start_time'], reverse=True):
+                    uuid = row['uuid']
+                    if row['start_time'] != written_time:
+                        written, written_time = set(), row['start_time']
+                    if uuid in written or self.index.get(uuid) != (row['start_time'], row.get('room')):
+                        continue
+                    written.add(uuid)
+                    writer.writerow(row)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for path in self._spilled:
+                os.remove(path)
 
-    existing_count = 0
-    if os.path.exists(output_file):
         try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    all_data[row['uuid']] = row
-                    existing_count += 1
-            print(f"已有数据: {existing_count} 条", flush=True)
-        except Exception as e:
-            print(f"读取已有数据失败: {e}", flush=True)
+            os.replace(tmp_file, self.snapshot_file)
+        except PermissionError:
+            os.remove(tmp_file)
+            print(f"\n[警告] {self.snapshot_file} 被占用（请关闭 Excel 等程序），新数据已保存在日志中，下次运行时再合并", flush=True)
+            return False
 
-    # 添加API数据（优先级高，新增或覆盖room=Unknown的数据）
-    api_new_count = 0
-    api_update_count = 0
-    for item in api_data:
-        if item['uuid'] not in all_data:
-            all_data[item['uuid']] = item
-            api_new_count += 1
-        elif all_data[item['uuid']].get('room') == 'Unknown':
-            # 用完整的API数据覆盖不完整的网页数据
-            all_data[item['uuid']] = item
-            api_update_count += 1
+        # 快照已包含日志内容；即使删除前中断，下次重放日志也只会得到相同结果
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_count = 0
+        return True
 
+def merge_and_save(api_data, web_data, compact=False, data_dir=None):
+    """
+    合并去重并保存（追加模式，不删除已有数据）
+
+    Args:
+        api_data: API 牌谱行，可以是 iter_api_rows 生成器（边抓取边写入，不在内存中累积）
+        web_data: 网页牌谱行列表
+        compact: 为True时无论日志多少都合并进快照
+        data_dir: 数据目录，多玩家模式下为各玩家的分区
+
+    Returns:
+        (新增条数, 合并后总条数)
+    """
+    print("\n" + "="*60, flush=True)
+    print("合并数据并去重", flush=True)
+    print("="*60, flush=True)
+
+    store = PaipuStore(data_dir)
+    try:
+        store.load()
+        print(f"已有数据: {len(store.index)} 条（其中日志 {store.journal_count} 条）", flush=True)
+    except Exception as e:
+        print(f"读取已有数据失败: {e}", flush=True)
+        raise
+
+    # 添加API数据（优先级高，新增或覆盖room=Unknown的数据）
+    api_new_count, api_update_count = store.upsert(api_data, upgrade_unknown=True)
     # 添加网页数据（只添加新的）
-    web_new_count = 0
-    for item in web_data:
-        if item['uuid'] not in all_data:
-            all_data[item['uuid']] = item
-            web_new_count += 1
+    web_new_count, _ = store.upsert(web_data)
 
     print(f"API新增: {api_new_count} 条", flush=True)
     if api_update_count > 0:
         print(f"API更新: {api_update_count} 条（覆盖Unknown数据）", flush=True)
     print(f"网页新增: {web_new_count} 条", flush=True)
-    print(f"合并后总计: {len(all_data)} 条", flush=True)
-
-    # 按时间排序
-    merged_list = list(all_data.values())
-    merged_list.sort(key=lambda x: x['start_time'], reverse=True)
+    print(f"合并后总计: {len(store.index)} 条", flush=True)
 
-    # 尝试保存，如果文件被占用则提示
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            with open(output_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['uuid', 'paipu_url', 'start_time', 'score', 'rank', 'room'])
-                writer.writeheader()
-                writer.writerows(merged_list)
-
-            print(f"\n[成功] 已保存到: {output_file}", flush=True)
-            break
-        except PermissionError:
-            if attempt < max_retries - 1:
-                print(f"\n[警告] 文件被占用，请关闭 Excel 或其他程序中的 paipu_list.csv")
-                print(f"将在5秒后重试... ({attempt + 1}/{max_retries})")
-                time.sleep(5)
-            else:
-                print(f"\n[错误] 无法保存文件，请手动关闭以下文件后重新运行：")
-                print(f"  {output_file}")
-                print("\n提示：如果文件在 Excel 中打开，请先关闭 Excel")
-                raise
+    if store.compact(force=compact):
+        print(f"\n[成功] 已保存到: {store.snapshot_file}", flush=True)
+    else:
+        print(f"\n[成功] 已追加到: {store.journal_file}（{store.journal_count} 条待合并）", flush=True)
 
     # 统计
-    from collections import defaultdict
     month_count = defaultdict(int)
-    for item in merged_list:
-        month = item['start_time'][:7]
-        month_count[month] += 1
+    for start_time, _ in store.index.values():
+        month_count[start_time[:7]] += 1
 
     print("\n按月份统计:")
     for month in sorted(month_count.keys(), reverse=True)[:6]:
         print(f"  {month}: {month_count[month]} 条")
 
+    latest = heapq.nlargest(5, store.index.items(), key=lambda x: x[1][0])
     print(f"\n最新5条:")
-    for i, item in enumerate(merged_list[:5], 1):
-        print(f"  {i}. [{item['start_time']}] {item['uuid']}")
+    for i, (uuid, (start_time, _)) in enumerate(latest, 1):
+        print(f"  {i}. [{start_time}] {uuid}")
+
+    return api_new_count + web_new_count, len(store.index)
+
+def crawl_players(players, web_only=False, full=False, use_cache=True):
+    """
+    多玩家模式：所有玩家共用一个连接池和全局限速，并发抓取，数据写入 data/players/<player_id>/
+
+    Args:
+        players: 玩家档案列表（load_players）
+        web_only: 为True时只获取最近的数据
+        full: 为True时忽略水位线，全量重建
+    """
+    print("="*60)
+    print(f"雀魂牌谱爬虫（多玩家模式，共 {len(players)} 个玩家）")
+    print("="*60)
+
+    run_start = time.time()
+    cache = ResponseCache(refresh=full) if use_cache else None
+    client = ApiClient(session=create_session(MAX_WORKERS * PLAYER_WORKERS), cache=cache)
+
+    def run(player):
+        player_start = time.time()
+        data_dir = player_data_dir(player)
+        state_file = os.path.join(data_dir, 'crawl_state.json')
+        state = load_crawl_state(state_file)
+
+        api_stats = {}
+        if web_only:
+            api_data, web_data = [], crawl_recent_data(player=player, client=client, data_dir=data_dir) or []
+        else:
+            # 增量 API 抓取的时间段一直延伸到当前时间，已经包含最新数据；边抓取边写入存储
+            api_data = iter_api_rows(full=full, state=state, player=player, client=client, data_dir=data_dir,
+                                     stats=api_stats)
+            web_data = []
+
+        new_count, total = merge_and_save(api_data, web_data, compact=full, data_dir=data_dir)
+        if not web_only:
+            save_crawl_state(state, state_file)
+        return {
+            'fetched': api_stats.get('fetched', 0) + len(web_data),
+            'new': new_count,
+            'total': total,
+            'seconds': time.time() - player_start,
+        }
+
+    summaries = {}
+    try:
+        with ThreadPoolExecutor(max_workers=PLAYER_WORKERS) as executor:
+            futures = [(player, executor.submit(run, player)) for player in players]
+            for player, future in futures:
+                try:
+                    summaries[player['player_id']] = future.result()
+                except Exception as e:
+                    print(f"[错误] 玩家 {player['player_name']} 抓取失败: {e}", flush=True)
+                    summaries[player['player_id']] = None
+    finally:
+        client.close()
+
+    elapsed = time.time() - run_start
+    total_requests = sum(client.request_counts.values())
+    total_fetched = sum(s['fetched'] for s in summaries.values() if s)
 
-def main(web_only=False):
+    print("\n" + "="*60, flush=True)
+    print("多玩家运行汇总", flush=True)
+    print("="*60, flush=True)
+    for player in players:
+        summary = summaries.get(player['player_id'])
+        name = f"{player['player_name']} ({player['player_id']})"
+        if summary is None:
+            print(f"  {name}: 失败", flush=True)
+            continue
+        print(f"  {name}: 获取 {summary['fetched']} 条，新增 {summary['new']} 条，共 {summary['total']} 条，"
+              f"请求 {client.request_counts[player['player_id']]} 次，用时 {summary['seconds']:.1f} 秒", flush=True)
+    print(f"总计: {total_requests} 个请求，获取 {total_fetched} 条，用时 {elapsed:.1f} 秒", flush=True)
+    print(client.summary(), flush=True)
+    if elapsed > 0:
+        print(f"吞吐: {total_requests / elapsed:.2f} 请求/秒，{total_fetched / elapsed:.1f} 条/秒", flush=True)
+    if cache:
+        cache.prune()
+        print(cache.summary(), flush=True)
+
+def main(web_only=False, full=False, use_cache=True, use_browser=False, players_file=None):
     """
     主函数
 
     Args:
         web_only: 如果为True，只爬取网页数据（用于定时更新）
+        full: 如果为True，忽略水位线，重新获取全部API历史数据
+        use_cache: 如果为False，不使用API响应磁盘缓存
+        use_browser: 如果为True，最新数据直接用浏览器（Selenium）爬取
+        players_file: 多玩家配置文件（JSON），提供时进入多玩家模式
     """
+    if players_file:
+        crawl_players(load_players(players_file), web_only=web_only, full=full, use_cache=use_cache)
+        return
+
     if web_only:
         print("="*60)
         print("雀魂牌谱爬虫（仅网页最新数据）")
@@ -531,7 +1661,7 @@ def main(web_only=False):
 
         # 只执行网页爬取
         print("\n开始执行: 网页数据获取", flush=True)
-        web_data = crawl_web_data()
+        web_data = crawl_web_data(use_browser=use_browser)
         print(f"完成，获取到 {len(web_data)} 条数据", flush=True)
 
         # 合并保存
@@ -548,25 +1678,26 @@ def main(web_only=False):
         print("雀魂牌谱完整爬虫（API + 网页）")
         print("="*60)
 
-        # 步骤1: API历史数据
-        print("\n开始执行步骤1: API数据获取", flush=True)
-        api_data = crawl_api_data(limit=None)
-        print(f"步骤1完成，获取到 {len(api_data)} 条数据", flush=True)
+        # 步骤1: 网页最新数据（数据量小，先获取）
+        print("\n开始执行步骤1: 网页数据获取", flush=True)
+        web_data = crawl_web_data(use_browser=use_browser)
+        print(f"步骤1完成，获取到 {len(web_data)} 条数据", flush=True)
+
+        # 步骤2: API历史数据边抓取边写入存储，不在内存中保留整个历史
+        print("\n开始执行步骤2: API数据获取并合并保存", flush=True)
+        state = load_crawl_state()
+        api_stats = {}
+        api_rows = iter_api_rows(full=full, state=state, use_cache=use_cache, stats=api_stats)
+        merge_and_save(api_rows, web_data, compact=full)
 
-        # 步骤2: 网页最新数据
-        print("\n开始执行步骤2: 网页数据获取", flush=True)
-        web_data = crawl_web_data()
-        print(f"步骤2完成，获取到 {len(web_data)} 条数据", flush=True)
+        # 数据落盘后再保存水位线，避免保存失败时丢失数据
+        save_crawl_state(state)
 
         print(f"\n数据汇总：", flush=True)
-        print(f"  API获取: {len(api_data)} 条", flush=True)
+        print(f"  API获取: {api_stats.get('fetched', 0)} 条", flush=True)
         print(f"  网页获取: {len(web_data)} 条", flush=True)
 
-        # 步骤3: 合并保存
-        if api_data or web_data:
-            print("\n开始执行步骤3: 合并保存", flush=True)
-            merge_and_save(api_data, web_data)
-
+        if api_stats.get('fetched') or web_data:
             print("\n" + "="*60, flush=True)
             print("✓ 全部完成！", flush=True)
             print("="*60, flush=True)
@@ -579,10 +1710,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='雀魂牌谱爬虫')
     parser.add_argument('--web-only', action='store_true',
                         help='仅爬取网页最新数据（用于定时更新）')
+    parser.add_argument('--full', action='store_true',
+                        help='忽略水位线，重新获取全部API历史数据')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不使用API响应磁盘缓存')
+    parser.add_argument('--selenium', action='store_true',
+                        help='最新数据使用浏览器爬取（默认直接请求数据接口，失败时才回退到浏览器）')
+    parser.add_argument('--players', metavar='FILE',
+                        help='多玩家模式：玩家列表JSON文件（格式见 players.example.json）')
     args = parser.parse_args()
 
     try:
-        main(web_only=args.web_only)
+        main(web_only=args.web_only, full=args.full, use_cache=not args.no_cache,
+             use_browser=args.selenium, players_file=args.players)
         if not args.web_only:
             print("\n程序执行完成，3秒后退出...", flush=True)
             time.sleep(3)
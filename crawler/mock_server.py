@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟牌谱屋服务器：用合成数据提供 player_records 接口和仿网页表格，
+用于在不访问线上网站的情况下测试和压测 crawl_all.py
+
+用法:
+    python mock_server.py --players 11111:100,22222:10000 --latency 50 --error-rate 0.05
+"""
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+MODE_ROOMS = {16: 'Thr', 12: 'Jad', 9: 'Gld'}
+RANK_GLYPHS = ['１', '２', '３', '４']
+WEB_PAGE_SIZE = 50  # 仿网页每次滚动追加的行数
+
+
+def player_name(player_id):
+    """合成玩家的昵称"""
+    return f"Player{player_id}"
+
+
+def real_majsoul_id(player_id):
+    """合成玩家的雀魂友人ID（牌谱链接中的 _a 后缀）"""
+    return str(player_id)
+
+
+def make_records(player_id, count, modes=(16, 12), start=datetime(2020, 1, 1), end=None, seed=None):
+    """生成 count 条合成对局记录（字段与 player_records 接口一致），按 startTime 升序"""
+    rnd = random.Random(player_id if seed is None else seed)
+    start_ts = int(start.timestamp())
+    end_ts = int((end or datetime.now()).timestamp())
+    times = sorted(rnd.randint(start_ts, end_ts) for _ in range(count))
+
+    records = []
+    for i, start_time in enumerate(times):
+        scores = [rnd.randrange(-200, 800) * 100 for _ in range(4)]
+        players = [{
+            'accountId': player_id if seat == 0 else 900000000 + rnd.randrange(1000000),
+            'nickname': player_name(player_id) if seat == 0 else f"Opponent{seat}",
+            'level': 10601 + rnd.randrange(300),
+            'score': scores[seat],
+            'gradingScore': rnd.randrange(-200, 200),
+        } for seat in range(4)]
+        rnd.shuffle(players)
+        date = datetime.fromtimestamp(start_time).strftime('%y%m%d')
+        records.append({
+            '_id': f"{player_id}{i:07d}",
+            'modeId': rnd.choice(modes),
+            'uuid': f"{date}-{player_id:08d}-{i:04d}-4{i % 1000:03d}-8000-{rnd.randrange(16 ** 12):012x}",
+            'startTime': start_time,
+            'endTime': start_time + rnd.randrange(1200, 3600),
+            'players': players,
+        })
+    return records
+
+
+class MockServer:
+    """
+    模拟牌谱屋服务器
+
+    Args:
+        players: {player_id: 对局数}
+        latency: 每个请求的基础延迟（秒），实际延迟在 0.5~1.5 倍之间随机
+        page_limit: 接口每次最多返回的记录数（模拟100条截断）
+        error_rate: 随机返回 429/500/503 的概率，429/503 附带 Retry-After
+        retry_after: Retry-After 头的秒数
+        combined_modes: 接口是否接受合并的模式参数（如 mode=16,12）；为 False 时只按第一个模式返回
+    """
+
+    def __init__(self, players, latency=0.0, page_limit=100, error_rate=0.0, retry_after=1,
+                 combined_modes=True, host='127.0.0.1', port=0, seed=0):
+        self.records = {player_id: make_records(player_id, count) for player_id, count in players.items()}
+        # 每个玩家按时间升序的 startTime（毫秒），用于二分定位时间段
+        self.start_ms = {player_id: [r['startTime'] * 1000 for r in records]
+                         for player_id, records in self.records.items()}
+        self.latency = latency
+        self.page_limit = page_limit
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.combined_modes = combined_modes
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def expected_records(self, player_id, modes, since=None):
+        """某玩家在指定模式（和起始时间之后）的全部记录，用于计算完整度"""
+        return [r for r in self.records.get(player_id, [])
+                if r['modeId'] in modes and (since is None or r['startTime'] >= since)]
+
+    def _send(self, handler, status, body, content_type='application/json', headers=None):
+        data = body.encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', f"{content_type}; charset=utf-8")
+        handler.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+        with self.lock:
+            self.stats['bytes'] += len(data)
+
+    def handle(self, handler):
+        with self.lock:
+            self.stats['requests'] += 1
+            roll = self.rnd.random()
+            jitter = 0.5 + self.rnd.random()
+        if self.latency:
+            time.sleep(self.latency * jitter)
+
+        if roll < self.error_rate:
+            with self.lock:
+                self.stats['errors'] += 1
+            status = [429, 500, 503][int(roll / self.error_rate * 3) % 3]
+            headers = {'Retry-After': str(self.retry_after)} if status in (429, 503) else {}
+            self._send(handler, status, json.dumps({'error': 'injected'}), headers=headers)
+            return
+
+        url = urlparse(handler.path)
+        match = re.match(r'^/api/v2/pl4/player_records/(\d+)/(\d+)/(\d+)$', url.path)
+        if match:
+            self._send(handler, 200, json.dumps(self.player_records(url, *map(int, match.groups()))))
+            return
+
+        match = re.match(r'^/player/(\d+)/([\d.]+)$', url.path)
+        if match:
+            self._send(handler, 200, self.web_page(int(match.group(1)), match.group(2)), 'text/html')
+            return
+
+        match = re.match(r'^/web_rows/(\d+)/([\d.]+)$', url.path)
+        if match:
+            offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+            rows = self.web_rows(int(match.group(1)), match.group(2), offset)
+            self._send(handler, 200, json.dumps(rows))
+            return
+
+        self._send(handler, 404, json.dumps({'error': 'not found'}))
+
+    def player_records(self, url, player_id, start_ms, end_ms):
+        """与线上一致：按时间倒序，最多返回 page_limit 条"""
+        query = parse_qs(url.query)
+        modes = [int(m) for m in re.split(r'[.,]', query.get('mode', ['16'])[0]) if m]
+        modes = set(modes if self.combined_modes else modes[:1])
+        lo, hi = sorted((start_ms, end_ms))
+        times = self.start_ms.get(player_id, [])
+        records = self.records.get(player_id, [])
+        result = []
+        for i in range(bisect.bisect_left(times, hi) - 1, bisect.bisect_left(times, lo) - 1, -1):
+            if records[i]['modeId'] in modes:
+                result.append(records[i])
+                if len(result) >= self.page_limit:
+                    break
+        return result
+
+    def web_rows(self, player_id, mode, offset):
+        """仿网页表格的一页数据（按时间倒序）"""
+        modes = {int(m) for m in mode.split('.') if m}
+        records = [r for r in reversed(self.records.get(player_id, [])) if r['modeId'] in modes]
+        rows = []
+        for record in records[offset:offset + WEB_PAGE_SIZE]:
+            ranked = sorted(record['players'], key=lambda p: p['score'], reverse=True)
+            rank = next(i for i, p in enumerate(ranked) if p['accountId'] == player_id)
+            me = ranked[rank]
+            rows.append({
+                'room': MODE_ROOMS.get(record['modeId'], 'Unk'),
+                'rank': RANK_GLYPHS[rank],
+                'time': datetime.fromtimestamp(record['startTime']).strftime('%Y/%m/%d %H:%M'),
+                'players': ' '.join(f"[Ex1] {p['nickname']} [{p['score']}]" for p in ranked),
+                'links': [f"https://mahjongsoul.game.yo-star.com/?paipu={record['uuid']}_a"
+                          f"{real_majsoul_id(p['accountId']) if p is me else p['accountId']}"
+                          for p in ranked],
+            })
+        return rows
+
+    def web_page(self, player_id, mode):
+        """仿牌谱屋玩家页：表格由脚本异步渲染，滚动到底部时继续追加"""
+        return WEB_PAGE_TEMPLATE.replace('__PLAYER__', str(player_id)).replace('__MODE__', mode)
+
+
+WEB_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>mock player page</title></head>
+<body>
+<div id="table" role="grid" style="min-height: 120vh"></div>
+<script>
+let offset = 0, loading = false, done = false;
+async function more() {
+    if (loading || done) return;
+    loading = true;
+    const rows = await (await fetch(`/web_rows/__PLAYER__/__MODE__?offset=${offset}`)).json();
+    done = rows.length === 0;
+    offset += rows.length;
+    const table = document.getElementById('table');
+    for (const r of rows) {
+        const row = document.createElement('div');
+        row.setAttribute('role', 'row');
+        row.innerHTML = `<div aria-colindex="1" title="${r.room}">${r.room}</div>`
+            + `<div aria-colindex="2"><div class="MuiBox-root css-9p3m8i">${r.rank}</div></div>`
+            + `<div aria-colindex="3">${r.players}</div>`
+            + `<div aria-colindex="4">${r.time}</div>`
+            + r.links.map(href => `<a href="${href}">paipu</a>`).join(' ');
+        row.style.height = '40px';
+        table.appendChild(row);
+    }
+    loading = false;
+}
+window.addEventListener('scroll', () => {
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 10) more();
+});
+setTimeout(more, 300);
+</script>
+</body></html>
+"""
+
+
+def parse_players(text):
+    """解析 '11111:100,22222:10000' 形式的玩家配置"""
+    players = {}
+    for item in text.split(','):
+        player_id, count = item.split(':')
+        players[int(player_id)] = int(count)
+    return players
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地模拟牌谱屋服务器')
+    parser.add_argument('--players', default='11111:100,22222:1000,33333:10000',
+                        help='玩家ID:对局数，逗号分隔（默认: %(default)s）')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的基础延迟（毫秒）')
+    parser.add_argument('--page-limit', type=int, default=100, help='接口每次最多返回的记录数')
+    parser.add_argument('--error-rate', type=float, default=0, help='随机返回 429/5xx 的概率')
+    parser.add_argument('--no-combined-mode', action='store_true',
+                        help='模拟不接受合并模式参数的接口（只按第一个模式返回）')
+    args = parser.parse_args()
+
+    server = MockServer(parse_players(args.players), latency=args.latency / 1000,
+                        page_limit=args.page_limit, error_rate=args.error_rate,
+                        combined_modes=not args.no_combined_mode, port=args.port)
+    print(f"模拟服务器已启动: {server.url}")
+    for player_id, records in server.records.items():
+        print(f"  玩家 {player_id}（{player_name(player_id)}，友人ID {real_majsoul_id(player_id)}）: {len(records)} 局")
+        print(f"    接口: {server.url}/api/v2/pl4/player_records/{player_id}/<start_ms>/<end_ms>?mode=16")
+        print(f"    网页: {server.url}/player/{player_id}/16.12")
+    print("按 Ctrl+C 停止")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+crawl_all.py 的测试：在本地模拟服务器（mock_server.py）上运行，不访问线上网站
+
+用法:
+    python -m unittest test_crawl_all -v
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import crawl_all
+from mock_server import MockServer, make_records
+
+
+class TokenBucketTest(unittest.TestCase):
+    """令牌桶限速：任意时长 T 内最多放行 capacity + rate*T 个请求"""
+
+    RATE = 5
+    BURST = 2
+    REQUESTS = 20
+
+    def setUp(self):
+        self.server = MockServer({11111: 1000}).start()
+        self.api_base = crawl_all.API_BASE
+        crawl_all.API_BASE = self.server.url
+        self.limiter = crawl_all.TokenBucket(self.RATE, self.BURST)
+        self.client = crawl_all.ApiClient(limiter=self.limiter)
+
+    def tearDown(self):
+        self.client.close()
+        crawl_all.API_BASE = self.api_base
+        self.server.stop()
+
+    def min_duration(self):
+        return (self.REQUESTS - self.BURST) / self.RATE
+
+    def fetch(self, i):
+        end_ms = int(time.time() * 1000) - i * 86400 * 1000
+        return self.client.get_records(11111, 16, end_ms - 86400 * 1000, end_ms)
+
+    def test_sequential_requests_hold_rate(self):
+        start = time.monotonic()
+        results = [self.fetch(i) for i in range(self.REQUESTS)]
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(records is not None for records in results))
+        self.assertEqual(self.server.stats['requests'], self.REQUESTS)
+        self.assertGreaterEqual(elapsed, self.min_duration())
+
+    def test_concurrent_requests_hold_rate(self):
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=crawl_all.MAX_WORKERS * 2) as executor:
+            results = list(executor.map(self.fetch, range(self.REQUESTS)))
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(records is not None for records in results))
+        self.assertEqual(self.server.stats['requests'], self.REQUESTS)
+        self.assertEqual(self.limiter.acquired, self.REQUESTS)
+        self.assertGreaterEqual(elapsed, self.min_duration())
+
+    def test_burst_is_not_throttled(self):
+        start = time.monotonic()
+        for _ in range(self.BURST):
+            self.limiter.acquire()
+        self.assertLess(time.monotonic() - start, 1 / self.RATE)
+
+
+class StubClient:
+    """按时间段返回预设结果的客户端：responses(start_ms, end_ms) 返回记录列表，None 表示请求失败"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.request_counts = defaultdict(int)
+        self.cache = None
+
+    def get_records(self, player_id, mode, start_ms, end_ms):
+        self.request_counts[player_id] += 1
+        return self.responses(start_ms, end_ms)
+
+
+class FirstGameTest(unittest.TestCase):
+    """二分查找第一局：请求失败时不能把区间起点当作第一局记入状态"""
+
+    def test_failed_request_is_not_complete(self):
+        calls = []
+
+        def responses(start_ms, end_ms):
+            calls.append((start_ms, end_ms))
+            return [{'startTime': 100}] * crawl_all.API_PAGE_LIMIT if len(calls) == 1 else None
+
+        first_ms, complete = crawl_all.find_first_game(StubClient(responses), 1, 16, 0, 10 ** 12)
+        self.assertEqual(first_ms, 0)
+        self.assertFalse(complete)
+
+    def test_found_first_game_is_complete(self):
+        records = [{'startTime': 5000}, {'startTime': 7000}]
+        first_ms, complete = crawl_all.find_first_game(StubClient(lambda s, e: records), 1, 16, 0, 10 ** 12)
+        self.assertEqual(first_ms, 4999 * 1000)
+        self.assertTrue(complete)
+
+    def test_no_games(self):
+        self.assertEqual(crawl_all.find_first_game(StubClient(lambda s, e: []), 1, 16, 0, 10 ** 12), (None, True))
+
+    def test_failed_search_is_not_persisted(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, True)
+        player = {'player_id': 1, 'player_name': 'P', 'real_majsoul_id': '1', 'mode': 16}
+        state = {}
+        rows = list(crawl_all.iter_api_rows(state=state, player=player, client=StubClient(lambda s, e: None),
+                                            data_dir=data_dir))
+        self.assertEqual(rows, [])
+        self.assertEqual(state['first_game'], {})
+        self.assertTrue(state['failed_windows'])
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """只有结束超过 API_LAG_DAYS 天的时间段才永久缓存；--full 重建时不直接信任缓存"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        self.server = MockServer({11111: 1000}).start()
+        self.addCleanup(self.server.stop)
+        api_base = crawl_all.API_BASE
+        crawl_all.API_BASE = self.server.url
+        self.addCleanup(setattr, crawl_all, 'API_BASE', api_base)
+        self.now = time.time()
+
+    def fetch(self, days_ago, refresh=False):
+        client = crawl_all.ApiClient(limiter=crawl_all.TokenBucket(1000, 100),
+                                     cache=crawl_all.ResponseCache(self.cache_dir, refresh=refresh))
+        end_ms = int((self.now - days_ago * 86400) * 1000)
+        records = client.get_records(11111, 16, end_ms - 30 * 86400 * 1000, end_ms)
+        client.close()
+        return records, client.cache.stats
+
+    def stored_entries(self):
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                with open(os.path.join(root, name), 'r', encoding='utf-8') as f:
+                    entries.append(json.load(f))
+        return entries
+
+    def test_window_inside_api_lag_is_not_permanent(self):
+        self.fetch(crawl_all.WATERMARK_OVERLAP_DAYS + 3)
+        [entry] = self.stored_entries()
+        self.assertIsNotNone(entry['expires_at'])
+
+    def test_entry_from_old_rule_is_revalidated(self):
+        self.fetch(crawl_all.API_LAG_DAYS + 1)
+        [entry] = self.stored_entries()
+        self.assertIsNone(entry['expires_at'])
+        cache = crawl_all.ResponseCache(self.cache_dir)
+        body, found = cache.get(entry['url'], entry['params'])
+        self.assertEqual(body, entry['body'])
+        # 按旧规则写入的永久条目（没有 lag_days）需要重新验证
+        del entry['lag_days']
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+                    json.dump(entry, f)
+        body, found = cache.get(entry['url'], entry['params'])
+        self.assertIsNone(body)
+        self.assertIsNotNone(found)
+
+    def test_old_window_is_permanent_but_full_refreshes(self):
+        records, _ = self.fetch(crawl_all.API_LAG_DAYS + 1)
+        _, stats = self.fetch(crawl_all.API_LAG_DAYS + 1)
+        self.assertEqual(stats['hit'], 1)
+        self.assertEqual(self.server.stats['requests'], 1)
+
+        refreshed, stats = self.fetch(crawl_all.API_LAG_DAYS + 1, refresh=True)
+        self.assertEqual(stats['hit'], 0)
+        self.assertEqual(self.server.stats['requests'], 2)
+        self.assertEqual(refreshed, records)
+
+
+def paipu_row(i, room='Throne'):
+    return {'uuid': f'uuid-{i:03d}', 'paipu_url': f'paipu-{i}', 'start_time': f'2024-01-01 {i // 60:02d}:{i % 60:02d}:00',
+            'score': '25000', 'rank': '2', 'room': room}
+
+
+class PaipuStoreTest(unittest.TestCase):
+    """paipu_list 存储：日志追加、Unknown 房间升级、分块排序合并"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, True)
+
+    def store(self):
+        return crawl_all.PaipuStore(self.data_dir).load()
+
+    def snapshot(self):
+        with open(os.path.join(self.data_dir, 'paipu_list.csv'), 'r', encoding='utf-8') as f:
+            return list(crawl_all.csv.DictReader(f))
+
+    def test_upgrade_unknown_room(self):
+        store = self.store()
+        store.upsert([paipu_row(1, 'Unknown'), paipu_row(2, 'Jade')])
+        # 不升级时已有记录保持不变
+        self.assertEqual(store.upsert([paipu_row(1), paipu_row(2)]), (0, 0))
+        self.assertEqual(store.upsert([paipu_row(1), paipu_row(2), paipu_row(3)], upgrade_unknown=True), (1, 1))
+
+        store = self.store()
+        self.assertEqual(store.index['uuid-001'][1], 'Throne')
+        self.assertEqual(store.index['uuid-002'][1], 'Jade')
+        store.compact(force=True)
+        rooms = {row['uuid']: row['room'] for row in self.snapshot()}
+        self.assertEqual(rooms, {'uuid-001': 'Throne', 'uuid-002': 'Jade', 'uuid-003': 'Throne'})
+
+    def test_torn_last_journal_line(self):
+        store = self.store()
+        store.upsert([paipu_row(1)])
+        line = json.dumps(paipu_row(2))
+        with open(store.journal_file, 'a', encoding='utf-8') as f:
+            f.write(line[:len(line) // 2])
+
+        store = self.store()
+        self.assertEqual(set(store.index), {'uuid-001'})
+        store.upsert([paipu_row(3)])
+        store = self.store()
+        self.assertEqual(set(store.index), {'uuid-001', 'uuid-003'})
+        self.assertEqual(store.journal_count, 2)
+
+    def test_compact_dedups_and_orders_across_spill_files(self):
+        with mock.patch.object(crawl_all, 'STREAM_BUFFER', 3):
+            store = self.store()
+            store.upsert(paipu_row(i) for i in range(0, 20, 2))
+            store.compact(force=True)
+            # 新对局与快照交错、日志中同一 uuid 出现多次（Unknown 后被升级），分成多个分块排序
+            store = self.store()
+            store.upsert((paipu_row(i, 'Unknown') for i in range(1, 20, 2)))
+            store.upsert((paipu_row(i) for i in range(1, 20, 4)), upgrade_unknown=True)
+            store = self.store()
+            self.assertGreater(store.journal_count, 3 * 2)
+            spilled = []
+            real_spill = store._spill
+            with mock.patch.object(store, '_spill', side_effect=lambda rows: spilled.append(real_spill(rows))):
+                self.assertTrue(store.compact(force=True))
+            self.assertGreater(len(spilled), 1)
+
+        rows = self.snapshot()
+        self.assertEqual([row['uuid'] for row in rows], [f'uuid-{i:03d}' for i in range(19, -1, -1)])
+        rooms = {row['uuid']: row['room'] for row in rows}
+        self.assertEqual(rooms['uuid-001'], 'Throne')
+        self.assertEqual(rooms['uuid-003'], 'Unknown')
+        self.assertFalse(os.path.exists(store.journal_file))
+        self.assertEqual([name for name in os.listdir(self.data_dir) if name.endswith('.tmp')], [])
+
+    def test_locked_snapshot_keeps_journal(self):
+        store = self.store()
+        store.upsert([paipu_row(1)])
+        store.compact(force=True)
+        store = self.store()
+        store.upsert([paipu_row(2)])
+        with mock.patch.object(crawl_all.os, 'replace', side_effect=PermissionError):
+            self.assertFalse(store.compact(force=True))
+
+        self.assertEqual([row['uuid'] for row in self.snapshot()], ['uuid-001'])
+        self.assertTrue(os.path.exists(store.journal_file))
+        self.assertEqual(set(self.store().index), {'uuid-001', 'uuid-002'})
+        self.assertTrue(self.store().compact(force=True))
+        self.assertEqual([row['uuid'] for row in self.snapshot()], ['uuid-002', 'uuid-001'])
+
+
+class RecordsToRowsTest(unittest.TestCase):
+    """批量转换与逐条转换结果一致（同分、找不到本玩家、座位数不同）"""
+
+    @unittest.skipIf(crawl_all.np is None, "需要 numpy")
+    def test_vectorized_matches_loop(self):
+        player = {'player_id': 1, 'player_name': 'P', 'real_majsoul_id': '9', 'mode': 16}
+
+        def seat(account_id, score):
+            return {'accountId': account_id, 'score': score}
+
+        records = [
+            {'uuid': 'tie-after', 'modeId': 16, 'startTime': 1700000000,
+             'players': [seat(2, 300), seat(3, 300), seat(1, 300), seat(4, 100)]},
+            {'uuid': 'tie-before', 'modeId': 12, 'startTime': 1700000100,
+             'players': [seat(1, 200), seat(2, 200), seat(3, 500), seat(4, -100)]},
+            {'uuid': 'missing', 'modeId': 9, 'startTime': 1700000200, 'players': [seat(2, 1), seat(3, 2)]},
+            {'uuid': 'three-seats', 'modeId': 99, 'startTime': 1700000300,
+             'players': [seat(2, 0), seat(1, -5), seat(3, -5)]},
+            {'uuid': 'no-players', 'startTime': 1700000400},
+            {'modeId': 16, 'players': []},
+        ] * 3
+        records += make_records(1, 500)
+        expected = [row for row in (crawl_all.record_to_row(r, player) for r in records) if row]
+        with mock.patch.object(crawl_all, 'VECTORIZE_MIN_ROWS', 0):
+            self.assertEqual(crawl_all.records_to_rows(records, player), expected)
+        self.assertEqual([row['rank'] for row in expected[:4]], [3, 2, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()